@@ -0,0 +1,98 @@
+"""
+Benchmark of pandas_df_from_dataset against the loaders previously used in plot_inefficiently.py,
+which are kept here only as baselines.
+"""
+import argparse
+import concurrent.futures
+import json
+from pathlib import Path
+from time import time
+import numpy as np
+import pandas as pd
+
+from parquet_loader import pandas_df_from_dataset
+from parquet_loader import abs_less
+
+
+def pandas_df_from_parquet(input_dir, columns):
+    df = pd.DataFrame()
+    for file in Path(input_dir).glob("*.parquet"):
+        df_tmp = pd.read_parquet(file, columns=columns)
+        df = pd.concat([df, df_tmp], ignore_index=True)
+    return df
+
+
+def pandas_df_from_parquet_parallel(input_dir, columns):
+    df = pd.DataFrame()
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        futures = [
+            executor.submit(pd.read_parquet, file, columns=columns)
+            for file in Path(input_dir).glob("*.parquet")
+        ]
+        df = pd.concat(
+            [f.result() for f in concurrent.futures.as_completed(futures)],
+            ignore_index=True,
+        )
+    return df
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the parquet loaders")
+
+    parser.add_argument(
+        "--input-dir",
+        type=str,
+        default="/work/gallim/devel/HiggsDNA_studies/tnp/official_parquet_output/DYJetsToLL_M-50_TuneCP5_13TeV-amcatnloFXFX-pythia8",
+    )
+
+    parser.add_argument("--n-repeat", type=int, default=3)
+
+    return parser.parse_args()
+
+
+def timed(func, n_repeat):
+    times = []
+    for _ in range(n_repeat):
+        start = time()
+        df = func()
+        times.append(time() - start)
+    return df, min(times)
+
+
+def main(args):
+    with open("var_specs.json", "r") as f:
+        columns = [dct["name"] for dct in json.load(f)]
+
+    loaders = {
+        "pd.concat in loop": lambda: pandas_df_from_parquet(args.input_dir, columns),
+        "process pool": lambda: pandas_df_from_parquet_parallel(args.input_dir, columns),
+        "pyarrow dataset": lambda: pandas_df_from_dataset(args.input_dir, columns),
+        "pyarrow dataset float32": lambda: pandas_df_from_dataset(args.input_dir, columns, downcast=True),
+    }
+
+    results = {}
+    for name, loader in loaders.items():
+        df, best = timed(loader, args.n_repeat)
+        results[name] = df
+        print(
+            "{:<30} {:8.2f} s {:10.1f} MB/s ({} rows)".format(
+                name, best, df.memory_usage(deep=True).sum() / 1.e6 / best, len(df)
+            )
+        )
+
+    # The sequential loader reads the files in glob order, the dataset in sorted order
+    reference = results["pd.concat in loop"].sort_values(columns).reset_index(drop=True)
+    candidate = results["pyarrow dataset"].sort_values(columns).reset_index(drop=True)
+    pd.testing.assert_frame_equal(reference, candidate)
+    print("pyarrow dataset output matches the sequential loader")
+
+    # Predicate pushdown
+    start = time()
+    df_eb = pandas_df_from_dataset(args.input_dir, columns, filter=abs_less("probe_eta", 1.4442))
+    print("{:<30} {:8.2f} s ({} rows)".format("pyarrow dataset EB filter", time() - start, len(df_eb)))
+    assert len(df_eb) == np.sum(np.abs(reference["probe_eta"]) < 1.4442)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(args)
@@ -0,0 +1,120 @@
+"""
+Reweighting of MC to data with a classifier trained to separate the two
+(see https://github.com/maxgalli/qRC/blob/TO_MERGE/quantile_regression_chain/syst/qRC_systematics.py#L91-L107):
+the weight of an MC event is p(data) / p(MC) as predicted by the classifier.
+
+Trained classifiers are cached with XGBoost's own model format in files whose name contains a hash of
+everything the training depends on (features, cut, hyperparameters and input files), so that a cached
+model is never reused after one of them changed.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from time import time
+import numpy as np
+import xgboost as xgb
+from sklearn.utils import shuffle
+
+
+default_features = ["probe_pt", "probe_fixedGridRhoAll", "probe_eta", "probe_phi"]
+
+default_hyperparameters = {
+    "learning_rate": 0.05,
+    "n_estimators": 500,
+    "max_depth": 10,
+    "gamma": 0,
+    "tree_method": "hist",
+}
+
+
+def files_fingerprint(input_files):
+    """List of (name, size, modification time) of the input files, in a reproducible order."""
+    fingerprint = []
+    for fl in sorted(str(f) for f in input_files):
+        stat = os.stat(fl)
+        fingerprint.append([fl, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def model_hash(features, cut, hyperparameters, input_files, max_train_events):
+    config = {
+        "features": list(features),
+        "cut": cut,
+        "hyperparameters": hyperparameters,
+        "max_train_events": max_train_events,
+        "xgboost": xgb.__version__,
+        "input_files": files_fingerprint(input_files),
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def probability_ratio(clf, X, eps=1.e-3):
+    """p(data) / (p(MC) + eps) for every row of X, computed on the whole predict_proba output at once."""
+    proba = clf.predict_proba(X)
+    return proba[:, 1] / (proba[:, 0] + eps)
+
+
+def train_classifier(df_mc, df_data, features, cut, hyperparameters, n_jobs, max_train_events=1000000, random_state=None):
+    if cut is not None:
+        # Evaluated only once per dataframe
+        df_mc = df_mc.query(cut, engine="numexpr")
+        df_data = df_data.query(cut, engine="numexpr")
+    n_events = min(df_mc.index.size, df_data.index.size, max_train_events)
+    X_data = df_data.sample(n_events, random_state=random_state).loc[:, features].values
+    X_mc = df_mc.sample(n_events, random_state=random_state).loc[:, features].values
+    X = np.vstack([X_data, X_mc])
+    y = np.concatenate([np.ones(X_data.shape[0]), np.zeros(X_mc.shape[0])])
+    X, y = shuffle(X, y, random_state=random_state)
+
+    clf = xgb.XGBClassifier(n_jobs=n_jobs, **hyperparameters)
+    start = time()
+    clf.fit(X, y)
+    print("Classifier trained in {:.2f} seconds".format(time() - start))
+
+    return clf
+
+
+def clf_reweight(
+    df_mc,
+    df_data,
+    clf_name,
+    input_files=(),
+    n_jobs=None,
+    cut=None,
+    features=None,
+    hyperparameters=None,
+    cache_dir=".",
+    max_train_events=1000000,
+    random_state=None,
+):
+    """
+    Return the classifier weights of the events in df_mc.
+    The classifier is trained on (at most max_train_events) events of df_mc and df_data passing cut,
+    unless a model trained with the same configuration on the same input_files is found in cache_dir.
+    n_jobs defaults to the number of cores of the machine.
+    """
+    if features is None:
+        features = default_features
+    if hyperparameters is None:
+        hyperparameters = default_hyperparameters
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+
+    model_file = Path(cache_dir) / "{}_{}.json".format(
+        clf_name, model_hash(features, cut, hyperparameters, input_files, max_train_events)
+    )
+    if model_file.is_file():
+        clf = xgb.XGBClassifier(n_jobs=n_jobs)
+        clf.load_model(model_file)
+        print("Loaded classifier from file {}".format(model_file))
+    else:
+        clf = train_classifier(df_mc, df_data, features, cut, hyperparameters, n_jobs, max_train_events, random_state)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that an interrupted job does not leave a broken model
+        tmp_file = model_file.with_suffix(".tmp.json")
+        clf.save_model(tmp_file)
+        os.replace(tmp_file, model_file)
+        print("Saved classifier to file {}".format(model_file))
+
+    return probability_ratio(clf, df_mc.loc[:, features].values)
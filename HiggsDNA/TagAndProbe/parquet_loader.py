@@ -0,0 +1,51 @@
+"""
+Loading of the HiggsDNA parquet outputs as a single pyarrow dataset.
+
+Compared to reading the files one by one with pandas:
+- only the requested columns are decoded;
+- simple predicates (e.g. abs(probe_eta) < 1.4442) are pushed down, so that row groups whose
+  statistics do not satisfy them are skipped and the others are filtered before the conversion to pandas;
+- files and row groups are read by a pool of threads;
+- the files are sorted, so that the order of the rows is the same in every run.
+"""
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+def abs_less(column, value):
+    """Expression for abs(column) < value, written without abs so that it can use the row group statistics."""
+    return (ds.field(column) < value) & (ds.field(column) > -value)
+
+
+def abs_greater(column, value):
+    """Expression for abs(column) > value, written without abs so that it can use the row group statistics."""
+    return (ds.field(column) > value) | (ds.field(column) < -value)
+
+
+def downcast_floats(table):
+    """Cast the float64 columns of table to float32."""
+    schema = pa.schema(
+        [
+            field.with_type(pa.float32()) if pa.types.is_float64(field.type) else field
+            for field in table.schema
+        ]
+    )
+    return table.cast(schema)
+
+
+def pandas_df_from_dataset(input_dir, columns=None, filter=None, downcast=False, use_threads=True):
+    """
+    Read the parquet files in input_dir as one dataframe with the given columns (all if None) and the rows
+    passing filter (a pyarrow.dataset expression, see abs_less and abs_greater).
+    If downcast is True, float64 columns are converted to float32.
+    """
+    files = sorted(str(f) for f in Path(input_dir).glob("*.parquet"))
+    if not files:
+        raise FileNotFoundError("No parquet files in {}".format(input_dir))
+    dataset = ds.dataset(files, format="parquet")
+    table = dataset.to_table(columns=columns, filter=filter, use_threads=use_threads)
+    if downcast:
+        table = downcast_floats(table)
+
+    return table.to_pandas(use_threads=use_threads)
@@ -0,0 +1,54 @@
+"""
+Frames partitioned in detector regions (EB, EE and the gap between them).
+
+The region of every row is computed only once and the rows are sorted by region (keeping the
+original order inside each region), so that every region is a contiguous block which is served as a
+slice of the sorted frame instead of a copy made with a boolean mask.
+Works with pandas dataframes and with awkward (or numpy) arrays.
+"""
+import numpy as np
+
+
+eb_max_eta = 1.4442
+ee_min_eta = 1.56
+region_names = ["EB", "EE", "gap"]
+
+
+def eta_region(eta, eb_max=eb_max_eta, ee_min=ee_min_eta):
+    """Index in region_names of every value of eta."""
+    abs_eta = np.abs(np.asarray(eta))
+    return np.where(abs_eta < eb_max, 0, np.where(abs_eta > ee_min, 1, 2)).astype(np.int8)
+
+
+class PartitionedFrame:
+    def __init__(self, frame, labels, names=region_names):
+        labels = np.asarray(labels)
+        self.names = list(names)
+        self.order = np.argsort(labels, kind="stable")
+        self.labels = labels[self.order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(self.names)))])
+        self.is_pandas = hasattr(frame, "iloc")
+        self.frame = frame.take(self.order) if self.is_pandas else frame[self.order]
+
+    def bounds(self, name):
+        i = self.names.index(name)
+        return self.offsets[i], self.offsets[i + 1]
+
+    def __getitem__(self, name):
+        start, stop = self.bounds(name)
+        if self.is_pandas:
+            return self.frame.iloc[start:stop]
+        return self.frame[start:stop]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def sizes(self):
+        return {name: int(self.offsets[i + 1] - self.offsets[i]) for i, name in enumerate(self.names)}
+
+    def assign(self, column, name, values):
+        """Set column (created with NaN if missing) to values for the rows of region name (pandas only)."""
+        if column not in self.frame.columns:
+            self.frame[column] = np.nan
+        start, stop = self.bounds(name)
+        self.frame.iloc[start:stop, self.frame.columns.get_loc(column)] = values
@@ -0,0 +1,138 @@
+"""
+Batched plotting backend for the data/MC comparisons.
+
+All the histograms are computed up front: for every variable the bin index of each event is computed
+only once (np.digitize) and the histograms of all the subdetectors are then filled together with a
+single np.bincount on (subdetector, bin). The figures, which only need the bin contents, are then drawn
+and saved by a pool of processes using the Agg backend.
+"""
+import concurrent.futures
+import numpy as np
+
+
+def bin_index(values, edges):
+    """Bin of each value as np.histogram would assign it (0 is underflow, len(edges) is overflow,
+    the upper edge belongs to the last bin)."""
+    idx = np.digitize(values, edges)
+    idx[values == edges[-1]] = len(edges) - 1
+    return idx
+
+
+def compute_histograms(df, vars_config, categories, n_categories, weights=None):
+    """
+    Return a dictionary name -> (edges, counts) where counts has shape (n_categories, bins):
+    categories is an integer array with the category (e.g. subdetector) of every event,
+    events with a category outside [0, n_categories) are ignored.
+    """
+    categories = np.asarray(categories)
+    valid = (categories >= 0) & (categories < n_categories)
+    if weights is not None:
+        weights = np.asarray(weights)[valid]
+    categories = categories[valid]
+
+    histograms = {}
+    for var_conf in vars_config:
+        name = var_conf["name"]
+        bins = var_conf["bins"]
+        edges = np.linspace(var_conf["range"][0], var_conf["range"][1], bins + 1)
+        idx = bin_index(df[name].values[valid], edges)
+        flat = categories * (bins + 2) + idx
+        counts = np.bincount(flat, weights=weights, minlength=n_categories * (bins + 2))
+        histograms[name] = (edges, counts.reshape(n_categories, bins + 2)[:, 1:-1])
+
+    return histograms
+
+
+def density(counts, edges):
+    """Normalize like np.histogram(..., density=True)."""
+    return counts / counts.sum() / np.diff(edges)
+
+
+def render_figure(job):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import mplhep as hep
+
+    hep.style.use("CMS")
+
+    name = job["name"]
+    subdetector = job["subdetector"]
+    edges = job["edges"]
+    data_hist = job["data_hist"]
+    mc_hist = job["mc_hist"]
+    output_dir = job["output_dir"]
+
+    fig, (up, down) = plt.subplots(
+        nrows=2,
+        ncols=1,
+        gridspec_kw={"height_ratios": (2, 1)},
+        sharex=True,
+    )
+    centers = (edges[1:] + edges[:-1]) / 2
+    up.plot(
+        centers,
+        data_hist,
+        label=f"{name} - Data - {subdetector}",
+        color="k",
+        marker="o",
+        linestyle="",
+    )
+    up.hist(
+        centers,
+        bins=edges,
+        weights=mc_hist,
+        histtype="step",
+        label=f"{name} - MC - {subdetector}",
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        down.plot(
+            centers,
+            100 * (data_hist - mc_hist) / mc_hist,
+            color="k",
+            marker="o",
+            linestyle="",
+        )
+
+    down.set_xlabel(job["x_label"])
+    up.set_ylabel("Events")
+    down.set_ylabel("(Data - MC) / MC")
+    down.set_ylim(-10, 10)
+    up.legend()
+    fig.savefig(output_dir + "/" + name + "_" + subdetector + ".pdf", bbox_inches="tight")
+    fig.savefig(output_dir + "/" + name + "_" + subdetector + ".png", bbox_inches="tight")
+    plt.close(fig)
+
+    return name, subdetector
+
+
+def plot_all(data_df, mc_df, vars_config, data_categories, mc_categories, category_names, output_dir, mc_weights=None, n_workers=None):
+    """Compute the normalized data and MC histograms of every variable in every category and draw them in parallel."""
+    n_categories = len(category_names)
+    print("Computing histograms...")
+    data_histograms = compute_histograms(data_df, vars_config, data_categories, n_categories)
+    mc_histograms = compute_histograms(mc_df, vars_config, mc_categories, n_categories, mc_weights)
+
+    jobs = []
+    for var_conf in vars_config:
+        name = var_conf["name"]
+        edges, data_counts = data_histograms[name]
+        _, mc_counts = mc_histograms[name]
+        for i, subdetector in enumerate(category_names):
+            jobs.append(
+                {
+                    "name": name,
+                    "x_label": var_conf["x_label"],
+                    "subdetector": subdetector,
+                    "edges": edges,
+                    "data_hist": density(data_counts[i], edges),
+                    "mc_hist": density(mc_counts[i], edges),
+                    "output_dir": output_dir,
+                }
+            )
+
+    print("Drawing {} figures...".format(len(jobs)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for name, subdetector in executor.map(render_figure, jobs):
+            print("Plotted variable: {} - {}".format(name, subdetector))
@@ -1,26 +1,90 @@
 from quantile_regression_chain import quantileRegression_chain as qRC
 from quantile_regression_chain import quantileRegression_chain_disc as qRCd
 import numpy as np
+import pandas as pd
+import os
+import time
 import yaml
-from distributed import LocalCluster, Client
-from dask_jobqueue import SLURMCluster
+from distributed import LocalCluster, Client, performance_report
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
 import argparse
 
+from qrc_config import qrc_columns
+from tnp_to_parquet import write_dataframe
+from tnp_to_parquet import DataFrameAppender
+from tnp_to_parquet import count_entries
+from tnp_to_parquet import available_columns
+from tnp_to_parquet import read_rows
+
 
 import logging
 logger = logging.getLogger("")
 
 
+year = '2018'
+workDir = '/work/gallim/dataframes/2018'
+weightsDirs = '/work/gallim/weights/2018_mc_full_dask'
+
+# Inputs are read from the Parquet files written by tnp_to_parquet.py when they exist, from HDF5 otherwise
+inputs = {
+        'EB': {'data': 'df_data_EB_test', 'mc': 'df_mc_EB_test'},
+        'EE': {'data': 'df_data_EE_test', 'mc': 'df_mc_EE_test'}
+        }
+
+ss = ['probeCovarianceIeIp','probeS4','probeR9','probePhiWidth','probeSigmaIeIe','probeEtaWidth']
+ch = ['probeChIso03','probeChIso03worst']
+ph = ['probePhoIso']
+
+random_seed = 42
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
             description = '')
 
-    parser.add_argument(
+    cluster_group = parser.add_mutually_exclusive_group(required=True)
+
+    cluster_group.add_argument(
         "-cl",
         "--cluster_id",
-        required=True,
         type=str,
-        help="")
+        help="Address of an already running Dask scheduler")
+
+    cluster_group.add_argument(
+        "--local",
+        type=int,
+        metavar="N",
+        help="Start a LocalCluster with N workers sharing the cores and memory of this machine")
+
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        choices=["h5", "parquet"],
+        default="h5",
+        help="Format of the corrected dataframes (the plotting notebooks read h5)")
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="If given, correct the MC in chunks of this many events instead of loading it all in memory "
+             "(the chunks are appended to the same single output file)")
+
+    parser.add_argument(
+        "--check-chunked",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Only check that correcting the first N MC events in chunks (of --chunk-size, N/4 by default) "
+             "is reproducible and gives the same shower shapes as in memory; nothing is written")
+
+    parser.add_argument(
+        "--report-dir",
+        type=str,
+        default="dask_reports",
+        help="Directory where the Dask performance reports of every stage ({subdetector}_{stage}.html) are written")
 
     return parser.parse_args()
 
@@ -36,99 +100,210 @@ def setup_logging(output_file, level=logging.DEBUG):
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
+def local_cluster(n_workers):
+    """LocalCluster with n_workers processes, splitting the cores of the machine among them
+    (memory_limit='auto' already gives each worker its share of the total memory).
+    """
+    threads_per_worker = max(1, os.cpu_count() // n_workers)
+    logger.info("Starting LocalCluster with {} workers and {} threads per worker".format(n_workers, threads_per_worker))
+
+    return LocalCluster(n_workers=n_workers, threads_per_worker=threads_per_worker, memory_limit='auto')
+
+def shower_shapes_chain(detector):
+    qrc = qRC(year, detector, workDir, ss)
+    for var in qrc.vars:
+        qrc.loadClfs(var,weightsDir=weightsDirs)
+
+    return qrc
+
+def photon_iso_chain(detector):
+    qrc = qRCd(year, detector, workDir, ph)
+    qrc.loadp0tclf('probePhoIso', weightsDir=weightsDirs)
+    qrc.loadClfs('probePhoIso',weightsDir=weightsDirs)
+
+    return qrc
+
+def charged_iso_chain(detector):
+    qrc = qRCd(year, detector, workDir, ch)
+    qrc.load3Catclf(ch, weightsDir=weightsDirs)
+    qrc.loadTailRegressors(ch,weightsDirs)
+    for var in qrc.vars:
+        qrc.loadClfs(var,weightsDirs)
+
+    return qrc
+
+def pass_dataframes(qrc, previous):
+    qrc.MC = previous.MC
+    if hasattr(previous, 'data'):
+        qrc.data = previous.data
+
+def correction_chains(detector):
+    """qRC objects of the three stages of detector, with their classifiers loaded: they are built once
+    and reused for all the events (or chunks of events) to correct.
+    """
+    return shower_shapes_chain(detector), photon_iso_chain(detector), charged_iso_chain(detector)
+
+def mc_input(detector):
+    """Path of the MC of detector, preferring the Parquet export to the HDF5 file.
+    """
+    parquet_file = '{}/{}.parquet'.format(workDir, inputs[detector]['mc'])
+    if os.path.exists(parquet_file):
+        return parquet_file
+    return '{}/{}.h5'.format(workDir, inputs[detector]['mc'])
+
+def load_mc(qrc, detector, start, stop):
+    """Load the MC events [start, stop) of detector in qrc: the Parquet export is read directly, touching
+    only the row groups of those events, the HDF5 file through qRC.
+    """
+    input_file = mc_input(detector)
+    if input_file.endswith('.parquet'):
+        columns = available_columns(input_file, qrc_columns)
+        missing = [col for col in qrc_columns if col not in columns]
+        if missing:
+            logger.warning("{}: columns {} not found in {}".format(detector, missing, input_file))
+        qrc.MC = read_rows(input_file, start, stop, columns)
+    else:
+        qrc.loadMCDF(os.path.basename(input_file), start, stop, columns=qrc_columns)
+
+def correct_shower_shapes(qrc, detector, client, start, stop):
+    load_mc(qrc, detector, start, stop)
+    for var in qrc.vars:
+        qrc.correctY(var, client)
+
+    return qrc
+
+def correct_photon_iso(qrc, previous, client):
+    pass_dataframes(qrc, previous)
+    qrc.correctY('probePhoIso', client)
+
+    return qrc
+
+def correct_charged_iso(qrc, previous, client):
+    pass_dataframes(qrc, previous)
+    for var in qrc.vars:
+        qrc.correctY(var, client)
+
+    return qrc
+
+def seed_events(client, start, seed=random_seed):
+    """The discrete (isolation) corrections draw their random numbers from numpy's global generator,
+    here and on the workers: seed it from the offset of the first event to correct, with an independent
+    stream for every worker, so that the output for a given range of events is always the same
+    (as long as the cluster has the same workers).
+    """
+    workers = sorted(client.scheduler_info()['workers'])
+    local, *remote = np.random.SeedSequence([seed, start]).spawn(len(workers) + 1)
+    np.random.seed(local.generate_state(1)[0])
+    for worker, sequence in zip(workers, remote):
+        client.run(np.random.seed, sequence.generate_state(1)[0], workers=[worker])
+
+# The global generators of the workers are shared by the EB and EE pipelines:
+# only one of them at a time runs the seeded isolation stages
+isolation_lock = threading.Lock()
+
+@contextmanager
+def stage(label, name, report_dir):
+    """Log the time spent in stage name of label (a subdetector or one of its chunks) and write its Dask
+    performance report to report_dir/{label}_{name}.html. EB and EE run concurrently on the same cluster,
+    so the report of a stage also contains the tasks of the other subdetector running at the same time.
+    """
+    start = time.time()
+    with performance_report(filename=os.path.join(report_dir, "{}_{}.html".format(label, name))):
+        yield
+    logger.info("{}: stage {} done in {:.1f} s".format(label, name, time.time() - start))
+
+def correct_events(detector, client, chains, start, stop, label, report_dir):
+    """Run the whole chain (shower shapes -> photon iso -> charged iso) on the MC events [start, stop)
+    of detector and return the corrected frame; data are not needed to apply the corrections.
+    """
+    qrc_ss, qrc_ph, qrc_ch = chains
+
+    with stage(label, "shower_shapes", report_dir):
+        correct_shower_shapes(qrc_ss, detector, client, start, stop)
+
+    with isolation_lock, stage(label, "isolation", report_dir):
+        seed_events(client, start)
+        correct_photon_iso(qrc_ph, qrc_ss, client)
+        correct_charged_iso(qrc_ch, qrc_ph, client)
+
+    return qrc_ch.MC
+
+def correct_detector(detector, client, report_dir, n_evts=-1):
+    """Correct all the MC of detector (or its first n_evts events) at once.
+    """
+    return correct_events(detector, client, correction_chains(detector), 0, n_evts, detector, report_dir)
+
+def corrected_chunks(detector, client, chunk_size, report_dir, n_evts=-1):
+    """Correct the MC of detector (or its first n_evts events) chunk_size events at a time through the
+    whole chain, yielding the label of every chunk and the corrected chunk, in order: at most one chunk
+    is in memory. The random numbers of every chunk are seeded from its first event (see seed_events).
+    """
+    n_total = count_entries(mc_input(detector))
+    if n_evts >= 0:
+        n_total = min(n_evts, n_total)
+    logger.info("Correcting {} MC events of {} in chunks of {}".format(n_total, detector, chunk_size))
+
+    chains = correction_chains(detector)
+    for i, start in enumerate(range(0, n_total, chunk_size)):
+        label = "{}_chunk{:05d}".format(detector, i)
+        yield label, correct_events(detector, client, chains, start, min(start + chunk_size, n_total), label, report_dir)
+
+def correct_in_chunks(detector, client, chunk_size, output_file, output_format, report_dir):
+    with DataFrameAppender(output_file, output_format) as output:
+        for label, chunk in corrected_chunks(detector, client, chunk_size, report_dir):
+            with stage(label, "write", report_dir):
+                output.append(chunk)
+
+def check_chunked(detector, client, chunk_size, n_evts, report_dir):
+    """Correct the first n_evts MC events of detector in memory and twice in chunks of chunk_size, and
+    raise unless (rows compared in order):
+    - the columns not derived from the isolation variables are identical in memory and in chunks,
+    - the two chunked corrections are identical, i.e. seeding every chunk makes them reproducible.
+    The isolation corrections of a chunk are seeded from its first event, so they differ from the
+    ones computed in memory (where the only chunk starts from 0) by construction.
+    """
+    in_memory = correct_detector(detector, client, report_dir, n_evts).reset_index(drop=True)
+    chunked = [
+            pd.concat([chunk for _, chunk in corrected_chunks(detector, client, chunk_size, report_dir, n_evts)], ignore_index=True)
+            for _ in range(2)
+            ]
+
+    deterministic = [col for col in in_memory.columns if not any(col.startswith(var) for var in ph + ch)]
+    pd.testing.assert_frame_equal(chunked[0][deterministic], in_memory[deterministic], check_exact=True)
+    pd.testing.assert_frame_equal(chunked[1], chunked[0], check_exact=True)
+    logger.info("{}: corrections of {} events in chunks of {} are identical to the in-memory ones and reproducible".format(
+        detector, n_evts, chunk_size))
+
 def main(args):
-    cluster = args.cluster_id
-
-    data_EB_input = 'df_data_EB_test.h5'
-    data_EE_input = 'df_data_EE_test.h5'
-    mc_EB_input = 'df_mc_EB_test.h5'
-    mc_EE_input = 'df_mc_EE_test.h5'
-
-    ss = ['probeCovarianceIeIp','probeS4','probeR9','probePhiWidth','probeSigmaIeIe','probeEtaWidth']
-    ch = ['probeChIso03','probeChIso03worst']
-    ph = ['probePhoIso']
-    year = '2018'
-    n_evts = -1
-    workDir = '/work/gallim/dataframes/2018'
-    weightsDirs = '/work/gallim/weights/2018_mc_full_dask'
-
-    cols = ["mass","probeScEnergy","probeScEta","probePhi","run","weight",
-            "weight_clf","rho","probeR9","probeSigmaIeIe","probePhiWidth",
-            "probeEtaWidth","probeCovarianceIeIp","probeCovarianceIpIp",
-            "probeS4","probePhoIso","probeChIso03","probeChIso03worst",
-            "probeSigmaRR","probePt","tagPt","probePassEleVeto","tagScEta"]
+    if args.local:
+        cluster = local_cluster(args.local)
+    else:
+        cluster = args.cluster_id
 
     client = Client(cluster)
-
-
-    # ### Shower Shapes
-
-    qrc_EB = qRC(year, 'EB', workDir, ss)
-    qrc_EB.loadMCDF(mc_EB_input, 0, n_evts, columns=cols)
-    qrc_EB.loadDataDF(data_EB_input, 0, n_evts, columns=cols)
-
-    qrc_EE = qRC(year, 'EE', workDir, ss)
-    qrc_EE.loadMCDF(mc_EE_input, 0, n_evts, columns=cols)
-    qrc_EE.loadDataDF(data_EE_input, 0, n_evts, columns=cols)
-
-    for qrc in [qrc_EB, qrc_EE]:
-        for var in qrc.vars:
-            qrc.loadClfs(var,weightsDir=weightsDirs)
-            qrc.correctY(var, client)
-
-    # ### Photon Iso
-
-    qrc_ph_EB = qRCd(year, 'EB', workDir, ph)
-
-    qrc_ph_EB.MC = qrc_EB.MC
-    qrc_ph_EB.data = qrc_EB.data
-
-    qrc_ph_EB.loadp0tclf('probePhoIso', weightsDir=weightsDirs)
-    qrc_ph_EB.loadClfs('probePhoIso',weightsDir=weightsDirs)
-    qrc_ph_EB.correctY('probePhoIso', client)
-
-    qrc_ph_EE = qRCd(year, 'EE', workDir, ph)
-
-    qrc_ph_EE.MC = qrc_EE.MC
-    qrc_ph_EE.data = qrc_EE.data
-
-    qrc_ph_EE.loadp0tclf('probePhoIso', weightsDir=weightsDirs)
-    qrc_ph_EE.loadClfs('probePhoIso',weightsDir=weightsDirs)
-    qrc_ph_EE.correctY('probePhoIso', client)
-
-    # ### Charged Iso
-
-    qrc_ch_EB = qRCd(year, 'EB', workDir, ch)
-
-    qrc_ch_EB.MC = qrc_ph_EB.MC
-    qrc_ch_EB.data = qrc_ph_EB.data
-
-    qrc_ch_EB.load3Catclf(ch, weightsDir=weightsDirs)
-    qrc_ch_EB.loadTailRegressors(ch,weightsDirs)
-    for var in qrc_ch_EB.vars:
-        qrc_ch_EB.loadClfs(var,weightsDirs)
-        qrc_ch_EB.correctY(var, client)
-
-    qrc_ch_EE = qRCd(year, 'EE', workDir, ch)
-
-    qrc_ch_EE.MC = qrc_ph_EE.MC
-    qrc_ch_EE.data = qrc_ph_EE.data
-
-    qrc_ch_EE.load3Catclf(ch, weightsDir=weightsDirs)
-    qrc_ch_EE.loadTailRegressors(ch,weightsDirs)
-    for var in qrc_ch_EE.vars:
-        qrc_ch_EE.loadClfs(var,weightsDirs)
-        qrc_ch_EE.correctY(var, client)
-
-    # Produce output files
-
-    output_name_EB = 'final_output_EB'
-    output_name_EE = 'final_output_EE'
-
-    qrc_ch_EB.MC.to_hdf('{}/{}.h5'.format(workDir, output_name_EB),'df',mode='w',format='t')
-    qrc_ch_EE.MC.to_hdf('{}/{}.h5'.format(workDir, output_name_EE),'df',mode='w',format='t')
-    #qrc_ch_EB.MC.to_hdf('{}/{}.h5'.format(weightsDirs, output_name_EB),'df',mode='w',format='t')
-    #qrc_ch_EE.MC.to_hdf('{}/{}.h5'.format(weightsDirs, output_name_EE),'df',mode='w',format='t')
+    os.makedirs(args.report_dir, exist_ok=True)
+
+    # The EB and EE pipelines run concurrently and share the cluster, every stage writes its own report
+    def pipeline(det):
+        if args.check_chunked:
+            check_chunked(det, client, args.chunk_size or max(1, args.check_chunked // 4), args.check_chunked, args.report_dir)
+            return
+        output_file = '{}/final_output_{}.{}'.format(workDir, det, args.output_format)
+        if args.chunk_size:
+            correct_in_chunks(det, client, args.chunk_size, output_file, args.output_format, args.report_dir)
+        else:
+            corrected = correct_detector(det, client, args.report_dir)
+            with stage(det, "write", args.report_dir):
+                write_dataframe(corrected, output_file, args.output_format)
+
+    with ThreadPoolExecutor(max_workers=len(inputs)) as executor:
+        futures = [executor.submit(pipeline, det) for det in inputs]
+        for future in futures:
+            future.result()
+
+    client.close()
+    if args.local:
+        cluster.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,104 @@
+"""
+Discovery of the tag and probe ntuples produced with flashgg.
+
+Instead of blindly adding every formatted path to a TChain (which makes ROOT open all the
+files serially at the first use to find out the missing ones and count the entries), the
+candidate files are probed concurrently and the results (entries, tree path, size) are kept
+in a JSON index, so that files which did not change are not opened again in the next runs.
+The TChain is then built from the index with Add(name, nentries).
+"""
+
+import ROOT
+import uproot
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+def candidate_paths(base_dir, file_name, number, runs_id = None):
+    if runs_id is None:
+        runs_id = []
+
+    if runs_id:
+        return [base_dir + '/' + file_name.format(ri[0], ri[1], num) for ri in runs_id for num in range(number)]
+    else:
+        return [base_dir + '/' + file_name.format(num) for num in range(number)]
+
+def probe_file(path, tree_path):
+    record = {'tree_path': tree_path, 'entries': 0, 'size': None, 'mtime': None}
+    try:
+        stat = os.stat(path)
+    except OSError:
+        record['status'] = 'missing'
+        return record
+
+    record['size'] = stat.st_size
+    record['mtime'] = stat.st_mtime
+    try:
+        with uproot.open(path) as f:
+            record['entries'] = f[tree_path].num_entries
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'corrupt'
+        record['error'] = str(e)
+
+    return record
+
+def update_index(paths, tree_path, index_file, n_threads = 16):
+    """Probe the files in paths with a pool of n_threads threads and store the results in index_file.
+    Files already in the index with the same size and modification time are not opened again.
+    """
+    index = {}
+    if index_file is not None and os.path.isfile(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    def needs_probe(path):
+        record = index.get(path)
+        if record is None or record['tree_path'] != tree_path or record['status'] != 'ok':
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        return stat.st_size != record['size'] or stat.st_mtime != record['mtime']
+
+    to_probe = [path for path in paths if needs_probe(path)]
+    print('Probing {} of {} files'.format(len(to_probe), len(paths)))
+    with ThreadPoolExecutor(max_workers = n_threads) as executor:
+        for path, record in zip(to_probe, executor.map(lambda p: probe_file(p, tree_path), to_probe)):
+            index[path] = record
+
+    if index_file is not None:
+        with open(index_file, 'w') as f:
+            json.dump(index, f, indent = 4)
+
+    return {path: index[path] for path in paths}
+
+def report(records):
+    """Print missing and corrupt files, return the number of good ones.
+    """
+    good = [path for path, rec in records.items() if rec['status'] == 'ok']
+    missing = [path for path, rec in records.items() if rec['status'] == 'missing']
+    corrupt = [path for path, rec in records.items() if rec['status'] == 'corrupt']
+
+    print('Found {} good files ({} entries), {} missing, {} corrupt'.format(
+        len(good), sum(records[path]['entries'] for path in good), len(missing), len(corrupt)))
+    for path in corrupt:
+        print('Corrupt file {}: {}'.format(path, records[path]['error']))
+    if missing:
+        print('Missing files:\n{}'.format('\n'.join(missing)))
+
+    return len(good)
+
+def fill_tchain(base_dir, file_name, number, tree_path, runs_id = None, index_file = None, n_threads = 16):
+    paths = candidate_paths(base_dir, file_name, number, runs_id)
+    records = update_index(paths, tree_path, index_file, n_threads)
+    report(records)
+
+    chain = ROOT.TChain()
+    for path, record in records.items():
+        if record['status'] == 'ok':
+            chain.Add(path + '/' + tree_path, record['entries'])
+
+    return chain
@@ -0,0 +1,27 @@
+"""
+Configuration shared between the scripts that prepare the inputs for qRC and the ones that run it.
+"""
+
+# Columns read by qRC (see 2018_make_corrected_dataframes.py)
+qrc_columns = ["mass","probeScEnergy","probeScEta","probePhi","run","weight",
+        "weight_clf","rho","probeR9","probeSigmaIeIe","probePhiWidth",
+        "probeEtaWidth","probeCovarianceIeIp","probeCovarianceIpIp",
+        "probeS4","probePhoIso","probeChIso03","probeChIso03worst",
+        "probeSigmaRR","probePt","tagPt","probePassEleVeto","tagScEta"]
+
+# Boundaries of the subdetectors in |probeScEta|
+eb_max_eta = 1.4442
+ee_min_eta = 1.566
+
+# Branches of the tag and probe ROOT trees written in the merged inputs for qRC, per year:
+# they have to be present in the input trees (the names used by qRC, e.g. probeR9 or weight_clf,
+# are defined only later when the dataframes are created)
+qrc_common_branches = ["mass","probeScEnergy","probeScEta","probePhi","run","weight",
+        "rho","probeSigmaIeIe","probeCovarianceIeIp","probeCovarianceIpIp",
+        "probeS4","probeChIso03","probeChIso03worst","probeSigmaRR",
+        "probePt","tagPt","probePassEleVeto","tagScEta"]
+
+qrc_root_branches = {
+        '2017': qrc_common_branches + ["probeFull5x5_r9","probeEtaWidth_Sc","probePhiWidth_Sc","probePhoIso03","probePhoIdMVA"],
+        '2018': qrc_common_branches + ["probeR9","probeEtaWidth","probePhiWidth","probePhoIso"]
+        }
@@ -0,0 +1,89 @@
+"""
+Merge of the tag and probe ntuples into the inputs for qRC.
+
+Compared to a plain Snapshot of the whole TChain:
+    - only the branches needed by qRC are written (qrc_config.qrc_root_branches of the year, plus any extra one
+      requested): a missing branch is an error, so that an incomplete merge is never written;
+    - compression algorithm and level can be chosen (LZ4 for speed, ZSTD for size);
+    - the output is split in shards of at most max_entries entries each, made of whole input files,
+      so that downstream readers can process them in parallel;
+    - snapshots are booked lazily, so that data and MC are written in a single call to RunGraphs.
+"""
+
+import ROOT
+
+from dataset_discovery import candidate_paths
+from dataset_discovery import update_index
+from dataset_discovery import report
+
+compression_algorithms = {
+        'zlib': ROOT.ROOT.RCompressionSetting.EAlgorithm.kZLIB,
+        'lzma': ROOT.ROOT.RCompressionSetting.EAlgorithm.kLZMA,
+        'lz4': ROOT.ROOT.RCompressionSetting.EAlgorithm.kLZ4,
+        'zstd': ROOT.ROOT.RCompressionSetting.EAlgorithm.kZSTD
+        }
+
+def shard_records(records, max_entries):
+    """Group the good files of an index in lists of (path, entries) with at most max_entries entries
+    (unless a single file is bigger than that).
+    """
+    shards = []
+    current = []
+    current_entries = 0
+    for path, record in records.items():
+        if record['status'] != 'ok':
+            continue
+        if current and current_entries + record['entries'] > max_entries:
+            shards.append(current)
+            current = []
+            current_entries = 0
+        current.append((path, record['entries']))
+        current_entries += record['entries']
+    if current:
+        shards.append(current)
+
+    return shards
+
+def book_snapshots(base_dir, file_name, number, tree_path, output_file_tmpl, branches, runs_id = None, index_file = None,
+        extra_columns = None, algorithm = 'lz4', level = 4, max_entries = 5000000):
+    """Book lazy snapshots of branches (e.g. qrc_root_branches[year]) of the files found with dataset_discovery
+    into output_file_tmpl.format(shard_number); raise ValueError if any of them is missing.
+    Return the list of booked results (with the chains and dataframes they depend on, which have to be
+    kept alive until the event loop runs).
+    """
+    paths = candidate_paths(base_dir, file_name, number, runs_id)
+    records = update_index(paths, tree_path, index_file)
+    report(records)
+
+    options = ROOT.RDF.RSnapshotOptions()
+    options.fLazy = True
+    options.fMode = 'RECREATE'
+    options.fCompressionAlgorithm = compression_algorithms[algorithm]
+    options.fCompressionLevel = level
+
+    wanted_columns = branches + (extra_columns if extra_columns else [])
+
+    booked = []
+    for i, shard in enumerate(shard_records(records, max_entries)):
+        chain = ROOT.TChain()
+        for path, entries in shard:
+            chain.Add(path + '/' + tree_path, entries)
+        rdf = ROOT.RDataFrame(chain)
+
+        available = set(str(col) for col in rdf.GetColumnNames())
+        missing = [col for col in wanted_columns if col not in available]
+        if missing:
+            raise ValueError('Branches {} not found in {} of {}'.format(missing, tree_path, base_dir))
+
+        output_file = output_file_tmpl.format(i)
+        print('Booking snapshot of {} files in {}'.format(len(shard), output_file))
+        snapshot = rdf.Snapshot(tree_path, output_file, ROOT.std.vector['string'](wanted_columns), options)
+        booked.append((snapshot, rdf, chain))
+
+    return booked
+
+def run_snapshots(*all_booked):
+    """Trigger all the booked snapshots (e.g. data and MC) concurrently.
+    """
+    snapshots = [snapshot for booked in all_booked for snapshot, _, _ in booked]
+    ROOT.RDF.RunGraphs(snapshots)
@@ -1,96 +1,98 @@
 import ROOT
+import json
 
-def fill_tchain(base_dir, file_name, number, tree_path, runs_id = None):
-    if runs_id is None:
-        runs_id = []
+from dataset_discovery import fill_tchain
 
-    chain = ROOT.TChain()
-    if runs_id:
-        for ri in runs_id:
-            for num in range(number):
-                chain.Add(base_dir + '/' + file_name.format(ri[0], ri[1], num) + '/' + tree_path)
-    else:
-        for num in range(number):
-            chain.Add(base_dir + '/' + file_name.format(num) + '/' + tree_path)
+def load_var_binning(config_file = 'var_binning.json'):
+    """Return the binnings for data and MC: MC also has the uncorrected versions of the variables.
+    """
+    with open(config_file) as f:
+        config = json.load(f)
 
-    return chain
+    data_binning = {var: tuple(binning) for var, binning in config['var_binning'].items()}
+    mc_binning = dict(data_binning)
+    mc_binning.update({var: tuple(binning) for var, binning in config['var_binning_uncorr'].items()})
 
-def write_histos(chain, output_file, var_binning = None):
-    ROOT.EnableImplicitMT(10)
+    return data_binning, mc_binning
+
+def book_histos(chain, var_binning = None):
+    """Book (without running the event loop) one Histo1D per variable, plus the sum of weights and of
+    squared weights of the whole sample.
+    Return the RDataFrame and the booked results, to be triggered together with ROOT.RDF.RunGraphs.
+    """
     rdf = ROOT.RDataFrame(chain)
     if var_binning:
-        r_rst_ptrs = [rdf.Histo1D((var, var, binning[0], binning[1], binning[2]), var, 'weight') for var, binning in var_binning.items()]
+        histos = [rdf.Histo1D((var, var, binning[0], binning[1], binning[2]), var, 'weight') for var, binning in var_binning.items()]
     else:
-        r_rst_ptrs = [rdf.Histo1D(column) for column in rdf.GetColumnNames()]
+        histos = [rdf.Histo1D(str(column)) for column in rdf.GetColumnNames()]
+    sums = {
+            'sum_weights': rdf.Sum('weight'),
+            'sum_weights2': rdf.Define('weight2', 'weight * weight').Sum('weight2')
+            }
+
+    return rdf, histos, sums
+
+def write_histos(output_file, histos, sums):
+    """Write the histograms normalized to unit area under the variable names, as done originally,
+    together with the raw (i.e. not normalized) ones, which keep sum of weights and sum of squared
+    weights per bin, as <variable>_raw and the totals of the sample as TParameters.
+    """
     f = ROOT.TFile(output_file, 'RECREATE')
-    for ptr in r_rst_ptrs:
+    for ptr in histos:
         histo = ptr.GetValue()
         print('Processing ptr for histo {}'.format(histo.GetName()))
-        histo.Scale(1/histo.Integral())
+        raw = histo.Clone(histo.GetName() + '_raw')
+        if histo.Integral() == 0:
+            print('Histo {} is empty'.format(histo.GetName()))
+        else:
+            histo.Scale(1/histo.Integral())
         histo.Write()
-    print('Run {} event loops'.format(rdf.GetNRuns()))
+        raw.Write()
+    for name, ptr in sums.items():
+        ROOT.TParameter['double'](name, ptr.GetValue()).Write()
     f.Close()
 
-    return rdf
-
 def main():
 
+    ROOT.EnableImplicitMT(10)
+
+    data_binning, mc_binning = load_var_binning()
+
     # Data
     base_dir = '/eos/cms/store/group/phys_higgs/cmshgg/gallim/TnPProduction/_data_UL17'
     file_name = 'output_SingleElectron_alesauva-UL2017-10_6_4-v0-Run2017{}-09Aug2019_UL2017{}_USER_{}.root'
     number = 500
+    index_file = base_dir.split('/')[-1] + '_index.json'
     tree_path = 'tagAndProbeDumper/trees/Data_13TeV_All'
-    output_file = 'tnp_data.root'
+    data_output_file = 'tnp_data.root'
     runs_id = [('B', '-v1-8940b7b9416f1cbf6fbb86981f4883ea'), ('C', '-v1-c086301171e46d9c80ca640d553ab2cd'), ('D', '-v1-c086301171e46d9c80ca640d553ab2cd'), ('E', '-v1-c086301171e46d9c80ca640d553ab2cd'), ('F', '_rsb-v2-c086301171e46d9c80ca640d553ab2cd')]
-    var_binning = {
-            'probePhoIso03': (100, 0, 10),
-            'probeChIso03worst': (100, 0, 10),
-            'probeChIso03': (100, 0, 10),
-            'probePhoIdMVA': (200, -1, 1),
-            'probeFull5x5_r9': (100, 0, 1),
-            'probeSigmaIeIe': (400, 0, 0.04),
-            'probeCovarianceIeIp': (100, -0.0005, 0.0005),
-            'probeEtaWidth_Sc': (100, 0, 0.05),
-            'probePhiWidth_Sc': (150, 0, 0.15),
-            'probeS4': (100, 0, 1)
-            }
 
     # Create and fill TChain
-    chain = fill_tchain(base_dir, file_name, number, tree_path, runs_id)
+    data_chain = fill_tchain(base_dir, file_name, number, tree_path, runs_id, index_file = index_file)
 
-    # Create RDataFrame and write histos
-    rdf = write_histos(chain, output_file, var_binning)
+    # Create RDataFrame and book histos
+    data_rdf, data_histos, data_sums = book_histos(data_chain, data_binning)
 
     # Simulation
     base_dir = '/eos/cms/store/group/phys_higgs/cmshgg/gallim/TnPProduction/_mc_UL17'
     file_name = 'output_DYJetsToLL_M-50_TuneCP5_13TeV-amcatnloFXFX-pythia8_alesauva-UL2017-10_6_4-v2-RunIISummer19UL17MiniAOD-106X_mc2017_realistic_v6-v2-c148a697ba5b08ec1e824b73db044236_USER_{}.root'
     number = 500
+    index_file = base_dir.split('/')[-1] + '_index.json'
     tree_path = 'tagAndProbeDumper/trees/DYJetsToLL_amcatnloFXFX_13TeV_All'
-    output_file = 'tnp_mc.root'
-    var_binning = {
-            'probePhoIso03': (100, 0, 10),
-            'probeChIso03worst': (100, 0, 10),
-            'probeChIso03worst_uncorr': (100, 0, 10),
-            'probeChIso03': (100, 0, 10),
-            'probeChIso03_uncorr': (100, 0, 10),
-            'probePhoIdMVA': (200, -1, 1),
-            'probePhoIdMVA_uncorr': (200, -1, 1),
-            'probeFull5x5_r9': (100, 0, 1),
-            'probeSigmaIeIe': (400, 0, 0.04),
-            'probeSigmaIeIe_uncorr': (400, 0, 0.04),
-            'probeCovarianceIeIp': (100, -0.0005, 0.0005),
-            'probeCovarianceIeIp_uncorr': (100, -0.0005, 0.0005),
-            'probeEtaWidth_Sc': (100, 0, 0.05),
-            'probePhiWidth_Sc': (150, 0, 0.15),
-            'probeS4': (100, 0, 1),
-            'probeS4_uncorr': (100, 0, 1)
-            }
+    mc_output_file = 'tnp_mc.root'
 
     # Create and fill TChain
-    chain = fill_tchain(base_dir, file_name, number, tree_path)
+    mc_chain = fill_tchain(base_dir, file_name, number, tree_path, index_file = index_file)
+
+    # Create RDataFrame and book histos
+    mc_rdf, mc_histos, mc_sums = book_histos(mc_chain, mc_binning)
+
+    # Run data and MC event loops concurrently
+    ROOT.RDF.RunGraphs(data_histos + list(data_sums.values()) + mc_histos + list(mc_sums.values()))
+    print('Run {} data and {} MC event loops'.format(data_rdf.GetNRuns(), mc_rdf.GetNRuns()))
 
-    # Create RDataFrame and write histos
-    rdf = write_histos(chain, output_file, var_binning)
+    write_histos(data_output_file, data_histos, data_sums)
+    write_histos(mc_output_file, mc_histos, mc_sums)
 
 if __name__ == "__main__":
     main()
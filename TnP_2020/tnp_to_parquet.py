@@ -0,0 +1,160 @@
+"""
+Export of the merged tag and probe trees (see create_input_files_for_qrc_tnp_2018.py) to Parquet.
+
+The trees are read in steps with uproot and every step is appended as a row group to one Parquet
+file per subdetector (df_{sample}_EB.parquet and df_{sample}_EE.parquet), split on probeScEta while
+writing: neither the whole sample nor an intermediate HDF5 file is ever materialized.
+The resulting files can be read back (also partially, by column or row group) with pandas.read_parquet
+or pyarrow; 2018_make_corrected_dataframes.py reads them (with read_rows) instead of the HDF5 inputs when
+they exist.
+"""
+
+import glob
+import numpy as np
+import pandas as pd
+import uproot
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from qrc_config import eb_max_eta
+from qrc_config import ee_min_eta
+
+subdetector_masks = {
+        'EB': lambda eta: np.abs(eta) < eb_max_eta,
+        'EE': lambda eta: np.abs(eta) > ee_min_eta
+        }
+
+def export_tree(file_pattern, tree_path, output_file_tmpl, columns = None, step_size = '200 MB', compression = 'zstd'):
+    """Stream tree_path of the files matching file_pattern into output_file_tmpl.format(subdetector).
+    columns defaults to all the branches of the tree (the merged trees are already pruned), a missing
+    column is an error. Return the number of entries written per subdetector.
+    """
+    files = sorted(glob.glob(file_pattern))
+    if not files:
+        raise FileNotFoundError('No files matching {}'.format(file_pattern))
+    with uproot.open(files[0]) as f:
+        available = f[tree_path].keys()
+    if columns is None:
+        columns = available
+    missing = [col for col in columns if col not in available]
+    if missing:
+        raise ValueError('Columns {} not found in {}'.format(missing, tree_path))
+    print('Exporting {} of {} files to {}'.format(tree_path, len(files), output_file_tmpl))
+
+    writers = {}
+    entries = {subdet: 0 for subdet in subdetector_masks}
+    try:
+        for arrays in uproot.iterate(['{}:{}'.format(fl, tree_path) for fl in files], columns, step_size = step_size, library = 'np'):
+            for subdet, mask_func in subdetector_masks.items():
+                mask = mask_func(arrays['probeScEta'])
+                table = pa.table({col: arrays[col][mask] for col in columns})
+                if subdet not in writers:
+                    writers[subdet] = pq.ParquetWriter(output_file_tmpl.format(subdet), table.schema, compression = compression)
+                writers[subdet].write_table(table)
+                entries[subdet] += table.num_rows
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    print('Written {}'.format(', '.join('{} {} entries'.format(subdet, n) for subdet, n in entries.items())))
+
+    return entries
+
+def write_dataframe(df, output_file, output_format = 'h5'):
+    """Write a (corrected) dataframe either to Parquet or, as done originally, to an HDF5 table.
+    """
+    if output_format == 'parquet':
+        df.to_parquet(output_file, engine = 'pyarrow', compression = 'zstd')
+    elif output_format == 'h5':
+        df.to_hdf(output_file, key = 'df', mode = 'w', format = 't')
+    else:
+        raise ValueError('Unknown output format {}'.format(output_format))
+
+class DataFrameAppender:
+    """Write a dataframe chunk by chunk to a single file: for HDF5 every chunk is appended to the table
+    (recreated with the first chunk), for Parquet it is written as a row group, so that the output
+    is read back exactly like the one of write_dataframe.
+    """
+    def __init__(self, output_file, output_format = 'h5'):
+        if output_format not in ('h5', 'parquet'):
+            raise ValueError('Unknown output format {}'.format(output_format))
+        self.output_file = output_file
+        self.output_format = output_format
+        self.writer = None
+        self.n_chunks = 0
+
+    def append(self, df):
+        if self.output_format == 'parquet':
+            table = pa.Table.from_pandas(df, preserve_index = True)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.output_file, table.schema, compression = 'zstd')
+            self.writer.write_table(table)
+        else:
+            df.to_hdf(self.output_file, key = 'df', mode = 'w' if self.n_chunks == 0 else 'a', format = 't', append = self.n_chunks > 0)
+        self.n_chunks += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def count_entries(input_file, key = 'df'):
+    """Number of rows of a Parquet file or of a table written with to_hdf(format='t'), without reading it.
+    """
+    if input_file.endswith('.parquet'):
+        return pq.ParquetFile(input_file).metadata.num_rows
+    with pd.HDFStore(input_file, 'r') as store:
+        return store.get_storer(key).nrows
+
+def available_columns(parquet_file, columns):
+    """The ones of columns that are in parquet_file.
+    """
+    names = pq.read_schema(parquet_file).names
+    return [col for col in columns if col in names]
+
+def read_rows(parquet_file, start, stop, columns = None):
+    """Read the rows [start, stop) (stop < 0 meaning up to the end) of parquet_file, reading only the
+    row groups that contain them. The index of the dataframe is the position of the rows in the file.
+    """
+    pf = pq.ParquetFile(parquet_file)
+    n_rows = pf.metadata.num_rows
+    stop = n_rows if stop < 0 else min(stop, n_rows)
+    offsets = np.cumsum([0] + [pf.metadata.row_group(i).num_rows for i in range(pf.num_row_groups)])
+    groups = [i for i in range(pf.num_row_groups) if offsets[i] < stop and offsets[i + 1] > start]
+    if groups:
+        table = pf.read_row_groups(groups, columns = columns).slice(start - offsets[groups[0]], stop - start)
+    else:
+        table = pf.schema_arrow.empty_table()
+        if columns is not None:
+            table = table.select(columns)
+    df = table.to_pandas()
+    df.index = pd.RangeIndex(start, start + len(df))
+
+    return df
+
+def main():
+
+    input_dir = '/work/gallim/root_files/tnp_merged_outputs/2018/UNCORRECTED_20201231'
+    output_dir = '/work/gallim/dataframes/2018'
+
+    # Data
+    export_tree(
+            input_dir + '/outputData_*.root',
+            'tagAndProbeDumper/trees/Data_13TeV_All',
+            output_dir + '/df_data_{}_test.parquet'
+            )
+
+    # Simulation
+    export_tree(
+            input_dir + '/outputMC_*.root',
+            'tagAndProbeDumper/trees/DYJetsToLL_amcatnloFXFX_13TeV_All',
+            output_dir + '/df_mc_{}_test.parquet'
+            )
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import ntupro
+import json
 from ntupro import Dataset, Histogram, Unit, UnitManager, GraphManager, RunManager
 
 
 def main():
 
+    with open('var_binning.json') as f:
+        var_binning_config = json.load(f)
+
     # Data config
     data_base_dir = '/eos/cms/store/group/phys_higgs/cmshgg/gallim/TnPProduction/_data_UL17/'
     data_base_file_name = 'output_SingleElectron_alesauva-UL2017-10_6_4-v0-Run2017{}-09Aug2019_UL2017{}_USER_{}.root'
@@ -18,32 +22,14 @@ def main():
         for num in range(number):
             data_file_names.append(data_base_file_name.format(ri[0], ri[1], num))
     data_tree_path = 'tagAndProbeDumper/trees/Data_13TeV_All'
-    var_binning = {
-            'probePhoIso03': (100, 0, 10),
-            'probeChIso03worst': (100, 0, 10),
-            'probeChIso03': (100, 0, 10),
-            'probePhoIdMVA': (200, -1, 1),
-            'probeFull5x5_r9': (100, 0, 1),
-            'probeSigmaIeIe': (400, 0, 0.04),
-            'probeCovarianceIeIp': (100, -0.0005, 0.0005),
-            'probeEtaWidth_Sc': (100, 0, 0.05),
-            'probePhiWidth_Sc': (150, 0, 0.15),
-            'probeS4': (100, 0, 1)
-            }
+    var_binning = {var: tuple(binning) for var, binning in var_binning_config['var_binning'].items()}
 
     # MC config
     mc_base_dir = '/eos/cms/store/group/phys_higgs/cmshgg/gallim/TnPProduction/_mc_UL17/'
     mc_base_file_name = 'output_DYJetsToLL_M-50_TuneCP5_13TeV-amcatnloFXFX-pythia8_alesauva-UL2017-10_6_4-v2-RunIISummer19UL17MiniAOD-106X_mc2017_realistic_v6-v2-c148a697ba5b08ec1e824b73db044236_USER_{}.root'
     mc_file_names = [mc_base_file_name.format(num) for num in range(number)]
     mc_tree_path = 'tagAndProbeDumper/trees/DYJetsToLL_amcatnloFXFX_13TeV_All'
-    var_binning_uncorr = {
-            'probeChIso03worst_uncorr': (100, 0, 10),
-            'probeChIso03_uncorr': (100, 0, 10),
-            'probePhoIdMVA_uncorr': (200, -1, 1),
-            'probeSigmaIeIe_uncorr': (400, 0, 0.04),
-            'probeCovarianceIeIp_uncorr': (100, -0.0005, 0.0005),
-            'probeS4_uncorr': (100, 0, 1)
-            }
+    var_binning_uncorr = {var: tuple(binning) for var, binning in var_binning_config['var_binning_uncorr'].items()}
 
     tnp_data = ntupro.dataset_from_files('tnp_data', data_tree_path, [data_base_dir + file_name for file_name in data_file_names], be_picky = False)
     tnp_mc = ntupro.dataset_from_files('tnp_mc', mc_tree_path, [mc_base_dir + file_name for file_name in mc_file_names], be_picky = False)
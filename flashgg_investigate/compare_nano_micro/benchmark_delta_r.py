@@ -0,0 +1,56 @@
+"""
+Benchmark of delta_r against the vector based computation previously used in dump_plots.py.
+"""
+import argparse
+from time import time
+import numpy as np
+import vector
+
+from delta_r import delta_r
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark delta R computations")
+
+    parser.add_argument("--n-events", type=int, default=1000000)
+
+    parser.add_argument("--n-repeat", type=int, default=5)
+
+    return parser.parse_args()
+
+
+def delta_r_vector(pt1, eta1, phi1, e1, pt2, eta2, phi2, e2):
+    four_1 = vector.obj(pt=pt1, phi=phi1, eta=eta1, E=e1)
+    four_2 = vector.obj(pt=pt2, phi=phi2, eta=eta2, E=e2)
+    return four_1.deltaR(four_2)
+
+
+def timed(func, n_repeat):
+    times = []
+    for _ in range(n_repeat):
+        start = time()
+        result = func()
+        times.append(time() - start)
+    return result, min(times)
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    n = args.n_events
+    pt1, pt2 = rng.uniform(20, 200, n), rng.uniform(20, 200, n)
+    eta1, eta2 = rng.uniform(-2.5, 2.5, n), rng.uniform(-2.5, 2.5, n)
+    phi1, phi2 = rng.uniform(-np.pi, np.pi, n), rng.uniform(-np.pi, np.pi, n)
+    e1, e2 = pt1 * np.cosh(eta1), pt2 * np.cosh(eta2)
+
+    reference, t_vector = timed(lambda: np.asarray(delta_r_vector(pt1, eta1, phi1, e1, pt2, eta2, phi2, e2)), args.n_repeat)
+    result, t_numpy = timed(lambda: delta_r(eta1, phi1, eta2, phi2), args.n_repeat)
+
+    print("vector: {:.4f} s".format(t_vector))
+    print("numpy float32: {:.4f} s ({:.1f}x)".format(t_numpy, t_vector / t_numpy))
+    print("Max absolute difference: {:.2e}".format(np.max(np.abs(reference - result))))
+    assert np.allclose(reference, result, atol=1.e-5)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(args)
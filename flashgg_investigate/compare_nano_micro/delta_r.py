@@ -0,0 +1,36 @@
+"""
+Delta R between photons computed directly on contiguous float32 numpy arrays.
+"""
+import numpy as np
+
+
+def as_float32(arr):
+    return np.ascontiguousarray(arr, dtype=np.float32)
+
+
+def delta_phi(phi1, phi2):
+    """phi1 - phi2 wrapped in [-pi, pi)."""
+    dphi = as_float32(phi1) - as_float32(phi2)
+    return (dphi + np.float32(np.pi)) % np.float32(2 * np.pi) - np.float32(np.pi)
+
+
+def delta_r(eta1, phi1, eta2, phi2):
+    return np.hypot(as_float32(eta1) - as_float32(eta2), delta_phi(phi1, phi2))
+
+
+def best_match(lead_eta_a, lead_phi_a, sublead_eta_a, sublead_phi_a, lead_eta_b, lead_phi_b, sublead_eta_b, sublead_phi_b):
+    """
+    Pair the two photons of sample a with the two photons of sample b without assuming that they have the
+    same lead/sublead ordering: the pairing (lead-lead, sublead-sublead) or (lead-sublead, sublead-lead) with
+    the smallest sum of delta R is chosen.
+    Return (swapped, lead_delta_r, sublead_delta_r): swapped is True where the lead photon of a is paired to
+    the sublead photon of b, the delta R are those of the photons of a with their partners in b.
+    """
+    dr_ll = delta_r(lead_eta_a, lead_phi_a, lead_eta_b, lead_phi_b)
+    dr_ss = delta_r(sublead_eta_a, sublead_phi_a, sublead_eta_b, sublead_phi_b)
+    dr_ls = delta_r(lead_eta_a, lead_phi_a, sublead_eta_b, sublead_phi_b)
+    dr_sl = delta_r(sublead_eta_a, sublead_phi_a, lead_eta_b, lead_phi_b)
+
+    swapped = dr_ls + dr_sl < dr_ll + dr_ss
+
+    return swapped, np.where(swapped, dr_ls, dr_ll), np.where(swapped, dr_sl, dr_ss)
@@ -1,16 +1,25 @@
 """
-Environment: hgg-coffea + install fastparquet
+Environment: hgg-coffea
 """
 import argparse
 import awkward as ak
-import uproot 
-import matplotlib.pyplot as plt
-import mplhep as hep
 import numpy as np
 import pandas as pd
-import vector
 import json
-hep.style.use("CMS")
+from readers import read_nano
+from readers import read_micro
+from event_matching import match_events
+from event_matching import format_report
+from delta_r import delta_r
+from delta_r import best_match
+from rendering import compute_contents
+from rendering import render_all
+from rendering import write_summary
+from outputs import write_dataset
+from outputs import write_views
+
+import logging
+logger = logging.getLogger(__name__)
 
 
 def parse_arguments():
@@ -38,250 +47,174 @@ def parse_arguments():
         required=True
     )
 
+    parser.add_argument(
+        "--best-match",
+        action="store_true",
+        help="Pair nano and micro photons by delta R instead of by lead/sublead ordering"
+    )
+
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=None,
+        help="Number of processes used to draw the figures (default: number of cores)"
+    )
+
+    parser.add_argument(
+        "--no-split-views",
+        dest="split_views",
+        action="store_false",
+        help="Do not write the nano, micro, nano_isos and micro_isos views to separate parquet files "
+             "(compare_nano_micro_mva.py reads them)"
+    )
+
     return parser.parse_args()
 
 
-def main(args):
+def partner_name(name):
+    """Name of the same column for the other photon, None if name is not a photon column."""
+    if name.startswith("lead"):
+        return "sub" + name
+    if name.startswith("sublead"):
+        return name[len("sub"):]
+    return None
+
+
+def needed_columns(specs, best_match=False):
+    """Columns to read from nano and micro: the plotted ones, the event identifiers and the extra
+    inputs needed for the comparison of the MVA; with best_match, for micro also the other photon of
+    every plotted photon column, so that lead and sublead can be swapped."""
+    ids = ["run", "lumi", "event"]
+    nano_columns = ids + [var["nano_col"] for var in specs] + ["lead_fixedGridRhoAll"]
+    micro_columns = ids + [var["micro_col"] for var in specs]
+    if best_match:
+        micro_columns += [partner_name(col) for col in micro_columns if partner_name(col) is not None]
+    return list(dict.fromkeys(nano_columns)), list(dict.fromkeys(micro_columns))
 
-    # Read nano, micro, EB or EE cuts
-    nanoaod_arr = ak.from_parquet(args.nano_input_dir)
-    print("Read nanoaod: {}".format(nanoaod_arr.type))
-    
-    microaod_arr = uproot.concatenate(
-        ["{}/*.root:diphotonDumper/trees/ggH_125_13TeV_All_$SYST".format(args.micro_input_dir)]
-        )
-    print("Read microaod: {}".format(microaod_arr.type))
-    # Stupid typo in flashgg
-    if "lead_ch_iso_worst__uncorr" in microaod_arr.fields:
-        microaod_arr["lead_ch_iso_worst_uncorr"] = microaod_arr["lead_ch_iso_worst__uncorr"]
-
-    if args.sd == "EB":
-        nanoaod_arr = nanoaod_arr[np.abs(nanoaod_arr.lead_eta) < 1.5]
-        nanoaod_arr = nanoaod_arr[np.abs(nanoaod_arr.sublead_eta) < 1.5]
-        microaod_arr = microaod_arr[np.abs(microaod_arr.lead_eta) < 1.5]
-        microaod_arr = microaod_arr[np.abs(microaod_arr.sublead_eta) < 1.5]
-
-    if args.sd == "EE":
-        nanoaod_arr = nanoaod_arr[np.abs(nanoaod_arr.lead_eta) > 1.5]
-        nanoaod_arr = nanoaod_arr[np.abs(nanoaod_arr.sublead_eta) > 1.5]
-        microaod_arr = microaod_arr[np.abs(microaod_arr.lead_eta) > 1.5]
-        microaod_arr = microaod_arr[np.abs(microaod_arr.sublead_eta) > 1.5]
+
+def main(args):
 
     # Read catalogue of variables to be plotted
     with open("plots_specs.json", "r") as f:
         columns = json.load(f)
 
-    # Create dict where keys are names of variables in nano and values are names of variables in micro
-    nano_micro_names = {var["nano_col"]: var["micro_col"] for var in columns}
-    nano_micro_names["event"] = "event"
-    nano_micro_names["lumi"] = "lumi"
-
-    # Event by event
-    nano_dict = {k: nanoaod_arr[k] for k in nano_micro_names.keys()}
-    nano_dict["lead_fixedGridRhoAll"] = nanoaod_arr["lead_fixedGridRhoAll"] # needed for XGBoost vs TMVA
-    test_nano = ak.Array(nano_dict)
+    nano_columns, micro_columns = needed_columns(columns, args.best_match)
 
-    test_micro = microaod_arr[nano_micro_names.values()]
+    # Read nano, micro, EB or EE cuts
+    nanoaod_arr = read_nano(args.nano_input_dir, nano_columns, args.sd)
+    print("Read nanoaod: {}".format(nanoaod_arr.type))
 
-    pd_nano = ak.to_pandas(test_nano)
-    pd_micro = ak.to_pandas(test_micro)
+    microaod_arr = read_micro(
+        args.micro_input_dir,
+        "diphotonDumper/trees/ggH_125_13TeV_All_$SYST",
+        micro_columns,
+        args.sd,
+        # Stupid typo in flashgg
+        aliases={
+            "lead_ch_iso_worst_uncorr": "lead_ch_iso_worst__uncorr",
+            "sublead_ch_iso_worst_uncorr": "sublead_ch_iso_worst__uncorr"
+            }
+        )
+    print("Read microaod: {}".format(microaod_arr.type))
 
-    pd_nano = pd_nano.set_index(["event", "lumi"])
-    pd_micro = pd_micro.set_index(["event", "lumi"])
+    # The photon directions are needed for the delta R cut in any case, the plots of the other columns
+    # missing in nano or micro are skipped
+    required = ["{}_{}".format(photon, var) for photon in ["lead", "sublead"] for var in ["eta", "phi"]]
+    for name, arr, sample_required in [("nano", nanoaod_arr, required + ["lead_fixedGridRhoAll"]), ("micro", microaod_arr, required)]:
+        missing = [col for col in sample_required if col not in arr.fields]
+        if missing:
+            raise ValueError("Columns {} needed for the comparison not found in {}".format(missing, name))
+    skipped = [var["nano_col"] for var in columns if var["nano_col"] not in nanoaod_arr.fields or var["micro_col"] not in microaod_arr.fields]
+    if skipped:
+        logger.warning("Skipping the plots of {}, their columns are missing in nano or micro".format(skipped))
+    columns = [var for var in columns if var["nano_col"] not in skipped]
 
-    pd_joined = pd_nano.join(pd_micro, lsuffix="_nano", rsuffix="_micro")
+    # Create dict where keys are names of variables in nano and values are names of variables in micro
+    nano_micro_names = {var["nano_col"]: var["micro_col"] for var in columns}
 
-    print("Joined dataframe:\n{}".format(pd_joined))
+    # Event by event: match on (run, lumi, event) and take the matched rows of every column
+    id_fields = [f for f in ["run", "lumi", "event"] if f in nanoaod_arr.fields and f in microaod_arr.fields]
+    nano_idx, micro_idx, report = match_events(
+        [ak.to_numpy(nanoaod_arr[f]) for f in id_fields],
+        [ak.to_numpy(microaod_arr[f]) for f in id_fields]
+        )
+    print("Matched on {}: {}".format(id_fields, format_report(report, "nano", "micro")))
 
-    #Remove NaN values
+    joined = {}
+    micro_joined_names = {}
     for nano_name, micro_name in nano_micro_names.items():
-        if nano_name in ["event", "lumi"]:
-            break
+        joined_nano_name, joined_micro_name = nano_name, micro_name
         if nano_name == micro_name:
-            nano_name += "_nano"
-            micro_name += "_micro"
-        pd_joined = pd_joined[pd_joined[nano_name].notna()]
-        pd_joined = pd_joined[pd_joined[micro_name].notna()]
+            joined_nano_name += "_nano"
+            joined_micro_name += "_micro"
+        joined[joined_nano_name] = ak.to_numpy(nanoaod_arr[nano_name])[nano_idx]
+        joined[joined_micro_name] = ak.to_numpy(microaod_arr[micro_name])[micro_idx]
+        micro_joined_names[micro_name] = joined_micro_name
+    joined["lead_fixedGridRhoAll"] = ak.to_numpy(nanoaod_arr["lead_fixedGridRhoAll"])[nano_idx] # needed for XGBoost vs TMVA
+
+    # NaN values and delta R cuts are combined in a single mask, applied once at the end
+    mask = np.ones(len(nano_idx), dtype=bool)
+    for values in joined.values():
+        if np.issubdtype(values.dtype, np.floating):
+            mask &= ~np.isnan(values)
 
     # Cut over delta R
-    # Here https://github.com/CoffeaTeam/coffea/blob/3db3fab23064c70d0ca63b185d51c7fa3b7849dc/coffea/nanoevents/methods/vector.py#L74
-    # useful info
     deltaR_threshold = 0.1
 
-    four_lead_nano = vector.obj(
-        pt=pd_joined["lead_pt"],
-        phi=pd_joined["lead_phi_nano"],
-        eta=pd_joined["lead_eta_nano"],
-        E=pd_joined["lead_energyRaw"]
-    )
-
-    four_sublead_nano = vector.obj(
-        pt=pd_joined["sublead_pt"],
-        phi=pd_joined["sublead_phi_nano"],
-        eta=pd_joined["sublead_eta_nano"],
-        E=pd_joined["sublead_energyRaw"]
-    )
-
-    pd_joined["deltaR_nano"] = four_lead_nano.deltaR(four_sublead_nano)
+    joined["deltaR_nano"] = delta_r(joined["lead_eta_nano"], joined["lead_phi_nano"], joined["sublead_eta_nano"], joined["sublead_phi_nano"])
 
-    four_lead_micro = vector.obj(
-        pt=pd_joined["leadPt"],
-        phi=pd_joined["lead_phi_micro"],
-        eta=pd_joined["lead_eta_micro"],
-        E=pd_joined["lead_SCRawE"]
-    )
-
-    four_sublead_micro = vector.obj(
-        pt=pd_joined["subleadPt"],
-        phi=pd_joined["sublead_phi_micro"],
-        eta=pd_joined["sublead_eta_micro"],
-        E=pd_joined["sublead_SCRawE"]
-    )
-
-    pd_joined["lead_deltaR"] = four_lead_nano.deltaR(four_lead_micro)
-    pd_joined["sublead_deltaR"] = four_sublead_nano.deltaR(four_sublead_micro)
-    pd_joined = pd_joined[pd_joined["lead_deltaR"] < deltaR_threshold]
-    pd_joined = pd_joined[pd_joined["sublead_deltaR"] < deltaR_threshold]
+    if args.best_match:
+        # Pair each nano photon to the closest micro photon instead of trusting the lead/sublead ordering
+        swapped, joined["lead_deltaR"], joined["sublead_deltaR"] = best_match(
+            joined["lead_eta_nano"], joined["lead_phi_nano"], joined["sublead_eta_nano"], joined["sublead_phi_nano"],
+            joined["lead_eta_micro"], joined["lead_phi_micro"], joined["sublead_eta_micro"], joined["sublead_phi_micro"]
+            )
+        # The partners come from the joined columns or, if they are not plotted, straight from micro;
+        # columns without a partner in micro cannot be swapped and are set to NaN in the swapped events
+        swapped_columns = {}
+        unpaired = []
+        for micro_name, joined_name in micro_joined_names.items():
+            partner = partner_name(micro_name)
+            if partner is None:
+                continue
+            if partner in micro_joined_names:
+                partner_values = joined[micro_joined_names[partner]]
+            elif partner in microaod_arr.fields:
+                partner_values = ak.to_numpy(microaod_arr[partner])[micro_idx]
+            else:
+                partner_values = np.nan
+                unpaired.append(micro_name)
+            swapped_columns[joined_name] = np.where(swapped, partner_values, joined[joined_name])
+        joined.update(swapped_columns)
+        if unpaired:
+            print("Micro columns without the other photon, set to NaN where swapped: {}".format(unpaired))
+        print("Lead and sublead micro photons swapped in {} events".format(np.sum(swapped & mask)))
+    else:
+        joined["lead_deltaR"] = delta_r(joined["lead_eta_nano"], joined["lead_phi_nano"], joined["lead_eta_micro"], joined["lead_phi_micro"])
+        joined["sublead_deltaR"] = delta_r(joined["sublead_eta_nano"], joined["sublead_phi_nano"], joined["sublead_eta_micro"], joined["sublead_phi_micro"])
+    mask &= (joined["lead_deltaR"] < deltaR_threshold) & (joined["sublead_deltaR"] < deltaR_threshold)
+
+    index = pd.MultiIndex.from_arrays(
+        [ak.to_numpy(nanoaod_arr[f])[nano_idx][mask] for f in ["event", "lumi"]],
+        names=["event", "lumi"]
+        )
+    pd_joined = pd.DataFrame({name: values[mask] for name, values in joined.items()}, index=index)
+    del joined
     print("Final joined dataframe:\n{}".format(pd_joined))
 
     # Plot
     print("Start plotting")
-    for column in columns:
-        fig, (up, middle, down) = plt.subplots(
-            nrows=3,
-            ncols=1,
-            gridspec_kw={"height_ratios": (2, 1, 1)}
-            )
-
-        nano_name = column["nano_col"]
-        micro_name = column["micro_col"]
+    jobs = compute_contents(pd_joined, columns, args.output_dir, args.sd)
+    write_summary(jobs, "{}/summary_{}.json".format(args.output_dir, args.sd))
+    render_all(jobs, args.n_workers)
 
-        if nano_name == micro_name:
-            nano_name += "_nano"
-            micro_name += "_micro"
-        
-        range = column["range"]
-
-        # Up
-        n, n_, n__ = up.hist(pd_joined[nano_name], bins=column["bins"], range=range, histtype="step", label="NanoAOD", linewidth=2)
-        m, m_, m__ = up.hist(pd_joined[micro_name], bins=column["bins"], range=range, histtype="step", label="MicroAOD", linewidth=2)
-
-        up.legend(fontsize=18, loc="upper right")
-        up.set_xlim(range)
-        up.set_xlabel(column["var"])
-        up.set_ylabel("Events")
-        if "log" in column:
-            up.set_yscale("log")
-        
-        # Middle
-        ylim = [0, 2]
-        middle.set_ylim(ylim)
-        #middle.axhline(1, xmin=range[0], xmax=range[1], color="black", alpha=0.6)
-        centers = (n_[:-1] + n_[1:]) / 2
-        middle.plot(centers, n / m, "k.")
-        middle.set_xlim(range)
-        middle.set_xlabel(column["var"])
-        middle.set_ylabel("$n/\mu$")
-        middle.grid(which="both")
-
-        # Down
-        perc_range = (-300, 300)
-        perc_bins = 500
-        down.hist(100 * (pd_joined[nano_name] - pd_joined[micro_name]) / pd_joined[micro_name], 
-                  bins=perc_bins,
-                  range=perc_range,
-                  histtype="step",
-                  density=True,
-                  color="black",
-                  linewidth=2)
-        #down.set_yscale("log")
-        down.set_xlabel("$(n_{ev} - \mu_{ev})/\mu_{ev}$ [%]")
-        down.set_ylabel("Events / {}%".format((perc_range[1] - perc_range[0]) / perc_bins))
-
-        print(column["nano_col"])
-        print("nano: {}".format(np.sum(n)))
-        print("micro: {}".format(np.sum(m)))
-        print("diff = {}".format(abs(np.sum(n) - np.sum(m))))
-        print("rel diff = {}%\n".format(100 * abs(np.sum(n) - np.sum(m)) / max(np.sum(n), np.sum(m))))
-
-        fig.tight_layout()
-
-        fig.savefig("{}/{}_{}.png".format(args.output_dir, column["nano_col"], args.sd), bbox_inches='tight')
-        fig.savefig("{}/{}_{}.pdf".format(args.output_dir, column["nano_col"], args.sd), bbox_inches='tight')
-
-        plt.close(fig)
-
-    # Dump pandas dataframe to parquet file
-    pd_joined.to_parquet("nano_micro_{}.parquet".format(args.sd), engine="fastparquet")
+    # Dump pandas dataframe to a single parquet file, the views are column projections of it
+    write_dataset(pd_joined, "nano_micro_{}.parquet".format(args.sd))
     print("Dumped dataframe to parquet file")
 
-    # Redundant: dump separate dataframes for nano and micro with PhotonID inputs
-    nano_vars = {
-        "r9": "lead_r9_nano", 
-        "s4": "lead_s4_nano",
-        "sieie": "lead_sieie_nano",
-        "etaWidth": "lead_etaWidth",
-        "phiWidth": "lead_phiWidth",
-        "sieip": "lead_sieip_nano",
-        "pfPhoIso03": "lead_pfPhoIso03",
-        "pfChargedIsoPFPV": "lead_pfChargedIsoPFPV",
-        "pfChargedIsoWorstVtx": "lead_pfChargedIsoWorstVtx",
-
-        "mva_ID": "lead_mvaID_recomputed"
-        }
-
-    micro_vars = {
-        "r9": "lead_r9_micro", 
-        "s4": "lead_s4_micro",
-        "sieie": "lead_sieie_micro",
-        "etaWidth": "lead_eta_width",
-        "phiWidth": "lead_phi_width",
-        "sieip": "lead_sieip_micro",
-        "pfPhoIso03": "lead_pho_iso",
-        "pfChargedIsoPFPV": "lead_ch_iso",
-        "pfChargedIsoWorstVtx": "lead_ch_iso_worst",
-
-        "mva_ID": "lead_mva"
-        }
-
-    nano_isos = {
-        "pfPhoIso03": "lead_pfPhoIso03",
-        "pfChargedIsoPFPV": "lead_pfChargedIsoPFPV",
-        "pfChargedIsoWorstVtx": "lead_pfChargedIsoWorstVtx",
-        "pfPhoIso03_uncorr": "lead_uncorr_pfPhoIso03",
-        "pfChargedIsoPFPV_uncorr": "lead_uncorr_pfChargedIsoPFPV",
-        "pfChargedIsoWorstVtx_uncorr": "lead_uncorr_pfChargedIsoWorstVtx",
-        }
-
-    micro_isos = {
-        "pfPhoIso03": "lead_pho_iso",
-        "pfChargedIsoPFPV": "lead_ch_iso",
-        "pfChargedIsoWorstVtx": "lead_ch_iso_worst",
-        "pfPhoIso03_uncorr": "lead_pho_iso_uncorr",
-        "pfChargedIsoPFPV_uncorr": "lead_ch_iso_uncorr",
-        "pfChargedIsoWorstVtx_uncorr": "lead_ch_iso_worst_uncorr",
-       }
-
-    nano_df = pd_joined[list(nano_vars.values())]
-    nano_df.rename(columns=dict((v, k) for k, v in nano_vars.items()), inplace=True)
-    nano_df.to_parquet("nano_{}.parquet".format(args.sd), engine="fastparquet")
-    print("Dumped nano dataframe to parquet file")
-
-    micro_df = pd_joined[list(micro_vars.values())]
-    micro_df.rename(columns=dict((v, k) for k, v in micro_vars.items()), inplace=True)
-    micro_df.to_parquet("micro_{}.parquet".format(args.sd), engine="fastparquet")
-    print("Dumped micro dataframe to parquet file")
-
-    nano_df = pd_joined[list(nano_isos.values())]
-    nano_df.rename(columns=dict((v, k) for k, v in nano_isos.items()), inplace=True)
-    nano_df.to_parquet("nano_{}_isos.parquet".format(args.sd), engine="fastparquet")
-    print("Dumped nano dataframe for isos to parquet file")
-
-    micro_df = pd_joined[list(micro_isos.values())]
-    micro_df.rename(columns=dict((v, k) for k, v in micro_isos.items()), inplace=True)
-    micro_df.to_parquet("micro_{}_isos.parquet".format(args.sd), engine="fastparquet")
-    print("Dumped micro dataframe for isos to parquet file")
-
+    if args.split_views:
+        written = write_views(pd_joined, args.sd)
+        print("Dumped views {} to separate parquet files".format(written))
 
 
 if __name__ == "__main__":
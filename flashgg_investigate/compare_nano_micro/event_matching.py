@@ -0,0 +1,98 @@
+"""
+Event by event matching of two samples (e.g. NanoAOD and MicroAOD) on (run, lumi, event).
+
+The identifiers are packed in a single 64 bit key, both samples are sorted once by key (np.argsort)
+and the keys of one sample are looked up in the other with np.searchsorted. The result is a pair of
+index arrays, which can be used to take the matched rows of any column of the two samples without
+building (and joining) full dataframes.
+Keys appearing more than once in a sample are ambiguous: they are not matched (a join would instead
+keep all the combinations of their events) and a warning with their number is logged.
+"""
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def bits_needed(*arrays):
+    max_value = max(int(arr.max()) if len(arr) else 0 for arr in arrays)
+    return max(1, max_value.bit_length())
+
+
+def pack_keys(ids_a, ids_b):
+    """
+    Pack the identifiers of two samples (lists of integer arrays, e.g. [run, lumi, event]) into uint64 keys.
+    The number of bits of every identifier is chosen from its maximum in both samples.
+    """
+    widths = [bits_needed(np.asarray(a), np.asarray(b)) for a, b in zip(ids_a, ids_b)]
+    if sum(widths) > 64:
+        raise ValueError("Identifiers need {} bits, they cannot be packed in a 64 bit key".format(sum(widths)))
+
+    def pack(ids):
+        key = np.zeros(len(ids[0]), dtype=np.uint64)
+        for arr, width in zip(ids, widths):
+            key = (key << np.uint64(width)) | np.asarray(arr).astype(np.uint64)
+        return key
+
+    return pack(ids_a), pack(ids_b)
+
+
+def duplicated_sorted(sorted_keys):
+    """Mask of the elements of sorted_keys which appear more than once."""
+    dup = np.zeros(len(sorted_keys), dtype=bool)
+    eq = sorted_keys[1:] == sorted_keys[:-1]
+    dup[1:] |= eq
+    dup[:-1] |= eq
+    return dup
+
+
+def match_events(ids_a, ids_b):
+    """
+    Match the events of two samples, ids_a and ids_b being lists of identifier arrays in the same order
+    (e.g. [run, lumi, event]).
+    Return (index_a, index_b, report): the i-th matched event is at index_a[i] in sample a and index_b[i]
+    in sample b, ordered by key; report contains the numbers of matched, unmatched and duplicated events
+    (the unmatched ones include the duplicated ones).
+    """
+    key_a, key_b = pack_keys(ids_a, ids_b)
+    order_a = np.argsort(key_a, kind="stable")
+    order_b = np.argsort(key_b, kind="stable")
+    sorted_a = key_a[order_a]
+    sorted_b = key_b[order_b]
+    dup_a = duplicated_sorted(sorted_a)
+    dup_b = duplicated_sorted(sorted_b)
+
+    pos = np.searchsorted(sorted_b, sorted_a)
+    pos_clipped = np.minimum(pos, max(len(sorted_b) - 1, 0))
+    found = (pos < len(sorted_b)) & (sorted_b[pos_clipped] == sorted_a) if len(sorted_b) else np.zeros(len(sorted_a), dtype=bool)
+    matched = found & ~dup_a & ~dup_b[pos_clipped] if len(sorted_b) else found
+
+    index_a = order_a[matched]
+    index_b = order_b[pos_clipped[matched]]
+
+    paired_b = np.zeros(len(sorted_b), dtype=bool)
+    paired_b[pos_clipped[matched]] = True
+
+    report = {
+        "a": len(key_a),
+        "b": len(key_b),
+        "matched": len(index_a),
+        "a_unmatched": int(np.sum(~matched)),
+        "b_unmatched": int(np.sum(~paired_b)),
+        "a_duplicated": int(np.sum(dup_a)),
+        "b_duplicated": int(np.sum(dup_b)),
+    }
+    if report["a_duplicated"] or report["b_duplicated"]:
+        logger.warning(
+            "{a_duplicated} events of a and {b_duplicated} events of b have a duplicated key and are not matched".format(**report)
+        )
+
+    return index_a, index_b, report
+
+
+def format_report(report, name_a="a", name_b="b"):
+    return (
+        "{matched} matched events; "
+        "{a} in {na} ({a_unmatched} without match, of which {a_duplicated} with duplicated key); "
+        "{b} in {nb} ({b_unmatched} without match, of which {b_duplicated} with duplicated key)"
+    ).format(na=name_a, nb=name_b, **report)
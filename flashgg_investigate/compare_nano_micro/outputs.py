@@ -0,0 +1,122 @@
+"""
+Output of the joined nano/micro dataframe.
+
+The joined dataframe is written once, to a single parquet file. The per-purpose dataframes (PhotonID
+inputs and isolations, for nano and micro) are views of it: a view is an alias map from the names used
+downstream to the columns of the joined dataframe, so it can be read as a column projection with
+read_view. If separate files are still needed, write_views writes them concurrently from the same
+Arrow table, without copying the columns.
+"""
+import concurrent.futures
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+nano_vars = {
+    "r9": "lead_r9_nano",
+    "s4": "lead_s4_nano",
+    "sieie": "lead_sieie_nano",
+    "etaWidth": "lead_etaWidth",
+    "phiWidth": "lead_phiWidth",
+    "sieip": "lead_sieip_nano",
+    "pfPhoIso03": "lead_pfPhoIso03",
+    "pfChargedIsoPFPV": "lead_pfChargedIsoPFPV",
+    "pfChargedIsoWorstVtx": "lead_pfChargedIsoWorstVtx",
+
+    "mva_ID": "lead_mvaID_recomputed"
+}
+
+micro_vars = {
+    "r9": "lead_r9_micro",
+    "s4": "lead_s4_micro",
+    "sieie": "lead_sieie_micro",
+    "etaWidth": "lead_eta_width",
+    "phiWidth": "lead_phi_width",
+    "sieip": "lead_sieip_micro",
+    "pfPhoIso03": "lead_pho_iso",
+    "pfChargedIsoPFPV": "lead_ch_iso",
+    "pfChargedIsoWorstVtx": "lead_ch_iso_worst",
+
+    "mva_ID": "lead_mva"
+}
+
+nano_isos = {
+    "pfPhoIso03": "lead_pfPhoIso03",
+    "pfChargedIsoPFPV": "lead_pfChargedIsoPFPV",
+    "pfChargedIsoWorstVtx": "lead_pfChargedIsoWorstVtx",
+    "pfPhoIso03_uncorr": "lead_uncorr_pfPhoIso03",
+    "pfChargedIsoPFPV_uncorr": "lead_uncorr_pfChargedIsoPFPV",
+    "pfChargedIsoWorstVtx_uncorr": "lead_uncorr_pfChargedIsoWorstVtx",
+}
+
+micro_isos = {
+    "pfPhoIso03": "lead_pho_iso",
+    "pfChargedIsoPFPV": "lead_ch_iso",
+    "pfChargedIsoWorstVtx": "lead_ch_iso_worst",
+    "pfPhoIso03_uncorr": "lead_pho_iso_uncorr",
+    "pfChargedIsoPFPV_uncorr": "lead_ch_iso_uncorr",
+    "pfChargedIsoWorstVtx_uncorr": "lead_ch_iso_worst_uncorr",
+}
+
+# Name of the view -> (alias map, file name template of the separate file)
+views = {
+    "nano": (nano_vars, "nano_{}.parquet"),
+    "micro": (micro_vars, "micro_{}.parquet"),
+    "nano_isos": (nano_isos, "nano_{}_isos.parquet"),
+    "micro_isos": (micro_isos, "micro_{}_isos.parquet"),
+}
+
+write_options = {"compression": "zstd", "use_dictionary": True}
+
+
+def to_table(df):
+    """Arrow table of df, with the view alias maps stored in the schema metadata."""
+    table = pa.Table.from_pandas(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"views"] = json.dumps({name: aliases for name, (aliases, _) in views.items()}).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def write_dataset(df, output_file):
+    pq.write_table(to_table(df), output_file, **write_options)
+
+
+def read_view(input_file, view):
+    """Read only the columns of a view from the file written by write_dataset, with the view names."""
+    aliases, _ = views[view]
+    table = pq.read_table(input_file, columns=list(aliases.values()))
+    return table.rename_columns(list(aliases.keys())).to_pandas()
+
+
+def view_table(table, view, index_columns):
+    """Projection of table on the columns of a view (renamed), followed by the index columns."""
+    aliases, _ = views[view]
+    columns = list(aliases.values()) + index_columns
+    return table.select(columns).rename_columns(list(aliases.keys()) + index_columns)
+
+
+def write_views(df, sd, n_threads=None):
+    """Write every view to its separate file and return the names of the ones written: the views with
+    columns missing in df are skipped."""
+    table = pa.Table.from_pandas(df)
+    index_columns = [name for name in df.index.names if name is not None]
+    available = {}
+    for view, (aliases, file_tmpl) in views.items():
+        missing = [col for col in aliases.values() if col not in table.column_names]
+        if missing:
+            logger.warning("View {} not written, columns {} are missing".format(view, missing))
+        else:
+            available[view] = file_tmpl
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_threads or len(views)) as executor:
+        futures = [
+            executor.submit(pq.write_table, view_table(table, view, index_columns), file_tmpl.format(sd), **write_options)
+            for view, file_tmpl in available.items()
+        ]
+        for future in futures:
+            future.result()
+
+    return list(available)
@@ -0,0 +1,102 @@
+"""
+Column-pruned readers for the nano (parquet) and micro (flashgg dumper ROOT trees) samples.
+
+Only the requested columns are read. The EB/EE selection (both photons in the same subdetector) is
+applied as a pre-filter: for the parquet files it is pushed down to pyarrow, which skips the row groups
+that cannot pass it; for the ROOT trees lead_eta and sublead_eta are read first and the other branches
+of a file are read only if some of its events pass.
+"""
+import glob
+import awkward as ak
+import numpy as np
+import uproot
+import pyarrow.dataset as ds
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+eta_columns = ["lead_eta", "sublead_eta"]
+
+
+def abs_eta_filter(column, sd, boundary):
+    field = ds.field(column)
+    if sd == "EB":
+        return (field < boundary) & (field > -boundary)
+    return (field > boundary) | (field < -boundary)
+
+
+def abs_eta_mask(eta, sd, boundary):
+    """Same selection as abs_eta_filter, on a numpy array."""
+    abs_eta = np.abs(eta)
+    if sd == "EB":
+        return abs_eta < boundary
+    return abs_eta > boundary
+
+
+def empty_array(columns):
+    return ak.Array({col: np.empty(0) for col in columns})
+
+
+def read_nano(input_dir, columns, sd, boundary=1.5):
+    dataset = ds.dataset(input_dir, format="parquet")
+    filter = abs_eta_filter("lead_eta", sd, boundary) & abs_eta_filter("sublead_eta", sd, boundary)
+    missing = [col for col in columns if col not in dataset.schema.names]
+    if missing:
+        logger.warning("Columns {} not found in the nano files of {}, they are not read".format(missing, input_dir))
+    columns = [col for col in columns if col in dataset.schema.names]
+    table = dataset.to_table(columns=columns, filter=filter)
+    if table.num_rows == 0:
+        logger.warning("No nano events in {} pass the {} selection".format(input_dir, sd))
+        return empty_array(columns)
+
+    return ak.from_arrow(table)
+
+
+def read_micro(input_dir, tree_path, columns, sd, aliases=None, boundary=1.5):
+    """
+    Read columns of tree_path from the ROOT files in input_dir; aliases maps names in columns to the
+    branch names to read when the former are not in the tree (e.g. typos in flashgg).
+    A column whose branch is missing in any of the files is not read at all (a warning names the files).
+    """
+    if aliases is None:
+        aliases = {}
+
+    arrays = []
+    missing = {}
+    for fl in sorted(glob.glob("{}/*.root".format(input_dir))):
+        with uproot.open(fl) as f:
+            tree = f[tree_path]
+            keys = set(tree.keys())
+            branches = {}
+            for col in columns:
+                branch = col if col in keys or col not in aliases else aliases[col]
+                if col in eta_columns:
+                    continue
+                if branch in keys:
+                    branches[col] = branch
+                else:
+                    missing.setdefault(col, []).append(fl)
+
+            etas = tree.arrays(eta_columns, library="np")
+            mask = abs_eta_mask(etas["lead_eta"], sd, boundary) & abs_eta_mask(etas["sublead_eta"], sd, boundary)
+            if not np.any(mask):
+                continue
+
+            others = tree.arrays(list(branches.values()), library="np")
+        arrays.append(
+            ak.Array({
+                **{col: etas[col][mask] for col in eta_columns if col in columns},
+                **{col: others[branch][mask] for col, branch in branches.items()},
+            })
+        )
+
+    for col, files in missing.items():
+        logger.warning("Branch {} not found in {} of {}, it is not read".format(col, tree_path, files))
+    columns = [col for col in columns if col not in missing]
+
+    if not arrays:
+        logger.warning("No micro events in {} pass the {} selection".format(input_dir, sd))
+        return empty_array(columns)
+
+    return ak.concatenate([arr[[col for col in arr.fields if col in columns]] for arr in arrays])
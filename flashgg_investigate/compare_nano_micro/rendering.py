@@ -0,0 +1,135 @@
+"""
+Rendering of the nano/micro comparison plots.
+
+The contents of all the histograms (nano, micro, their ratio and the per event percentage difference)
+are computed up front with numpy; the figures, which only need these arrays, are then drawn and saved
+by a pool of processes using the Agg backend.
+"""
+import concurrent.futures
+import json
+import numpy as np
+
+
+perc_range = (-300, 300)
+perc_bins = 500
+
+
+def compute_contents(pd_joined, columns, output_dir, sd):
+    """One job for every entry of plots_specs.json, with the histograms and the summary statistics."""
+    jobs = []
+    for column in columns:
+        nano_name = column["nano_col"]
+        micro_name = column["micro_col"]
+        if nano_name == micro_name:
+            nano_name += "_nano"
+            micro_name += "_micro"
+        nano_values = pd_joined[nano_name].values
+        micro_values = pd_joined[micro_name].values
+
+        n, edges = np.histogram(nano_values, bins=column["bins"], range=column["range"])
+        m, _ = np.histogram(micro_values, bins=edges)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = n / m
+            perc_diff = 100 * (nano_values - micro_values) / micro_values
+        perc, perc_edges = np.histogram(perc_diff, bins=perc_bins, range=perc_range, density=True)
+
+        n_sum, m_sum = float(np.sum(n)), float(np.sum(m))
+        jobs.append({
+            "column": column,
+            "sd": sd,
+            "output_dir": output_dir,
+            "edges": edges,
+            "n": n,
+            "m": m,
+            "ratio": ratio,
+            "perc": perc,
+            "perc_edges": perc_edges,
+            "summary": {
+                "nano": n_sum,
+                "micro": m_sum,
+                "diff": abs(n_sum - m_sum),
+                "rel_diff": 100 * abs(n_sum - m_sum) / max(n_sum, m_sum) if max(n_sum, m_sum) > 0 else 0.,
+            },
+        })
+
+    return jobs
+
+
+def render_figure(job):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import mplhep as hep
+
+    hep.style.use("CMS")
+
+    column = job["column"]
+    edges = job["edges"]
+    centers = (edges[:-1] + edges[1:]) / 2
+    range = column["range"]
+
+    fig, (up, middle, down) = plt.subplots(
+        nrows=3,
+        ncols=1,
+        gridspec_kw={"height_ratios": (2, 1, 1)}
+        )
+
+    # Up
+    up.hist(centers, bins=edges, weights=job["n"], histtype="step", label="NanoAOD", linewidth=2)
+    up.hist(centers, bins=edges, weights=job["m"], histtype="step", label="MicroAOD", linewidth=2)
+
+    up.legend(fontsize=18, loc="upper right")
+    up.set_xlim(range)
+    up.set_xlabel(column["var"])
+    up.set_ylabel("Events")
+    if "log" in column:
+        up.set_yscale("log")
+
+    # Middle
+    middle.set_ylim([0, 2])
+    middle.plot(centers, job["ratio"], "k.")
+    middle.set_xlim(range)
+    middle.set_xlabel(column["var"])
+    middle.set_ylabel("$n/\\mu$")
+    middle.grid(which="both")
+
+    # Down
+    perc_edges = job["perc_edges"]
+    down.hist(
+        (perc_edges[:-1] + perc_edges[1:]) / 2,
+        bins=perc_edges,
+        weights=job["perc"],
+        histtype="step",
+        color="black",
+        linewidth=2)
+    down.set_xlabel("$(n_{ev} - \\mu_{ev})/\\mu_{ev}$ [%]")
+    down.set_ylabel("Events / {}%".format((perc_range[1] - perc_range[0]) / perc_bins))
+
+    fig.tight_layout()
+
+    fig.savefig("{}/{}_{}.png".format(job["output_dir"], column["nano_col"], job["sd"]), bbox_inches='tight')
+    fig.savefig("{}/{}_{}.pdf".format(job["output_dir"], column["nano_col"], job["sd"]), bbox_inches='tight')
+
+    plt.close(fig)
+
+    return column["nano_col"]
+
+
+def write_summary(jobs, output_file):
+    """Print the comparison of the number of events in every histogram and dump it to output_file."""
+    summary = {job["column"]["nano_col"]: job["summary"] for job in jobs}
+    lines = [
+        "{:<40} nano: {:>12.0f} micro: {:>12.0f} diff = {:>10.0f} rel diff = {:.4f}%".format(
+            name, s["nano"], s["micro"], s["diff"], s["rel_diff"])
+        for name, s in summary.items()
+    ]
+    print("\n".join(lines))
+    with open(output_file, "w") as f:
+        json.dump(summary, f, indent=4)
+
+
+def render_all(jobs, n_workers=None):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for name in executor.map(render_figure, jobs):
+            print("Plotted {}".format(name))
@@ -0,0 +1,103 @@
+import argparse
+import time
+import numpy as np
+from itertools import combinations
+from scipy.optimize import minimize
+
+from utils import setup_logging
+from utils.binning import get_edges
+from utils.binning import StreamingQuantiles
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_edges_powell(arr, edge_min, edge_max, n_bins):
+    """Previous implementation of get_edges, kept only as a reference for the benchmark.
+    """
+    big_num = 99999999
+    def compute_total_diff(arr, edge_min, edge_max, *edges_cent):
+        edges = [edge_min] + list(edges_cent) + [edge_max]
+        try:
+            hist, _ = np.histogram(arr, edges)
+        except ValueError:
+            return big_num
+        diff = sum([abs(first - second) for first, second in list(combinations(hist, 2))])
+        return diff
+
+    n_edges = n_bins + 1
+    x0 = np.linspace(edge_min, edge_max, n_edges)
+
+    def diff_to_minimize(edges):
+            return compute_total_diff(arr, edge_min, edge_max, *edges)
+
+    res = minimize(diff_to_minimize, x0=x0[1:-1], method='Powell')
+
+    return [edge_min] + list(res.x) + [edge_max]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark equal-population binning against the Powell optimizer")
+
+    parser.add_argument(
+            "--n-events",
+            type=int,
+            default=1000000,
+            help="Number of toy sigma_m events"
+            )
+
+    parser.add_argument(
+            "--n-bins",
+            type=int,
+            default=5
+            )
+
+    parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100000,
+            help="Chunk size used to fill the streaming estimator"
+            )
+
+    return parser.parse_args()
+
+
+def main(args):
+    logger = setup_logging()
+
+    edge_min = 0.
+    edge_max = 0.035
+    n_bins = args.n_bins
+
+    # Toy sigma_m distribution, roughly shaped like the ggH one
+    rng = np.random.default_rng(42)
+    arr = rng.gamma(4., 0.0025, args.n_events)
+
+    results = {}
+
+    start = time.perf_counter()
+    results["powell"] = get_edges_powell(arr, edge_min, edge_max, n_bins)
+    results["powell_time"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results["quantile"] = get_edges(arr, edge_min, edge_max, n_bins)
+    results["quantile_time"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sq = StreamingQuantiles(edge_min, edge_max)
+    for i in range(0, len(arr), args.chunk_size):
+        sq.fill(arr[i:i + args.chunk_size])
+    results["streaming"] = sq.get_edges(n_bins)
+    results["streaming_time"] = time.perf_counter() - start
+
+    for method in ["powell", "quantile", "streaming"]:
+        counts, _ = np.histogram(arr, results[method])
+        logger.info("{}: {:.3f} s, edges {}, counts {}".format(
+            method, results["{}_time".format(method)], ["{:.5f}".format(e) for e in results[method]], counts
+            ))
+
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    main(args)
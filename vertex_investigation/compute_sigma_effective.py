@@ -1,15 +1,15 @@
-import uproot
 import numpy as np
 import matplotlib.pyplot as plt
-import os
-from itertools import combinations
-from scipy.optimize import minimize
 import mplhep as hep
 
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import tree_name_tmpl
 from utils import setup_logging
+from utils.columnar_cache import read_columns
+from utils.binning import get_edges
+from utils.sigma_effective import sigma_effective_by_category
+from utils.sigma_effective import bootstrap_sigma_effective
 
 import logging
 logger = logging.getLogger(__name__)
@@ -17,39 +17,6 @@ logger = logging.getLogger(__name__)
 hep.set_style("CMS")
 
 
-def get_edges(arr, edge_min, edge_max, n_bins):
-    """Given an array of events (sigmaM_over_M), the range and the number of bins,
-    return the sequence of edges that minimizes the sum of the difference in number 
-    of events between the permutations of pairs of bins.
-    """
-    big_num = 99999999
-    def compute_total_diff(arr, edge_min, edge_max, *edges_cent):
-        edges = [edge_min] + list(edges_cent) + [edge_max]
-        try:
-            hist, _ = np.histogram(arr, edges)
-        except ValueError:
-            return big_num
-        diff = sum([abs(first - second) for first, second in list(combinations(hist, 2))])
-        return diff
-    
-    n_edges = n_bins + 1
-    x0 = np.linspace(edge_min, edge_max, n_edges)
-    
-    def diff_to_minimize(edges):
-            return compute_total_diff(arr, edge_min, edge_max, *edges)
-    
-    res = minimize(diff_to_minimize, x0=x0[1:-1], method='Powell')
-    
-    return [edge_min] + list(res.x) + [edge_max]
-
-
-def sigma_effective(arr):
-    arr.sort()
-    left = np.quantile(arr, 0.16)
-    right = np.quantile(arr, 0.84)
-
-    return right - left 
-
 def rel_diff(a, b):
     return abs(a - b) / max(a, b)
 
@@ -68,13 +35,8 @@ def main(args):
 
     plots_specs = {}
 
-    # Needed names for files and trees
-    file_dirs = {
-            "Vertex 0th": v0_input_dir,
-            "Vertex Reco": vcustom_input_dir
-            }
-
     # Create sigma_m_over_m categories
+    # Each vertex is read only once: categories are then assigned in memory
     logger.info("Creating categories of SigmaMOverM")
     file_format = {
             "Vertex 0th": v0_input_dir + "/" + file_names_tmpl[channel],
@@ -84,47 +46,47 @@ def main(args):
     categories = {}
     smom = "sigma_m" # due to how we defined it in flashgg, it's already divided by M
     for vtx_name, direc in file_format.items():
-        categories[vtx_name] = {}
+        logger.info("Working with vertex {}".format(vtx_name))
+        categories[vtx_name] = []
         plots_specs[vtx_name] = {}
 
-        arr = uproot.concatenate(["{}:{}".format(direc, tree_name)], expressions=[smom], library="ak")
-        arr = np.asarray([ev[0] for ev in arr.to_numpy()])
+        events = read_columns(direc, tree_name, ["mass", "weight", smom], channel, args.cache_dir, args.prune_cache)
 
-        cut_format = "({var} > {min_edge}) & ({var} < {max_edge})"
         edge_min = 0.
         edge_max = 0.035
         n_bins = 5
-        edges = get_edges(arr, edge_min, edge_max, n_bins)
+        edges = get_edges(events[smom], edge_min, edge_max, n_bins)
 
         low = edges[0]
         for high in edges[1:]:
             cat_name = "SigmaMOverM_{:.5f}-{:.5f}".format(low, high)
-            cat_string = cut_format.format(var=smom, min_edge=low, max_edge=high)
-            categories[vtx_name][cat_name] = cat_string
+            categories[vtx_name].append(cat_name)
 
             plots_specs[vtx_name][cat_name] = {}
             plots_specs[vtx_name][cat_name]["range"] = (low, high)
 
             low = high
 
-    logger.info("Created categories {}".format(categories))
+        logger.info("Created categories {}".format(categories[vtx_name]))
 
-    for vtx_name, direc in file_dirs.items():
-        logger.info("Working with vertex {}".format(vtx_name))
-        for cat_name, cut in categories[vtx_name].items():
-            logger.info("Working with category {}".format(cat_name))
-
-            files = [fl for fl in os.listdir(direc) if fl.startswith(file_names_tmpl[channel][:20])]
-
-            events = uproot.concatenate(
-                [direc + "/" + fl + ":" + tree_name for fl in files],
-                ["mass", "weight"],
-                cut,
-                library="np"
-            )
+        # Index of the category for every event, -1 or n_bins if outside [edge_min, edge_max)
+        cat_index = np.digitize(events[smom], edges) - 1
 
-            mass = events["mass"]
-            plots_specs[vtx_name][cat_name]["sigma_effective"] = sigma_effective(mass) 
+        if args.n_bootstrap > 0:
+            for i, cat_name in enumerate(categories[vtx_name]):
+                logger.info("Bootstrapping category {}".format(cat_name))
+                cat_mask = cat_index == i
+                sigma, sigma_unc = bootstrap_sigma_effective(
+                        events["mass"][cat_mask], events["weight"][cat_mask],
+                        n_bootstrap=args.n_bootstrap, n_workers=args.n_workers
+                        )
+                plots_specs[vtx_name][cat_name]["sigma_effective"] = sigma
+                plots_specs[vtx_name][cat_name]["sigma_effective_unc"] = sigma_unc
+        else:
+            sigmas = sigma_effective_by_category(events["mass"], cat_index, n_bins, events["weight"])
+            for cat_name, sigma in zip(categories[vtx_name], sigmas):
+                plots_specs[vtx_name][cat_name]["sigma_effective"] = sigma
+                plots_specs[vtx_name][cat_name]["sigma_effective_unc"] = 0.
 
 
     # Plot
@@ -149,17 +111,18 @@ def main(args):
     fig.suptitle(channel)
 
     for vtx_name, cat_specs in plots_specs.items():
-        ax.plot(
+        ax.errorbar(
                 x_s[vtx_name], 
                 [cat_spec["sigma_effective"] for cat_spec in plots_specs[vtx_name].values()],
-                fmts[vtx_name], 
+                yerr=[cat_spec["sigma_effective_unc"] for cat_spec in plots_specs[vtx_name].values()],
+                fmt=fmts[vtx_name], 
                 label=vtx_name if vtx_name == "Vertex 0th" else r"PV Run2 $H \rightarrow \gamma \gamma$"
                 )
 
     #rax_y = [rel_diff(s0, sc) for s0, sc in zip(
     rax_y = [squared_diff(s0, sc) for s0, sc in zip(
-        [plots_specs["Vertex 0th"][cat]["sigma_effective"] for cat in list(categories["Vertex 0th"].keys())],
-        [plots_specs["Vertex Reco"][cat]["sigma_effective"] for cat in list(categories["Vertex Reco"].keys())]
+        [plots_specs["Vertex 0th"][cat]["sigma_effective"] for cat in categories["Vertex 0th"]],
+        [plots_specs["Vertex Reco"][cat]["sigma_effective"] for cat in categories["Vertex Reco"]]
     )]
 
     #logger.info("Relative differences: {}".format(rax_y))
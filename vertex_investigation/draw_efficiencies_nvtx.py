@@ -1,15 +1,15 @@
-import uproot
 import matplotlib.pyplot as plt
 import numpy as np
 import mplhep as hep
-import ROOT
 
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import tree_name_tmpl
 from utils import setup_logging
+from utils.columnar_cache import read_columns
 from utils import rel_diff_asymm
 from utils.plotting_specs import y_lims
+from utils.efficiency import binned_efficiency
 
 hep.set_style("CMS")
 
@@ -18,30 +18,15 @@ logger = logging.getLogger(__name__)
 
 
 
-def count_fraction(awk_arr, var, limits):
-    """ Given an awkward array, a variable (will be p_t) and a list of values (i.e. list of lists of variable length), loop over these values
-    to compute the fraction of events with diff_z < 1. (cm).
-    Return two lists containing the computed values (for each range) and theis uncertainties.
-    Uncertainties are computed using ROOT.TEfficiency.ClopperPearson, and it is thus a list of elements [low, up]
+def count_fraction(arr, var, edges):
+    """ Given a dictionary of numpy arrays, a variable (will be the number of vertexes) and the bin edges, compute in a single pass
+    the fraction of events with diff_z < 1. (cm) in every bin of var.
+    Return the output of binned_efficiency: values, uncertainties (elements [low, up], Clopper-Pearson)
+    and mean and spread of var in every bin.
     """
-    vals = []
-    uncs = []
-    for rng in limits:
-        logger.info("Working with number of vertexes {}".format(rng))
-        part_arr = awk_arr[[i in rng for i in awk_arr[var]]] # Highly inefficient but no better solution found
-        part_arr['diff_z'] = abs(part_arr.gen_vtx_z - part_arr.vtx_z)
-        total = len(part_arr)
-        passed = len(part_arr[part_arr.diff_z < 1.])
-        frac = passed / total
-        vals.append(frac)
-        unc = [
-                abs(ROOT.TEfficiency.ClopperPearson(total, passed, .68, 0) - frac),
-                abs(ROOT.TEfficiency.ClopperPearson(total, passed, .68, 1) - frac)
-                ]
-        uncs.append(unc)
-
-    return vals, uncs
+    diff_z = np.abs(arr["gen_vtx_z"] - arr["vtx_z"])
 
+    return binned_efficiency(arr[var], diff_z < 1., edges)
 
 
 def main(args):
@@ -68,31 +53,28 @@ def main(args):
     for var, specs in ranges.items():
         logger.info("Working with {}".format(var))
 
-        # Read two trees lazily
+        # Read the two trees, only the needed branches (from the columnar cache)
         imp_variables = [var] + ["vtx_z", "gen_vtx_z", "weight"]
 
-        arr_vtx0 = uproot.lazy(["{}:{}".format(v0_file, tree_name)], imp_variables)
-        arr_vtxc = uproot.lazy(["{}:{}".format(v_custom_file, tree_name)], imp_variables)
+        arr_vtx0 = read_columns(v0_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
+        arr_vtxc = read_columns(v_custom_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
 
-        # Compute quantities
-        var_range = np.arange(*specs["range"])
+        # Compute quantities: bins of two (integer) numbers of vertexes
+        step = 2
+        var_edges = np.arange(specs["range"][0], specs["range"][1] + step, step)
 
-        var_ranges = []
-        start = 0
-        step =  2
-        for i in range(*specs["range"], step):
-            var_ranges.append([i + s for s in range(step)])
-            start = i
+        eff_vtx0 = count_fraction(arr_vtx0, var, var_edges)
+        eff_vtxc = count_fraction(arr_vtxc, var, var_edges)
 
         x_vtx0, x_vtxc, y_vtx0, y_vtxc = {}, {}, {}, {}
-        xs = [rng[:-1] for rng in var_ranges]
+        xs = var_edges[:-1]
         x_vtx0["values"] = xs
         x_vtxc["values"] = xs
-        x_vtx0["unc"] = np.zeros(len(var_ranges))
-        x_vtxc["unc"] = np.zeros(len(var_ranges))
+        x_vtx0["unc"] = np.zeros(len(xs))
+        x_vtxc["unc"] = np.zeros(len(xs))
 
-        y_vtx0["values"], y_vtx0["unc"] = count_fraction(arr_vtx0, var, var_ranges)
-        y_vtxc["values"], y_vtxc["unc"] = count_fraction(arr_vtxc, var, var_ranges)
+        y_vtx0["values"], y_vtx0["unc"] = eff_vtx0["values"], eff_vtx0["unc"]
+        y_vtxc["values"], y_vtxc["unc"] = eff_vtxc["values"], eff_vtxc["unc"]
 
         # Plot
         fig, (ax, rax) = plt.subplots(
@@ -1,15 +1,15 @@
-import uproot
 import matplotlib.pyplot as plt
 import numpy as np
 import mplhep as hep
-import ROOT
 
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import tree_name_tmpl
 from utils import setup_logging
+from utils.columnar_cache import read_columns
 from utils import rel_diff_asymm
 from utils.plotting_specs import y_lims
+from utils.efficiency import binned_efficiency
 
 hep.set_style("CMS")
 
@@ -18,29 +18,15 @@ logger = logging.getLogger(__name__)
 
 
 
-def count_fraction(awk_arr, var, limits):
-    """ Given an awkward array, a variable (will be p_t) and a list of ranges (i.e. list of 2-tuples), loop over the ranges
-    to compute the fraction of events with diff_z < 1. (cm) in every range of var.
-    Return two lists containing the computed values (for each range) and theis uncertainties.
-    Uncertainties are computed using ROOT.TEfficiency.ClopperPearson, and it is thus a list of elements [low, up]
+def count_fraction(arr, var, edges):
+    """ Given a dictionary of numpy arrays, a variable (will be p_t) and the bin edges, compute in a single pass
+    the fraction of events with diff_z < 1. (cm) in every bin of var.
+    Return the output of binned_efficiency: values, uncertainties (elements [low, up], Clopper-Pearson)
+    and mean and spread of var in every bin.
     """
-    vals = []
-    uncs = []
-    for rng in limits:
-        logger.info("Working with range {}".format(rng))
-        part_arr = awk_arr[(awk_arr[var] > rng[0]) & (awk_arr[var] < rng[1])]
-        part_arr['diff_z'] = abs(part_arr.gen_vtx_z - part_arr.vtx_z)
-        total = len(part_arr)
-        passed = len(part_arr[part_arr.diff_z < 1.])
-        frac = passed / total
-        vals.append(frac)
-        unc = [
-                abs(ROOT.TEfficiency.ClopperPearson(total, passed, .68, 0) - frac),
-                abs(ROOT.TEfficiency.ClopperPearson(total, passed, .68, 1) - frac)
-                ]
-        uncs.append(unc)
+    diff_z = np.abs(arr["gen_vtx_z"] - arr["vtx_z"])
 
-    return vals, uncs
+    return binned_efficiency(arr[var], diff_z < 1., edges)
 
 
 def main(args):
@@ -67,31 +53,28 @@ def main(args):
     for var, specs in ranges.items():
         logger.info("Working with {}".format(var))
 
-        # Read two trees lazily
+        # Read the two trees, only the needed branches (from the columnar cache)
         imp_variables = [var] + ["vtx_z", "gen_vtx_z", "weight"]
 
-        arr_vtx0 = uproot.lazy(["{}:{}".format(v0_file, tree_name)], imp_variables)
-        arr_vtxc = uproot.lazy(["{}:{}".format(v_custom_file, tree_name)], imp_variables)
+        arr_vtx0 = read_columns(v0_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
+        arr_vtxc = read_columns(v_custom_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
 
         # Compute quantities
         n_ranges = 35
-        var_range = np.linspace(specs["range"][0], specs["range"][1], n_ranges)
+        var_edges = np.linspace(specs["range"][0], specs["range"][1], n_ranges)
 
-        var_ranges = []
-        inf = var_range[0]
-        for sup in var_range[1:]:
-            var_ranges.append((inf, sup))
-            inf = sup
+        eff_vtx0 = count_fraction(arr_vtx0, var, var_edges)
+        eff_vtxc = count_fraction(arr_vtxc, var, var_edges)
 
         x_vtx0, x_vtxc, y_vtx0, y_vtxc = {}, {}, {}, {}
-        xs = [np.mean(rng) for rng in var_ranges]
+        xs = (var_edges[1:] + var_edges[:-1]) / 2
         x_vtx0["values"] = xs
         x_vtxc["values"] = xs
-        x_vtx0["unc"] = [np.std(arr_vtx0[(arr_vtx0[var] > rng[0]) & (arr_vtx0[var] < rng[1])][var].to_numpy()) for rng in var_ranges]
-        x_vtxc["unc"] = [np.std(arr_vtxc[(arr_vtxc[var] > rng[0]) & (arr_vtxc[var] < rng[1])][var].to_numpy()) for rng in var_ranges]
+        x_vtx0["unc"] = eff_vtx0["x_std"]
+        x_vtxc["unc"] = eff_vtxc["x_std"]
 
-        y_vtx0["values"], y_vtx0["unc"] = count_fraction(arr_vtx0, var, var_ranges)
-        y_vtxc["values"], y_vtxc["unc"] = count_fraction(arr_vtxc, var, var_ranges)
+        y_vtx0["values"], y_vtx0["unc"] = eff_vtx0["values"], eff_vtx0["unc"]
+        y_vtxc["values"], y_vtxc["unc"] = eff_vtxc["values"], eff_vtxc["unc"]
 
         # Plot
         fig, (ax, rax) = plt.subplots(
@@ -1,148 +1,249 @@
-import uproot
 import awkward as ak
 import coffea.hist as hist
 import matplotlib.pyplot as plt
 import numpy as np
 import mplhep as hep
+import time
 import zfit
 from scipy.stats import chisquare
-from rich.logging import RichHandler
+
+from utils import parse_arguments
+from utils import file_names_tmpl
+from utils import tree_name_tmpl
+from utils import setup_logging
+from utils import subdetector_categories
+from utils.columnar_cache import read_columns
+from utils.scheduler import dump_fit_results
+from utils.fit_seeds import FitSeedCache
+from utils.fit_seeds import run_warm_started_fits
 
 import logging
 logger = logging.getLogger(__name__)
 
 hep.set_style("CMS")
 
-def setup_logging(level=logging.INFO):
-    logger = logging.getLogger()
-
-    logger.setLevel(level)
-    formatter = logging.Formatter("%(message)s")
-
-    stream_handler = RichHandler(show_time=False, rich_tracebacks=True)
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
 
-    return logger
+fit_range = [115, 135]
+parameter_names = ["mu1", "sigma1", "mu2", "sigma2", "n", "alpha", "frac"]
+binned_fit_bins = 400
 
 
-def EBEB_mask(df):
-    return np.maximum(abs(df.lead_eta), abs(df.sublead_eta)) < 1.5
-
-def EBEE_mask(df):
-    return np.logical_and(
-            np.minimum(abs(df.lead_eta), abs(df.sublead_eta)) < 1.5,
-            np.maximum(abs(df.lead_eta), abs(df.sublead_eta)) > 1.5
-            )
-
-def EEEE_mask(df):
-    return np.maximum(abs(df.lead_eta), abs(df.sublead_eta)) > 1.5
-
-def format_fit_info(data, result, res,*args):
-    mu1_est = result.params[args[0]]["value"]
-    sigma1_est = result.params[args[1]]["value"]
-    mu2_est = result.params[args[2]]["value"]
-    sigma2_est = result.params[args[3]]["value"]
-    n_est = result.params[args[4]]["value"]
-    alpha_est = result.params[args[5]]["value"]
-    frac_est = result.params[args[6]]["value"]
-
-    mu1_err = result.params[args[0]]["minuit_hesse"]["error"]
-    sigma1_err = result.params[args[1]]["minuit_hesse"]["error"]
-    mu2_err = result.params[args[2]]["minuit_hesse"]["error"]
-    sigma2_err = result.params[args[3]]["minuit_hesse"]["error"]
-    n_err = result.params[args[4]]["minuit_hesse"]["error"]
-    alpha_err = result.params[args[5]]["minuit_hesse"]["error"]
-    frac_err = result.params[args[6]]["minuit_hesse"]["error"]
-
+def format_fit_info(data, params, res):
     s = "Data:\n" \
             + "mass = {:.5f} +/- {:.5f}\n".format(np.mean(data["mass"]), np.std(data["mass"])) \
             + "sigma_m_over_m = {:.5f} +/- {:.5f}\n".format(np.mean(data["sigma_m"]), np.std(data["sigma_m"])) \
             + "\n" \
             + "Fit:\n" \
-            + "mass1 = {:.5f} +/- {:.5f}\n".format(mu1_est, mu1_err) \
-            + "sigma1 = {:.5f} +/- {:.5f}\n".format(sigma1_est, sigma1_err) \
-            + "mass2 = {:.5f} +/- {:.5f}\n".format(mu2_est, mu2_err) \
-            + "sigma2 = {:.5f} +/- {:.5f}\n".format(sigma2_est, sigma2_err) \
-            + "n = {:.5f} +/- {:.5f}\n".format(n_est, n_err) \
-            + "alpha = {:.5f} +/- {:.5f}\n".format(alpha_est, alpha_err) \
-            + "frac = {:.5f} +/- {:.5f}\n".format(frac_est, frac_err) \
+            + "mass1 = {:.5f} +/- {:.5f}\n".format(params["mu1"]["value"], params["mu1"]["error"]) \
+            + "sigma1 = {:.5f} +/- {:.5f}\n".format(params["sigma1"]["value"], params["sigma1"]["error"]) \
+            + "mass2 = {:.5f} +/- {:.5f}\n".format(params["mu2"]["value"], params["mu2"]["error"]) \
+            + "sigma2 = {:.5f} +/- {:.5f}\n".format(params["sigma2"]["value"], params["sigma2"]["error"]) \
+            + "n = {:.5f} +/- {:.5f}\n".format(params["n"]["value"], params["n"]["error"]) \
+            + "alpha = {:.5f} +/- {:.5f}\n".format(params["alpha"]["value"], params["alpha"]["error"]) \
+            + "frac = {:.5f} +/- {:.5f}\n".format(params["frac"]["value"], params["frac"]["error"]) \
             + "\n" \
-            + "chiSq / ndof = {:.5f}\n".format(res.statistic) \
-            + "p_value = {:.5f}\n".format(res.pvalue)
+            + "chiSq / ndof = {:.5f}\n".format(res["statistic"]) \
+            + "p_value = {:.5f}\n".format(res["pvalue"])
 
     return s
 
 
+def build_model(obs, suffix, seeds=None):
+    """Create Gauss + Crystal Ball with zfit, with parameter names unique to suffix, so that
+    no parameter is shared between fits; if seeds (name: value) are given, they are used as
+    starting values.
+    Return the model and the list of parameters in the order of parameter_names.
+    """
+    mu1 = zfit.Parameter("mu1_{}".format(suffix), 125, 120, 130)
+    sigma1 = zfit.Parameter("sigma1_{}".format(suffix), 1, 0.1, 10)
+    mu2 = zfit.Parameter("mu2_{}".format(suffix), 125, 120, 130)
+    sigma2 = zfit.Parameter("sigma2_{}".format(suffix), 1, 0.1, 10)
+    n = zfit.Parameter("n_{}".format(suffix), 1, 0, 10)
+    alpha = zfit.Parameter("alpha_{}".format(suffix), 1, 0, 10)
+    frac = zfit.Parameter("frac_{}".format(suffix), 0.5, 0, 1)
+    parameters = [mu1, sigma1, mu2, sigma2, n, alpha, frac]
+
+    if seeds is not None:
+        for name, par in zip(parameter_names, parameters):
+            if name in seeds:
+                par.set_value(min(max(seeds[name], par.lower), par.upper))
 
-def main():
-    logger = setup_logging()
+    gauss = zfit.pdf.Gauss(obs=obs, mu=mu1, sigma=sigma1)
+    cb = zfit.pdf.CrystalBall(obs=obs, mu=mu2, sigma=sigma2, n=n, alpha=alpha)
 
-    # Needed names for files and trees
-    v0_file = "/work/gallim/root_files/vertex_investigation/VertexInvestigation_vtx0/output_GluGluHToGG_M125_TuneCP5_13TeV-amcatnloFXFX-pythia8_storeWeights_alesauva-UL2018_0-10_6_4-v0-RunIISummer19UL18MiniAOD-106X_upgrade2018_realistic_v11_L1v1-v1-3f96409841a3cc85b911eb441562baae_USER_*.root"
-    v_custom_file = "/work/gallim/root_files/vertex_investigation/VertexInvestigation/output_GluGluHToGG_M125_TuneCP5_13TeV-amcatnloFXFX-pythia8_storeWeights_alesauva-UL2018_0-10_6_4-v0-RunIISummer19UL18MiniAOD-106X_upgrade2018_realistic_v11_L1v1-v1-3f96409841a3cc85b911eb441562baae_USER_*.root"
+    model = zfit.pdf.SumPDF(pdfs=[gauss, cb], fracs=frac)
 
-    tree_name = "diphotonDumper/trees/ggH_125_13TeV_All_$SYST"
+    return model, parameters
 
-    output_dir = "/eos/home-g/gallim/www/plots/Hgg/VertexInvestigation/mass_fit"
 
-    # Read two trees lazily
-    imp_variables = ["weight", "lead_eta", "sublead_eta", "sigma_m", "mass"]
+def minimize_and_collect(loss, parameters):
+    """Minimize loss and return the fitted values and errors of parameters, and the number of
+    function calls of the minimization.
+    With weighted data, hesse errors are corrected with the asymptotic method.
+    """
+    minimizer = zfit.minimize.Minuit()
+    result = minimizer.minimize(loss)
+    result.hesse(name="minuit_hesse", weightcorr="asymptotic")
+
+    params = {
+            name: {
+                "value": float(result.params[par]["value"]),
+                "error": float(result.params[par]["minuit_hesse"]["error"])
+                } for name, par in zip(parameter_names, parameters)
+            }
 
-    arr_vtx0 = uproot.lazy(["{}:{}".format(v0_file, tree_name)], imp_variables)
-    arr_vtxc = uproot.lazy(["{}:{}".format(v_custom_file, tree_name)], imp_variables)
+    return params, int(result.info["n_eval"])
 
-    arrays = {
-            "vtx0": arr_vtx0,
-            "vtxc": arr_vtxc
-            }
 
-    # Define categories
-    categories = {
-            "EBEB": EBEB_mask,
-            "EBEE": EBEE_mask,
-            "EEEE": EEEE_mask
-            }
+def fit_unbinned(mass_arr, weight_arr, suffix, seeds=None):
+    obs = zfit.Space("M", limits=fit_range)
+    model, parameters = build_model(obs, suffix, seeds)
 
-    masked_arrays = {
-            "EBEB": {},
-            "EBEE": {},
-            "EEEE": {}
-            }
+    data = zfit.Data.from_numpy(obs=obs, array=mass_arr, weights=weight_arr)
+    nll = zfit.loss.UnbinnedNLL(model=model, data=data)
 
-    histos = {}
+    return (model, *minimize_and_collect(nll, parameters))
+
+
+def fit_binned(mass_arr, weight_arr, suffix, seeds=None):
+    """Extended binned likelihood fit on binned_fit_bins bins: the cost of each evaluation
+    depends on the number of bins instead of the number of events.
+    """
+    obs = zfit.Space("M", limits=fit_range)
+    binned_obs = zfit.Space("M", binning=zfit.binned.RegularBinning(binned_fit_bins, *fit_range, name="M"))
+    model, parameters = build_model(obs, suffix, seeds)
+
+    total = np.sum(weight_arr)
+    n_sig = zfit.Parameter("n_sig_{}".format(suffix), total, 0., 10 * abs(total))
+    binned_model = zfit.pdf.BinnedFromUnbinnedPDF(model.create_extended(n_sig), binned_obs)
+
+    data = zfit.Data.from_numpy(obs=obs, array=mass_arr, weights=weight_arr).to_binned(binned_obs)
+    nll = zfit.loss.ExtendedBinnedNLL(model=binned_model, data=data)
+
+    return (model, *minimize_and_collect(nll, parameters))
 
-    fits = {
-            "EBEB": {},
-            "EBEE": {},
-            "EEEE": {}
+
+def fit_category(task):
+    """Fit the mass distribution of one (vertex, category) to Gauss + Crystal Ball with zfit.
+    Run in a worker process by run_fits.
+    If task["validate"] is set, both the binned and unbinned fits are performed and their
+    parameters and fit times are compared.
+    """
+    suffix = "{}_{}".format(task["vertex"], task["category"])
+
+    in_range = (task["mass"] >= fit_range[0]) & (task["mass"] <= fit_range[1])
+    mass_arr = task["mass"][in_range]
+    weight_arr = task["weight"][in_range]
+
+    fit_functions = {
+            "binned": fit_binned,
+            "unbinned": fit_unbinned
+            }
+    modes = ["binned", "unbinned"] if task["validate"] else ["binned" if task["binned"] else "unbinned"]
+
+    fit_results = {}
+    for mode in modes:
+        start = time.perf_counter()
+        model, params, n_calls = fit_functions[mode](mass_arr, weight_arr, "{}_{}".format(suffix, mode), task["seeds"])
+        fit_results[mode] = {"model": model, "params": params, "n_calls": n_calls, "time": time.perf_counter() - start}
+
+    main_mode = "binned" if task["binned"] else "unbinned"
+    model = fit_results[main_mode]["model"]
+    params = fit_results[main_mode]["params"]
+
+    # Compute chi-square and p-value
+    bins = task["bins"]
+    observed_values, observed_edges = np.histogram(mass_arr, bins, fit_range, weights=weight_arr)
+    observed_centers = .5*(observed_edges[1:] + observed_edges[:-1])
+    expected_values = model.pdf(observed_centers).numpy()
+    expected_values *= np.sum(observed_values) / np.sum(expected_values)
+    res = chisquare(observed_values, f_exp=expected_values)
+
+    # Model values for plots
+    x = np.linspace(*fit_range, 1000)
+
+    result = {
+            "mode": main_mode,
+            "params": params,
+            "fit_time": fit_results[main_mode]["time"],
+            "n_calls": fit_results[main_mode]["n_calls"],
+            "chi_square": {"statistic": float(res.statistic), "pvalue": float(res.pvalue)},
+            "model_x": x.tolist(),
+            "model_y": model.pdf(x, norm_range=fit_range).numpy().tolist()
             }
 
-    # Define zfit objects for fits
-    logger.info("Creating zfit objects")
+    if task["validate"]:
+        result["validation"] = {
+                "time_binned": fit_results["binned"]["time"],
+                "time_unbinned": fit_results["unbinned"]["time"],
+                "params": {
+                    name: {
+                        "binned": fit_results["binned"]["params"][name],
+                        "unbinned": fit_results["unbinned"]["params"][name],
+                        # Difference in units of the unbinned uncertainty
+                        "pull": (fit_results["binned"]["params"][name]["value"] - fit_results["unbinned"]["params"][name]["value"]) \
+                                / fit_results["unbinned"]["params"][name]["error"]
+                        } for name in parameter_names
+                    }
+                }
 
-    fit_range = [115, 135]
-    obs = zfit.Space("M", limits=fit_range)
-    mu1 = zfit.Parameter("mu1", 125, 120, 130)
-    sigma1 = zfit.Parameter("sigma1", 1, 0.1, 10)
-    mu2 = zfit.Parameter("mu2", 125, 120, 130)
-    sigma2 = zfit.Parameter("sigma2", 1, 0.1, 10)
-    n = zfit.Parameter("n", 1, 0, 10)
-    alpha = zfit.Parameter("alpha", 1, 0, 10)
-    frac = zfit.Parameter("frac", 0.5, 0, 1)
+    return result
 
-    gauss = zfit.pdf.Gauss(obs=obs, mu=mu1, sigma=sigma1)
-    cb = zfit.pdf.CrystalBall(obs=obs, mu=mu2, sigma=sigma2, n=n, alpha=alpha)
 
-    model = zfit.pdf.SumPDF(pdfs=[gauss, cb], fracs=frac)
+def format_validation_report(fits):
+    """Summary table comparing binned and unbinned fits, from the output of run_fits.
+    """
+    lines = ["{:<10}{:<8}{:<10}{:>12}{:>12}{:>10}".format("vertex", "cat", "param", "binned", "unbinned", "pull")]
+    for vtx_name, cat_fits in fits.items():
+        for cat_name, fit in cat_fits.items():
+            if "validation" not in fit:
+                continue
+            validation = fit["validation"]
+            for name, par in validation["params"].items():
+                lines.append("{:<10}{:<8}{:<10}{:>12.5f}{:>12.5f}{:>10.3f}".format(
+                    vtx_name, cat_name, name, par["binned"]["value"], par["unbinned"]["value"], par["pull"]
+                    ))
+            lines.append("{:<10}{:<8}{:<10}{:>11.1f}s{:>11.1f}s".format(
+                vtx_name, cat_name, "time", validation["time_binned"], validation["time_unbinned"]
+                ))
 
-    minimizer = zfit.minimize.Minuit()
+    return "\n".join(lines)
+
+
+def main(args):
+    logger = setup_logging()
+
+    v0_input_dir = args.v0_input_dir
+    vcustom_input_dir = args.vcustom_input_dir
+    output_dir = args.output_dir
+    channel = args.channel
+
+    tree_name = tree_name_tmpl.format(channel)
+
+    # Needed names for files and trees
+    v0_file = v0_input_dir + "/" + file_names_tmpl[channel]
+    v_custom_file = vcustom_input_dir + "/" + file_names_tmpl[channel]
+
+    # Read the two trees, only the needed branches (from the columnar cache)
+    imp_variables = ["weight", "lead_eta", "sublead_eta", "sigma_m", "mass"]
+
+    arr_vtx0 = read_columns(v0_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
+    arr_vtxc = read_columns(v_custom_file, tree_name, imp_variables, channel, args.cache_dir, args.prune_cache)
+
+    arrays = {
+            "vtx0": arr_vtx0,
+            "vtxc": arr_vtxc
+            }
+
+    masked_arrays = {cat_name: {} for cat_name in subdetector_categories}
+
+    histos = {}
 
     variables = [
             {
                 "name": "mass",
                 "bins": 100,
-                "range": [115, 135]
+                "range": fit_range
             },
             {
                 "name": "sigma_m",
@@ -152,10 +253,12 @@ def main():
         ]
 
     # Loop over categories
-    for cat_name, func in categories.items():
+    tasks = []
+    for cat_name, func in subdetector_categories.items():
         logger.info("Working with category {}".format(cat_name))
         for vtx_name, arr in arrays.items():
-            masked_arrays[cat_name][vtx_name] = arr[func(arr)]
+            cat_mask = func(arr)
+            masked_arrays[cat_name][vtx_name] = {var: values[cat_mask] for var, values in arr.items()}
 
         histos[cat_name] = hist.Hist(
                 "Density",
@@ -179,53 +282,83 @@ def main():
             fig.savefig("{}/{}.png".format(output_dir, output_name), bbox_inches='tight')
             fig.savefig("{}/{}.pdf".format(output_dir, output_name), bbox_inches='tight')
 
-        # Fits
-        logger.info("Proceed with fits")
-        x = np.linspace(115, 135, 1000) # x values for model in plots
         for vtx_name, arr in masked_arrays[cat_name].items():
-            data = zfit.Data.from_numpy(obs=obs, array=arr["mass"].to_numpy())
-            nll = zfit.loss.UnbinnedNLL(model=model, data=data)
-            fits[cat_name]["result"] = minimizer.minimize(nll)
-            fits[cat_name]["param_errors"] = fits[cat_name]["result"].hesse()
-
-            # Compute chi-square and p-value
-            logger.info("Computing goodness of fit")
-            parameters = [mu1, sigma1, mu2, sigma2, n, alpha, frac]
-            observed_values, observed_edges = np.histogram(arr["mass"].to_numpy(), variables[0]["bins"], variables[0]["range"])
-            observed_centers = .5*(observed_edges[1:] + observed_edges[:-1])
-            plot_scale = len(arr["mass"]) / variables[0]["bins"] * obs.area().numpy()
-            expected_values = model.pdf(observed_centers).numpy() * plot_scale
-            res = chisquare(observed_values, f_exp=expected_values)
-            textstr = format_fit_info(arr, fits[cat_name]["result"], res, *parameters)
-            logger.info(textstr)
-
-            # Plot superimposed histogram and model
-            logger.info("Creating plot for category {}, vertex {} with model".format(cat_name, vtx_name))
-            fig, ax = plt.subplots()
-            y = model.pdf(x, norm_range=fit_range).numpy()
-            plt.plot(x, y, label="Model")
-            err_opts = {
-                'linestyle': 'none',
-                'marker': '.',
-                'markersize': 10.,
-                'color': 'k',
-                'elinewidth': 1,
-                }
-            hist.plot1d(
-                    histos[cat_name].sum("sigma_m")[vtx_name],
-                    density=True,
-                    error_opts=err_opts
-                    )
+            tasks.append({
+                "channel": channel,
+                "vertex": vtx_name,
+                "category": cat_name,
+                "mass": arr["mass"],
+                "weight": arr["weight"],
+                "bins": variables[0]["bins"],
+                "binned": args.binned,
+                "validate": args.validate_binned,
+                "model": "gauss_cb_zfit_binned" if args.binned else "gauss_cb_zfit"
+                })
+
+    # Fits can be warm-started from the same category of the other vertex
+    # and from the neighbouring subdetector categories
+    cat_names = list(subdetector_categories)
+    for task in tasks:
+        i = cat_names.index(task["category"])
+        task["neighbours"] = [
+                (channel, vtx_name, task["category"]) for vtx_name in arrays if vtx_name != task["vertex"]
+                ] + [
+                (channel, task["vertex"], cat_names[j]) for j in [i - 1, i + 1] if 0 <= j < len(cat_names)
+                ]
+
+    # Fits
+    logger.info("Proceed with fits")
+    all_fits = run_warm_started_fits(
+            fit_category,
+            tasks,
+            FitSeedCache(args.seed_cache),
+            n_workers=args.n_workers
+            )
+    dump_fit_results(all_fits, "fit_results_zfit.json")
+    fits = all_fits[channel]
+
+    if args.validate_binned:
+        report = format_validation_report(fits)
+        logger.info("Binned vs unbinned fits:\n{}".format(report))
+        with open("{}/binned_validation_{}.txt".format(output_dir, channel), "w") as fl:
+            fl.write(report)
+
+    for task in tasks:
+        vtx_name, cat_name = task["vertex"], task["category"]
+        fit = fits[vtx_name][cat_name]
+        if fit["status"] != "ok":
+            continue
+
+        textstr = format_fit_info(masked_arrays[cat_name][vtx_name], fit["params"], fit["chi_square"])
+        logger.info(textstr)
+
+        # Plot superimposed histogram and model
+        logger.info("Creating plot for category {}, vertex {} with model".format(cat_name, vtx_name))
+        fig, ax = plt.subplots()
+        plt.plot(fit["model_x"], fit["model_y"], label="Model")
+        err_opts = {
+            'linestyle': 'none',
+            'marker': '.',
+            'markersize': 10.,
+            'color': 'k',
+            'elinewidth': 1,
+            }
+        hist.plot1d(
+                histos[cat_name].sum("sigma_m")[vtx_name],
+                density=True,
+                error_opts=err_opts
+                )
 
-            # Stats box
-            props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
-            ax.text(0.05, 0.95, textstr, transform=ax.transAxes, fontsize=12, verticalalignment='top', bbox=props)
+        # Stats box
+        props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
+        ax.text(0.05, 0.95, textstr, transform=ax.transAxes, fontsize=12, verticalalignment='top', bbox=props)
 
-            output_name = "mass_{}_{}_with_model".format(vtx_name, cat_name)
-            hep.cms.label(loc=0, data=True, llabel="Work in Progress", rlabel="", ax=ax, pad=.05)
-            fig.savefig("{}/{}.png".format(output_dir, output_name), bbox_inches='tight')
-            fig.savefig("{}/{}.pdf".format(output_dir, output_name), bbox_inches='tight')
+        output_name = "mass_{}_{}_with_model".format(vtx_name, cat_name)
+        hep.cms.label(loc=0, data=True, llabel="Work in Progress", rlabel="", ax=ax, pad=.05)
+        fig.savefig("{}/{}.png".format(output_dir, output_name), bbox_inches='tight')
+        fig.savefig("{}/{}.pdf".format(output_dir, output_name), bbox_inches='tight')
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_arguments()
+    main(args)
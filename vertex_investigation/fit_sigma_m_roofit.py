@@ -1,16 +1,83 @@
 import ROOT
-import os
-from array import array
 
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import tree_name_tmpl
 from utils import setup_logging
+from utils import subdetector_categories
+from utils.columnar_cache import read_columns
+from utils.roofit_data import weighted_dataset
+from utils.roofit_data import binned_dataset
+from utils.scheduler import run_fits
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+def fit_category(task):
+    """Fit the mass distribution of one (vertex, category) to Gauss + Crystal Ball.
+    Run in a worker process by run_fits, task contains the mass and weight arrays of the category.
+    """
+    ROOT.gROOT.SetBatch(True)
+
+    vtx_name = task["vertex"]
+    cat_name = task["category"]
+    output_dir = task["output_dir"]
+
+    # RooFit objects
+    mass = ROOT.RooRealVar("mass", "Invariant mass [GeV]", 125, 115, 135)
+    weight = ROOT.RooRealVar("weight", "weight", -1, 1)
+    mu = ROOT.RooRealVar("mu", "mu", 125, 120, 135)
+    sigma = ROOT.RooRealVar("sigma", "sigma", 1, 0.1, 10)
+    mu_cb = ROOT.RooRealVar("mu_cb", "mu_cb", 125, 100, 140)
+    sigma_cb = ROOT.RooRealVar("sigma_cb", "sigma_cb", 4, 0.1, 10)
+    alpha = ROOT.RooRealVar("alpha", "alpha", 1, 0, 20)
+    n = ROOT.RooRealVar("n", "n", 1, 0, 5)
+    frac = ROOT.RooRealVar("frac", "frac", 0.5, 0., 1.)
+
+    gauss = ROOT.RooGaussian("gauss", "gauss", mass, mu, sigma)
+    cb = ROOT.RooCBShape("cb", "cb", mass, mu_cb, sigma_cb, alpha, n)
+
+    model = ROOT.RooAddPdf("model", "model", ROOT.RooArgList(gauss, cb), ROOT.RooArgList(frac))
+
+    # Create (weighted) dataset
+    if task["binned"]:
+        data = binned_dataset("data", mass, task["mass"], task["weight"])
+    else:
+        data = weighted_dataset("data", mass, weight, task["mass"], task["weight"])
+
+    # Fit in subrange
+    mass.setRange("higgs", 120, 130)
+    logger.info("Performing fit")
+    fit_result = fit_result = model.fitTo(
+            data,
+            ROOT.RooFit.Range("higgs"),
+            ROOT.RooFit.Save(1),
+            ROOT.RooFit.AsymptoticError(1)
+            )
+
+    # Plot decoration
+    mass_frame = mass.frame(ROOT.RooFit.Title("Mass-{}-{}".format(vtx_name, cat_name)))
+    mass_frame.GetYaxis().SetTitleOffset(1.6)
+    data.plotOn(mass_frame, ROOT.RooFit.DataError(ROOT.RooAbsData.SumW2))
+    model.plotOn(mass_frame, ROOT.RooFit.LineColor(getattr(ROOT, task["color"])))
+    chi_sq = mass_frame.chiSquare()
+    model.paramOn(mass_frame, ROOT.RooFit.Layout(0.65), ROOT.RooFit.Label("chiSq / ndof = {:.5f}".format(chi_sq)))
+    #data.statOn(mass_frame, ROOT.RooFit.Layout(0.46, 0.12, 0.95))
+
+    # Dump plots
+    logger.info("Dumping plots")
+    c = ROOT.TCanvas("", "")
+    mass_frame.Draw()
+    c.SaveAs("{}/mass_{}_{}.png".format(output_dir, vtx_name, cat_name))
+    c.SaveAs("{}/mass_{}_{}.pdf".format(output_dir, vtx_name, cat_name))
+
+    result = {var.GetName(): {"value": var.getVal(), "error": var.getError()} for var in fit_result.floatParsFinal()}
+    result["chi_sq"] = chi_sq
+
+    return result
+
+
 def main(args):
     logger = setup_logging()
 
@@ -22,9 +89,9 @@ def main(args):
     tree_name = tree_name_tmpl.format(channel)
 
     # Needed names for files and trees
-    file_dirs = {
-            "v0": v0_input_dir,
-            "vcustom": vcustom_input_dir
+    file_format = {
+            "v0": v0_input_dir + "/" + file_names_tmpl[channel],
+            "vcustom": vcustom_input_dir + "/" + file_names_tmpl[channel]
             }
 
     fit_colors = {
@@ -32,83 +99,32 @@ def main(args):
             "vcustom": "kRed"
             }
 
-    tree_name = "diphotonDumper/trees/ggH_125_13TeV_All_$SYST"
-
-    categories = {
-            "EBEB": "max(abs(lead_eta), abs(sublead_eta)) < 1.5",
-            "EBEE": "min(abs(lead_eta), abs(sublead_eta)) < 1.5 && max(abs(lead_eta), abs(sublead_eta)) > 1.5",
-            "EEEE" : "max(abs(lead_eta), abs(sublead_eta)) > 1.5"
-            }
-
-    for vtx_name, direc in file_dirs.items():
+    # Each vertex is read only once, the events of every category are then passed to the fits
+    tasks = []
+    for vtx_name, direc in file_format.items():
         logger.info("Working with vertex {}".format(vtx_name))
-        for cat_name, cut in categories.items():
-            logger.info("Working with category {}".format(cat_name))
-
-            chain = ROOT.TChain()
-            files = [fl for fl in os.listdir(direc) if fl.startswith(file_names_tmpl[channel][:20])]
-            for fl in files:
-                chain.Add("{}/{}/{}".format(direc, fl, tree_name))
-            rdf = ROOT.RDataFrame(chain)
-            rdf_cut = rdf.Filter(cut)
-            mass_arr = rdf_cut.Take[float]("mass").GetValue()
-            weight_arr = rdf_cut.Take[float]("weight").GetValue()
-            mass_fake_arr = array("d", [0.])
-            weight_fake_arr = array("d", [0.])
-            cut_tree = ROOT.TTree("cut_tree", "cut_tree")
-            cut_tree.Branch("mass", mass_fake_arr, "mass/D")
-            cut_tree.Branch("weight", weight_fake_arr, "weight/D")
-            for ev_mass, ev_weight in zip(mass_arr, weight_arr):
-                mass_fake_arr[0] = ev_mass
-                weight_fake_arr[0] = ev_weight
-                cut_tree.Fill()
-
-            # RooFit objects
-            mass = ROOT.RooRealVar("mass", "Invariant mass [GeV]", 125, 115, 135)
-            weight = ROOT.RooRealVar("weight", "weight", -1, 1)
-            mu = ROOT.RooRealVar("mu", "mu", 125, 120, 135)
-            sigma = ROOT.RooRealVar("sigma", "sigma", 1, 0.1, 10)
-            mu_cb = ROOT.RooRealVar("mu_cb", "mu_cb", 125, 100, 140)
-            sigma_cb = ROOT.RooRealVar("sigma_cb", "sigma_cb", 4, 0.1, 10)
-            alpha = ROOT.RooRealVar("alpha", "alpha", 1, 0, 20)
-            n = ROOT.RooRealVar("n", "n", 1, 0, 5)
-            frac = ROOT.RooRealVar("frac", "frac", 0.5, 0., 1.)
-
-            gauss = ROOT.RooGaussian("gauss", "gauss", mass, mu, sigma)
-            cb = ROOT.RooCBShape("cb", "cb", mass, mu_cb, sigma_cb, alpha, n)
-
-            model = ROOT.RooAddPdf("model", "model", ROOT.RooArgList(gauss, cb), ROOT.RooArgList(frac))
-
-            # Create (weighted) dataset
-            data = ROOT.RooDataSet("data".format(cat_name), "data".format(cat_name), cut_tree, ROOT.RooArgSet(mass, weight), "", weight.GetName())
-
-            # Fit in subrange
-            mass.setRange("higgs", 120, 130)
-            logger.info("Performing fit")
-            fit_result = fit_result = model.fitTo(
-                    data, 
-                    ROOT.RooFit.Range("higgs"), 
-                    ROOT.RooFit.Save(1),
-                    ROOT.RooFit.AsymptoticError(1)
-                    )
-
-            # Plot decoration
-            mass_frame = mass.frame(ROOT.RooFit.Title("Mass-{}-{}".format(vtx_name, cat_name)))
-            mass_frame.GetYaxis().SetTitleOffset(1.6)
-            data.plotOn(mass_frame, ROOT.RooFit.DataError(ROOT.RooAbsData.SumW2))
-            model.plotOn(mass_frame, ROOT.RooFit.LineColor(getattr(ROOT, fit_colors[vtx_name])))
-            chi_sq = mass_frame.chiSquare()
-            model.paramOn(mass_frame, ROOT.RooFit.Layout(0.65), ROOT.RooFit.Label("chiSq / ndof = {:.5f}".format(chi_sq)))
-            #data.statOn(mass_frame, ROOT.RooFit.Layout(0.46, 0.12, 0.95))
-
-            # Dump plots
-            logger.info("Dumping plots")
-            c = ROOT.TCanvas("", "")
-            mass_frame.Draw()
-            c.SaveAs("{}/mass_{}_{}.png".format(output_dir, vtx_name, cat_name))
-            c.SaveAs("{}/mass_{}_{}.pdf".format(output_dir, vtx_name, cat_name))
-
-            del mu, sigma, mu_cb, sigma_cb, alpha, n, frac, gauss, cb, model, fit_result, mass_frame
+
+        events = read_columns(direc, tree_name, ["mass", "weight", "lead_eta", "sublead_eta"], channel, args.cache_dir, args.prune_cache)
+
+        for cat_name, func in subdetector_categories.items():
+            cat_mask = func(events)
+            tasks.append({
+                "channel": channel,
+                "vertex": vtx_name,
+                "category": cat_name,
+                "mass": events["mass"][cat_mask],
+                "weight": events["weight"][cat_mask],
+                "color": fit_colors[vtx_name],
+                "binned": args.binned,
+                "output_dir": output_dir
+                })
+
+    run_fits(
+            fit_category,
+            tasks,
+            "fit_results_roofit.json",
+            n_workers=args.n_workers
+            )
 
 
 
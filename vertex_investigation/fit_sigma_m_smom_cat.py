@@ -1,56 +1,111 @@
 import ROOT
-import uproot
 import numpy as np
-import os
-from array import array
-from itertools import combinations
-from scipy.optimize import minimize
-import pickle
+import time
 
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import tree_name_tmpl
 from utils import setup_logging
+from utils.columnar_cache import read_columns
+from utils.roofit_data import weighted_dataset
+from utils.roofit_data import binned_dataset
+from utils.binning import get_edges
+from utils.scheduler import dump_fit_results
+from utils.fit_seeds import FitSeedCache
+from utils.fit_seeds import run_warm_started_fits
+from utils.fit_seeds import seed_roofit_parameters
+from utils.propagation import parameters_by_name
+from utils.propagation import propagate
+from utils.propagation import propagate_toys
+from utils.propagation import sum_effective_sigma
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def get_edges(arr, edge_min, edge_max, n_bins):
-    """Given an array of events (sigmaM_over_M), the range and the number of bins,
-    return the sequence of edges that minimizes the sum of the difference in number 
-    of events between the permutations of pairs of bins.
-    """
-    big_num = 99999999
-    def compute_total_diff(arr, edge_min, edge_max, *edges_cent):
-        edges = [edge_min] + list(edges_cent) + [edge_max]
-        try:
-            hist, _ = np.histogram(arr, edges)
-        except ValueError:
-            return big_num
-        diff = sum([abs(first - second) for first, second in list(combinations(hist, 2))])
-        return diff
-    
-    n_edges = n_bins + 1
-    x0 = np.linspace(edge_min, edge_max, n_edges)
-    
-    def diff_to_minimize(edges):
-            return compute_total_diff(arr, edge_min, edge_max, *edges)
-    
-    res = minimize(diff_to_minimize, x0=x0[1:-1], method='Powell')
-    
-    return [edge_min] + list(res.x) + [edge_max]
+# Parameters entering the effective sigma of the double Crystal Ball, in the order expected by sum_effective_sigma
+eff_sigma_parameters = ["sigma1", "sigma2", "frac"]
 
 
-def eff_sigma_unc(
-        d_sigma_eff_over_v_gauss, d_sigma_eff_over_v_cb,
-        d_sigma_eff_over_frac,
-        v_v_gauss, v_v_cb, v_frac,
-        cov_v_gauss_v_cb, cov_v_gauss_frac, cov_v_cb_frac):
+def fit_category(task):
+    """Fit the mass distribution of one (vertex, category) to a double Crystal Ball.
+    Run in a worker process by run_fits, task contains the mass and weight arrays of the category.
+    """
+    ROOT.gROOT.SetBatch(True)
 
-    var = d_sigma_eff_over_v_gauss**2 * v_v_gauss + d_sigma_eff_over_v_cb**2 * v_v_cb + d_sigma_eff_over_frac**2 * v_frac + 2 * d_sigma_eff_over_v_gauss * d_sigma_eff_over_v_cb * cov_v_gauss_v_cb + 2 * d_sigma_eff_over_v_gauss * d_sigma_eff_over_frac * cov_v_gauss_frac + 2 * d_sigma_eff_over_v_cb * d_sigma_eff_over_frac * cov_v_cb_frac
+    vtx_name = task["vertex"]
+    cat_name = task["category"]
+    output_dir = task["output_dir"]
 
-    return np.sqrt(var)
+    # RooFit objects
+    mass = ROOT.RooRealVar("mass", "Invariant mass [GeV]", 125, 115, 135)
+    weight = ROOT.RooRealVar("weight", "weight", -1, 1)
+    
+    mu = ROOT.RooRealVar("mu", "mu", 125, 120, 130)
+    sigma1 = ROOT.RooRealVar("sigma1", "sigma1", 1, 0.1, 10)
+    alpha1 = ROOT.RooRealVar("alpha1", "alpha1", 1, 0, 10)
+    n1 = ROOT.RooRealVar("n1", "n1", 1, 0, 5)
+
+    cb1 = ROOT.RooCBShape("cb1", "cb1", mass, mu, sigma1, alpha1, n1)
+
+    sigma2 = ROOT.RooRealVar("sigma2", "sigma2", 4, 0.1, 10)
+    alpha2 = ROOT.RooRealVar("alpha2", "alpha2", 1, 0, 10)
+    n2 = ROOT.RooRealVar("n2", "n2", 1, 0, 5)
+
+    frac = ROOT.RooRealVar("frac", "frac", 0.5, 0., 1.)
+
+    cb2 = ROOT.RooCBShape("cb2", "cb2", mass, mu, sigma2, alpha2, n2)
+
+    model = ROOT.RooAddPdf("model", "model", ROOT.RooArgList(cb1, cb2), ROOT.RooArgList(frac))
+
+    # Create (weighted) dataset
+    if task["binned"]:
+        data = binned_dataset("data", mass, task["mass"], task["weight"])
+    else:
+        data = weighted_dataset("data", mass, weight, task["mass"], task["weight"])
+
+    # Start from the cached values, if any
+    seed_roofit_parameters(model.getParameters(data), task["seeds"])
+
+    # Fit in subrange
+    mass.setRange("higgs", 116, 134)
+    logger.info("Performing fit")
+    start = time.perf_counter()
+    fit_result = fit_result = model.fitTo(
+            data, 
+            ROOT.RooFit.Range("higgs"), 
+            ROOT.RooFit.Save(1),
+            ROOT.RooFit.AsymptoticError(1)
+            )
+    fit_time = time.perf_counter() - start
+
+    # Plot decoration
+    mass_frame = mass.frame(ROOT.RooFit.Title("Mass-{}-{}".format(vtx_name, cat_name)))
+    mass_frame.GetYaxis().SetTitleOffset(1.6)
+    data.plotOn(mass_frame, ROOT.RooFit.DataError(ROOT.RooAbsData.SumW2))
+    model.plotOn(mass_frame, ROOT.RooFit.LineColor(getattr(ROOT, task["color"])))
+    chi_sq = mass_frame.chiSquare()
+    model.paramOn(mass_frame, ROOT.RooFit.Layout(0.65), ROOT.RooFit.Label("chiSq / ndof = {:.5f}".format(chi_sq)))
+
+    # Dump plots
+    logger.info("Dumping plots")
+    c = ROOT.TCanvas("", "")
+    mass_frame.Draw()
+    c.SaveAs("{}/mass_{}_{}.jpg".format(output_dir, vtx_name, cat_name))
+    c.SaveAs("{}/mass_{}_{}.pdf".format(output_dir, vtx_name, cat_name))
+
+    # Fill values for final plots; the effective sigma and its uncertainty are computed for
+    # all the categories at once in main
+    result = {"range": task["range"]}
+    result["params"] = {var.GetName(): {"value": var.getVal(), "error": var.getError()} for var in fit_result.floatParsFinal()}
+    result["fit_time"] = fit_time
+    # RooFitResult does not keep the number of function calls, fit_time is used to compare warm and cold starts
+    result["n_calls"] = None
+
+    values, cov = parameters_by_name(fit_result, eff_sigma_parameters)
+    result["eff_sigma_inputs"] = {"values": values.tolist(), "covariance": cov.tolist()}
+
+    return result
 
 
 def main(args):
@@ -65,162 +120,91 @@ def main(args):
 
     tree_name = tree_name_tmpl.format(channel)
 
-    final_plots_specs = {}
-
-    # Needed names for files and trees
-    file_dirs = {
-            "Vertex 0th": v0_input_dir,
-            "Vertex Reco": vcustom_input_dir
-            }
-
     fit_colors = {
             "Vertex 0th": "kRed",
             "Vertex Reco": "kBlue"
             }
 
     # Create sigma_m_over_m categories
+    # Each vertex is read only once, the events of every category are then passed to the fits
     logger.info("Creating categories of SigmaMOverM")
     file_format = {
             "Vertex 0th": v0_input_dir + "/" + file_names_tmpl[channel],
             "Vertex Reco": vcustom_input_dir + "/" + file_names_tmpl[channel]
             }
 
-    categories = {}
+    tasks = []
     smom = "sigma_m" # due to how we defined it in flashgg, it's already divided by M
     for vtx_name, direc in file_format.items():
-        categories[vtx_name] = {}
-        final_plots_specs[vtx_name] = {}
+        logger.info("Working with vertex {}".format(vtx_name))
 
-        arr = uproot.concatenate(["{}:{}".format(direc, tree_name)], expressions=[smom], library="ak")
-        arr = np.asarray([ev[0] for ev in arr.to_numpy()])
+        events = read_columns(direc, tree_name, ["mass", "weight", smom], channel, args.cache_dir, args.prune_cache)
 
-        cut_format = "{var} > {min_edge} && {var} < {max_edge}"
         edge_min = 0.
         edge_max = 0.035
         n_bins = 5
-        edges = get_edges(arr, edge_min, edge_max, n_bins)
+        edges = get_edges(events[smom], edge_min, edge_max, n_bins)
+        cat_index = np.digitize(events[smom], edges) - 1
 
-        low = edges[0]
-        for high in edges[1:]:
+        for i, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
             cat_name = "SigmaMOverM_{:.5f}-{:.5f}".format(low, high)
-            cat_string = cut_format.format(var=smom, min_edge=low, max_edge=high)
-            categories[vtx_name][cat_name] = cat_string
-
-            final_plots_specs[vtx_name][cat_name] = {}
-            final_plots_specs[vtx_name][cat_name]["range"] = (low, high)
-
-            low = high
-
-    logger.info("Created categories {}".format(categories))
-
-    for vtx_name, direc in file_dirs.items():
-        logger.info("Working with vertex {}".format(vtx_name))
-        for cat_name, cut in categories[vtx_name].items():
-            logger.info("Working with category {}".format(cat_name))
-
-            chain = ROOT.TChain()
-            files = [fl for fl in os.listdir(direc) if fl.startswith(file_names_tmpl[channel][:20])]
-            for fl in files:
-                chain.Add("{}/{}/{}".format(direc, fl, tree_name))
-            rdf = ROOT.RDataFrame(chain)
-            rdf_cut = rdf.Filter(cut)
-            mass_arr = rdf_cut.Take[float]("mass").GetValue()
-            weight_arr = rdf_cut.Take[float]("weight").GetValue()
-            mass_fake_arr = array("d", [0.])
-            weight_fake_arr = array("d", [0.])
-            cut_tree = ROOT.TTree("cut_tree", "cut_tree")
-            cut_tree.Branch("mass", mass_fake_arr, "mass/D")
-            cut_tree.Branch("weight", weight_fake_arr, "weight/D")
-            for ev_mass, ev_weight in zip(mass_arr, weight_arr):
-                mass_fake_arr[0] = ev_mass
-                weight_fake_arr[0] = ev_weight
-                cut_tree.Fill()
-
-            # RooFit objects
-            mass = ROOT.RooRealVar("mass", "Invariant mass [GeV]", 125, 115, 135)
-            weight = ROOT.RooRealVar("weight", "weight", -1, 1)
-            
-            mu = ROOT.RooRealVar("mu", "mu", 125, 120, 130)
-            sigma1 = ROOT.RooRealVar("sigma1", "sigma1", 1, 0.1, 10)
-            alpha1 = ROOT.RooRealVar("alpha1", "alpha1", 1, 0, 10)
-            n1 = ROOT.RooRealVar("n1", "n1", 1, 0, 5)
-
-            cb1 = ROOT.RooCBShape("cb1", "cb1", mass, mu, sigma1, alpha1, n1)
-
-            sigma2 = ROOT.RooRealVar("sigma2", "sigma2", 4, 0.1, 10)
-            alpha2 = ROOT.RooRealVar("alpha2", "alpha2", 1, 0, 10)
-            n2 = ROOT.RooRealVar("n2", "n2", 1, 0, 5)
-
-            frac = ROOT.RooRealVar("frac", "frac", 0.5, 0., 1.)
-
-            cb2 = ROOT.RooCBShape("cb2", "cb2", mass, mu, sigma2, alpha2, n2)
-
-            model = ROOT.RooAddPdf("model", "model", ROOT.RooArgList(cb1, cb2), ROOT.RooArgList(frac))
-
-            # Create (weighted) dataset
-            data = ROOT.RooDataSet("data".format(cat_name), "data".format(cat_name), cut_tree, ROOT.RooArgSet(mass, weight), "", weight.GetName())
-
-            # Fit in subrange
-            mass.setRange("higgs", 116, 134)
-            logger.info("Performing fit")
-            fit_result = fit_result = model.fitTo(
-                    data, 
-                    ROOT.RooFit.Range("higgs"), 
-                    ROOT.RooFit.Save(1),
-                    ROOT.RooFit.AsymptoticError(1)
-                    )
-
-            # Plot decoration
-            mass_frame = mass.frame(ROOT.RooFit.Title("Mass-{}-{}".format(vtx_name, cat_name)))
-            mass_frame.GetYaxis().SetTitleOffset(1.6)
-            data.plotOn(mass_frame, ROOT.RooFit.DataError(ROOT.RooAbsData.SumW2))
-            model.plotOn(mass_frame, ROOT.RooFit.LineColor(getattr(ROOT, fit_colors[vtx_name])))
-            chi_sq = mass_frame.chiSquare()
-            model.paramOn(mass_frame, ROOT.RooFit.Layout(0.65), ROOT.RooFit.Label("chiSq / ndof = {:.5f}".format(chi_sq)))
-
-            # Dump plots
-            logger.info("Dumping plots")
-            c = ROOT.TCanvas("", "")
-            mass_frame.Draw()
-            c.SaveAs("{}/mass_{}_{}.jpg".format(output_dir, vtx_name, cat_name))
-            c.SaveAs("{}/mass_{}_{}.pdf".format(output_dir, vtx_name, cat_name))
-
-            # Fill values for final plots
-            parameters = {var.GetName(): var.getVal() for var in list(model.getParameters(data))}
-
-            # See https://root-forum.cern.ch/t/how-to-calculate-effective-sigma/39472/3
-            final_plots_specs[vtx_name][cat_name]["fitted_sigma"] = np.sqrt(
-                    (parameters["sigma1"]**2)*parameters["frac"] \
-                    + (parameters["sigma2"]**2)*(1 - parameters["frac"])
-                    )
-            # Propagate uncertainty on sigma effective
-            # To get the covariances from fit result, remember the indexes
-            cov_matrix = fit_result.covarianceMatrix()
-            frac_index = 2
-            sigma1_index = 6
-            sigma2_index = 7
-
-            var_frac = cov_matrix[frac_index][frac_index]
-            var_v_1 = cov_matrix[sigma1_index][sigma1_index]
-            var_v_2 = cov_matrix[sigma2_index][sigma2_index]
-
-            cov_v_1_v_2 = cov_matrix[sigma1_index][sigma2_index]
-            cov_v_1_frac = cov_matrix[sigma1_index][frac_index]
-            cov_v_2_frac = cov_matrix[sigma2_index][frac_index]
-
-
-            final_plots_specs[vtx_name][cat_name]["fitted_sigma_unc"] = eff_sigma_unc(
-                    parameters["frac"], 
-                    1 - parameters["frac"], 
-                    parameters["sigma1"] - parameters["sigma2"],
-                    var_v_1, var_v_2, var_frac,
-                    cov_v_1_v_2, cov_v_1_frac, cov_v_2_frac
-                    )
-
-    logger.info("Dumping final plots specifications: {}".format(final_plots_specs))
-
-    with open("sigma_m_final_plots_specs_{}.pkl".format(channel), "wb") as fl:
-        pickle.dump(final_plots_specs, fl)
+            cat_mask = cat_index == i
+            tasks.append({
+                "channel": channel,
+                "vertex": vtx_name,
+                "category": cat_name,
+                "range": (low, high),
+                "mass": events["mass"][cat_mask],
+                "weight": events["weight"][cat_mask],
+                "color": fit_colors[vtx_name],
+                "binned": args.binned,
+                "output_dir": output_dir,
+                "model": "double_cb_binned" if args.binned else "double_cb"
+                })
+
+    logger.info("Created categories {}".format([(task["vertex"], task["category"]) for task in tasks]))
+
+    # Fits can be warm-started from the neighbouring sigma_m/M categories of the same vertex
+    # and from the same category of the other vertex
+    cat_names = {vtx_name: [task["category"] for task in tasks if task["vertex"] == vtx_name] for vtx_name in file_format}
+    for task in tasks:
+        i = cat_names[task["vertex"]].index(task["category"])
+        task["neighbours"] = [
+                (channel, task["vertex"], cat_names[task["vertex"]][j]) for j in [i - 1, i + 1] if 0 <= j < n_bins
+                ] + [
+                (channel, vtx_name, names[i]) for vtx_name, names in cat_names.items() if vtx_name != task["vertex"]
+                ]
+
+    final_plots_specs = run_warm_started_fits(
+            fit_category,
+            tasks,
+            FitSeedCache(args.seed_cache),
+            n_workers=args.n_workers
+            )
+
+    # Effective sigma with uncertainty for all the successful fits at once
+    done = [
+            spec for vtx_specs in final_plots_specs[channel].values() for spec in vtx_specs.values()
+            if spec["status"] == "ok"
+            ]
+    if not done:
+        logger.warning("No successful fit, effective sigmas are not computed")
+    else:
+        values = np.array([spec["eff_sigma_inputs"]["values"] for spec in done])
+        covs = np.array([spec["eff_sigma_inputs"]["covariance"] for spec in done])
+        sigmas, sigma_uncs = propagate(sum_effective_sigma, values, covs)
+        if args.n_toys > 0:
+            toy_uncs = propagate_toys(sum_effective_sigma, values, covs, n_toys=args.n_toys, n_workers=args.n_workers)
+        for i, spec in enumerate(done):
+            spec["fitted_sigma"] = sigmas[i]
+            spec["fitted_sigma_unc"] = sigma_uncs[i]
+            if args.n_toys > 0:
+                spec["fitted_sigma_unc_toys"] = toy_uncs[i]
+                logger.info("Effective sigma {:.4f} +/- {:.4f} (linear) +/- {:.4f} (toys)".format(sigmas[i], sigma_uncs[i], toy_uncs[i]))
+
+    dump_fit_results(final_plots_specs, "sigma_m_final_plots_specs.json")
+
+    logger.info("Final plots specifications: {}".format(final_plots_specs))
 
 
 
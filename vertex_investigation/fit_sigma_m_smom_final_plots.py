@@ -1,4 +1,3 @@
-import pickle
 import matplotlib.pyplot as plt
 import numpy as np
 from uncertainties import ufloat
@@ -7,6 +6,7 @@ import mplhep as hep
 from utils import parse_arguments
 from utils import file_names_tmpl
 from utils import setup_logging
+from utils.scheduler import load_fit_results
 
 import logging
 logger = logging.getLogger(__name__)
@@ -28,18 +28,25 @@ def main(args):
     output_dir = args.output_dir
     channel = args.channel
 
-    pkl_name = "sigma_m_final_plots_specs_{}.pkl".format(channel)
-    logger.info("Found file {}".format(pkl_name))
+    results_name = "sigma_m_final_plots_specs.json"
+    logger.info("Found file {}".format(results_name))
 
-    with open(pkl_name, "rb") as fl:
-        plots_specs = pickle.load(fl)
+    plots_specs = load_fit_results(results_name, channel)
+
+    # Failed fits carry neither the range nor the fitted sigma
+    def ok(spec):
+        return spec.get("status") == "ok" and "fitted_sigma" in spec
+
+    good_specs = {}
+    for vtx_name, cat_specs in plots_specs.items():
+        failed = [cat for cat, spec in cat_specs.items() if not ok(spec)]
+        if failed:
+            logger.warning("Skipping failed fits of {}: {}".format(vtx_name, failed))
+        good_specs[vtx_name] = [spec for spec in cat_specs.values() if ok(spec)]
+
+    def center(cat_spec):
+        return cat_spec["range"][0] + abs(cat_spec["range"][1] - cat_spec["range"][0]) / 2
 
-    x_v0 = [cat_spec["range"][0] + abs(cat_spec["range"][1] - cat_spec["range"][0]) / 2 for cat_spec in plots_specs["Vertex 0th"].values()]
-    x_vcustom = [cat_spec["range"][0] + abs(cat_spec["range"][1] - cat_spec["range"][0]) / 2 for cat_spec in plots_specs["Vertex Reco"].values()]
-    x_s = {
-            "Vertex 0th": x_v0,
-            "Vertex Reco": x_vcustom
-            }
     fmts = {
             "Vertex 0th": "r^",
             "Vertex Reco": "sb"
@@ -53,30 +60,30 @@ def main(args):
             sharex=True
             )
 
-    for vtx_name, cat_specs in plots_specs.items():
+    for vtx_name, cat_specs in good_specs.items():
         ax.errorbar(
-                x_s[vtx_name], 
-                [cat_spec["fitted_sigma"] for cat_spec in plots_specs[vtx_name].values()],
-                yerr=[cat_spec["fitted_sigma_unc"] for cat_spec in plots_specs[vtx_name].values()],
-                fmt=fmts[vtx_name], 
+                [center(cat_spec) for cat_spec in cat_specs],
+                [cat_spec["fitted_sigma"] for cat_spec in cat_specs],
+                yerr=[cat_spec["fitted_sigma_unc"] for cat_spec in cat_specs],
+                fmt=fmts[vtx_name],
                 label=vtx_name
                 )
-    rax_y = [rel_diff(s0, sc) for s0, sc in zip(
-        [ufloat(cat_spec["fitted_sigma"], cat_spec["fitted_sigma_unc"]) for cat_spec in plots_specs["Vertex 0th"].values()],
-        [ufloat(cat_spec["fitted_sigma"], cat_spec["fitted_sigma_unc"]) for cat_spec in plots_specs["Vertex Reco"].values()])
-        ]
+
+    # Categories are compared in order, only where both fits succeeded
+    pairs = [(s0, sc) for s0, sc in zip(plots_specs["Vertex 0th"].values(), plots_specs["Vertex Reco"].values()) if ok(s0) and ok(sc)]
+    rax_y = [rel_diff(ufloat(s0["fitted_sigma"], s0["fitted_sigma_unc"]), ufloat(sc["fitted_sigma"], sc["fitted_sigma_unc"])) for s0, sc in pairs]
 
     logger.info("Relative differences: {}".format(rax_y))
 
     rax.errorbar(
-            x_s["Vertex 0th"], 
+            [center(s0) for s0, _ in pairs],
             [val.n for val in rax_y],
             yerr = [val.s for val in rax_y],
             fmt="ko"
             )
 
     for x in [ax, rax]:
-        for cat in plots_specs["Vertex 0th"].values():
+        for cat in good_specs["Vertex 0th"]:
             low = cat["range"][0]
             x.axvline(low, color="black", alpha=0.4)
 
@@ -3,3 +3,4 @@ from .utils import parse_arguments
 from .utils import file_names_tmpl
 from .utils import tree_name_tmpl
 from .utils import rel_diff_asymm
+from .utils import subdetector_categories
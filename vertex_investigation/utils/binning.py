@@ -0,0 +1,97 @@
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_edges(arr, edge_min, edge_max, n_bins, weights=None):
+    """Given an array of events (sigmaM_over_M), the range and the number of bins,
+    return the sequence of edges that splits the events in [edge_min, edge_max] into
+    n_bins bins with the same number of events (or the same sum of weights, if weights
+    are passed).
+    The edges are the quantiles of the (weighted) distribution, so they are computed
+    with a single sort of the array instead of a numerical minimization.
+    If no event falls in the range, the bins are evenly spaced.
+    """
+    arr = np.asarray(arr)
+    in_range = (arr >= edge_min) & (arr <= edge_max)
+    arr = arr[in_range]
+
+    probs = np.linspace(0., 1., n_bins + 1)[1:-1]
+
+    if len(arr) == 0:
+        logger.warning("No events in [{}, {}], using evenly spaced edges".format(edge_min, edge_max))
+        return list(np.linspace(edge_min, edge_max, n_bins + 1))
+
+    if weights is None:
+        edges_cent = np.quantile(arr, probs)
+    else:
+        weights = np.asarray(weights)[in_range]
+        edges_cent = weighted_quantile(arr, weights, probs)
+
+    return [edge_min] + list(edges_cent) + [edge_max]
+
+
+def weighted_quantile(arr, weights, probs):
+    """Compute the quantiles probs of arr, where each event counts as much as its weight.
+    Quantiles are interpolated linearly between the midpoints of the cumulative sum of weights.
+    Negative MC weights (e.g. NLO samples) make the cumulative sum non monotonic, while np.interp
+    needs increasing points: as in sigma_effective, its running maximum is used, which is exact
+    when all the weights are positive.
+    """
+    order = np.argsort(arr, kind="stable")
+    arr = np.asarray(arr)[order]
+    weights = np.asarray(weights)[order]
+
+    cum_weights = np.cumsum(weights) - 0.5 * weights
+    total = np.sum(weights)
+    if total <= 0:
+        raise ValueError("Sum of weights must be positive to compute weighted quantiles")
+    if np.any(weights < 0):
+        logger.warning("{} negative weights found, using the running maximum of the cumulative sum".format(np.sum(weights < 0)))
+        cum_weights = np.maximum.accumulate(cum_weights)
+
+    return np.interp(np.asarray(probs) * total, cum_weights, arr)
+
+
+class StreamingQuantiles:
+    """Approximate quantiles for inputs that do not fit in memory.
+
+    Events are accumulated chunk by chunk (e.g. from uproot.iterate) in a fine histogram
+    over [edge_min, edge_max]; quantiles are then obtained inverting the cumulative
+    distribution, with a resolution of (edge_max - edge_min) / n_fine_bins.
+    Memory is constant and, unlike sampling sketches, the result does not depend on the
+    order in which the chunks are filled. Negative weights are treated as in weighted_quantile.
+    """
+    def __init__(self, edge_min, edge_max, n_fine_bins=100000):
+        self.edge_min = edge_min
+        self.edge_max = edge_max
+        self.fine_edges = np.linspace(edge_min, edge_max, n_fine_bins + 1)
+        self.counts = np.zeros(n_fine_bins)
+
+    def fill(self, arr, weights=None):
+        counts, _ = np.histogram(np.asarray(arr), self.fine_edges, weights=weights)
+        self.counts += counts
+
+    def quantile(self, probs):
+        cdf = np.concatenate([[0.], np.cumsum(self.counts)])
+        total = cdf[-1]
+        if total <= 0:
+            raise ValueError("Sum of weights filled in the streaming quantile estimator must be positive")
+        if np.any(self.counts < 0):
+            logger.warning("{} bins with negative sum of weights found, using the running maximum of the cumulative sum".format(
+                np.sum(self.counts < 0)))
+            cdf = np.maximum.accumulate(cdf)
+
+        return np.interp(np.asarray(probs) * total, cdf, self.fine_edges)
+
+    def get_edges(self, n_bins):
+        """Same output as get_edges, using the accumulated fine histogram.
+        """
+        if not np.any(self.counts):
+            logger.warning("No events in [{}, {}], using evenly spaced edges".format(self.edge_min, self.edge_max))
+            return list(np.linspace(self.edge_min, self.edge_max, n_bins + 1))
+
+        probs = np.linspace(0., 1., n_bins + 1)[1:-1]
+
+        return [self.edge_min] + list(self.quantile(probs)) + [self.edge_max]
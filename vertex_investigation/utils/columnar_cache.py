@@ -0,0 +1,88 @@
+import glob
+import hashlib
+import os
+import shutil
+import uuid
+import uproot
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "vertex_investigation")
+
+
+def fingerprint(files, tree_name):
+    """Hash identifying a set of input files: it changes if a file is added, removed or rewritten
+    (different size or modification time).
+    """
+    hasher = hashlib.sha1(tree_name.encode())
+    for fl in sorted(files):
+        stat = os.stat(fl)
+        hasher.update("{}:{}:{}".format(os.path.basename(fl), stat.st_size, stat.st_mtime_ns).encode())
+
+    return hasher.hexdigest()[:16]
+
+
+def read_columns(file_pattern, tree_name, columns, channel, cache_dir=default_cache_dir, prune=False):
+    """Read columns of tree_name from the files matching file_pattern, as a dictionary of numpy
+    arrays (like uproot.concatenate with library="np").
+
+    Every column is converted once into an uncompressed Feather file stored in
+    cache_dir/channel/vertex_dir/fingerprint, which is then memory-mapped in the following calls;
+    only the columns not already in the cache are read from the ROOT files.
+    Each column is written as a single record batch, so that it is returned without copies.
+    When the input files change, the fingerprint changes: the caches of the other fingerprints
+    in the same directory are removed only if prune is True (other jobs might be reading them).
+    """
+    files = sorted(glob.glob(file_pattern))
+    if not files:
+        raise FileNotFoundError("No files matching {}".format(file_pattern))
+
+    vertex_dir = os.path.basename(os.path.dirname(file_pattern))
+    base_dir = os.path.join(cache_dir, channel, vertex_dir)
+    fp = fingerprint(files, tree_name)
+    cache_path = os.path.join(base_dir, fp)
+
+    if os.path.isdir(base_dir):
+        for old_fp in os.listdir(base_dir):
+            if old_fp != fp:
+                if prune:
+                    logger.info("Removing outdated cache {}".format(os.path.join(base_dir, old_fp)))
+                    shutil.rmtree(os.path.join(base_dir, old_fp), ignore_errors=True)
+                else:
+                    logger.info("Found other cache {} (use --prune-cache to remove it)".format(os.path.join(base_dir, old_fp)))
+    os.makedirs(cache_path, exist_ok=True)
+
+    def column_file(col):
+        return os.path.join(cache_path, "{}.feather".format(col))
+
+    missing = [col for col in columns if not os.path.isfile(column_file(col))]
+    if missing:
+        logger.info("Caching columns {} of {} files in {}".format(missing, len(files), cache_path))
+        arrays = uproot.concatenate(["{}:{}".format(fl, tree_name) for fl in files], missing, library="np")
+        for col in missing:
+            # Write to a temporary file first, so that an interrupted job does not leave a broken cache;
+            # its name is unique, since other jobs might be filling the same cache at the same time
+            tmp_file = "{}.{}.{}.tmp".format(column_file(col), os.getpid(), uuid.uuid4().hex)
+            try:
+                feather.write_feather(
+                        pa.table({col: arrays[col]}), tmp_file, compression="uncompressed", chunksize=max(len(arrays[col]), 1)
+                        )
+                os.replace(tmp_file, column_file(col))
+            except BaseException:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                raise
+
+    arrays = {}
+    for col in columns:
+        table = feather.read_table(column_file(col), memory_map=True)
+        column = table.column(col)
+        # Caches written with a single chunk are served directly from the memory map
+        column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        arrays[col] = column.to_numpy(zero_copy_only=False)
+
+    return arrays
@@ -0,0 +1,63 @@
+import numpy as np
+from scipy.stats import beta
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def clopper_pearson(passed, total, level=0.68):
+    """Vectorized version of ROOT.TEfficiency.ClopperPearson.
+    Return two arrays with the lower and upper bounds of the interval for every (passed, total) pair.
+    """
+    passed = np.asarray(passed, dtype=float)
+    total = np.asarray(total, dtype=float)
+    alpha = (1. - level) / 2.
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        low = np.where(passed > 0, beta.ppf(alpha, passed, total - passed + 1), 0.)
+        up = np.where(passed < total, beta.ppf(1. - alpha, passed + 1, total - passed), 1.)
+
+    return low, up
+
+
+def binned_efficiency(x, passed_mask, edges, level=0.68):
+    """Given the values of the binning variable x, a boolean mask of the events that pass
+    the selection and the bin edges, compute for every bin in one pass:
+    - the number of total and passed events;
+    - the fraction of passed events with its Clopper-Pearson uncertainties;
+    - mean and standard deviation of x in the bin.
+    Events are assigned to bins [edges[i], edges[i+1]), events outside the edges are ignored.
+
+    Return a dictionary of arrays of length len(edges) - 1; "unc" has shape (n_bins, 2) and
+    contains the [low, up] distances from the central value, as needed by rel_diff_asymm.
+    """
+    x = np.asarray(x, dtype=float)
+    passed_mask = np.asarray(passed_mask, dtype=bool)
+    n_bins = len(edges) - 1
+
+    bin_index = np.digitize(x, edges) - 1
+    in_range = (bin_index >= 0) & (bin_index < n_bins)
+    bin_index = bin_index[in_range]
+    x = x[in_range]
+    passed_mask = passed_mask[in_range]
+
+    total = np.bincount(bin_index, minlength=n_bins)
+    passed = np.bincount(bin_index, weights=passed_mask, minlength=n_bins)
+    sum_x = np.bincount(bin_index, weights=x, minlength=n_bins)
+    sum_x2 = np.bincount(bin_index, weights=x**2, minlength=n_bins)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = passed / total
+        x_mean = sum_x / total
+        x_std = np.sqrt(np.maximum(sum_x2 / total - x_mean**2, 0.))
+
+    low, up = clopper_pearson(passed, total, level)
+
+    return {
+            "total": total,
+            "passed": passed,
+            "values": frac,
+            "unc": np.stack([np.abs(low - frac), np.abs(up - frac)], axis=1),
+            "x_mean": x_mean,
+            "x_std": x_std
+            }
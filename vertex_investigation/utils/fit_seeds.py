@@ -0,0 +1,160 @@
+import json
+import os
+
+from .scheduler import run_fits
+from .scheduler import merge_fit_results
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class FitSeedCache:
+    """Converged fit parameters persisted in a JSON file, keyed by (channel, vertex, category, model),
+    to be used as starting values when the same (or a neighbouring) fit is run again.
+
+    Every entry also records the cost of the fit (number of function calls when available, and
+    fit time) both for the last fit started from the default values (cold), if any, and for the last
+    one, so that the savings of warm starts can be reported.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, "r") as fl:
+                self.entries = json.load(fl)
+            # Older caches also recorded as cold the first runs seeded from a neighbour
+            for entry in self.entries.values():
+                if entry.pop("cold_seeded", False):
+                    entry.pop("cold_cost", None)
+            logger.info("Loaded {} fit seeds from {}".format(len(self.entries), path))
+
+    @staticmethod
+    def make_key(channel, vertex, category, model):
+        return "/".join([channel, vertex, category, model])
+
+    def get(self, channel, vertex, category, model, neighbours=()):
+        """Return the seeds for the fit and the key they come from; if the fit itself is not in the
+        cache, look for the neighbours, a sequence of (channel, vertex, category) in order of preference.
+        Return (None, None) if nothing is found.
+        """
+        for ch, vtx, cat in [(channel, vertex, category)] + list(neighbours):
+            key = self.make_key(ch, vtx, cat, model)
+            if key in self.entries:
+                return self.entries[key]["params"], key
+
+        return None, None
+
+    def update(self, channel, vertex, category, model, params, cost, warm):
+        entry = self.entries.setdefault(self.make_key(channel, vertex, category, model), {})
+        entry["params"] = params
+        if not warm:
+            entry["cold_cost"] = cost
+        entry["last_cost"] = cost
+
+    def save(self):
+        logger.info("Dumping fit seeds in {}".format(self.path))
+        with open(self.path, "w") as fl:
+            json.dump(self.entries, fl, indent=4, default=float)
+
+    def report(self):
+        """Table comparing, for every fit, the cost of the cold start with the one of the last run;
+        fits which were never started cold are listed but not counted in the savings.
+        """
+        lines = ["{:<60}{:>12}{:>12}{:>12}{:>12}".format("fit", "calls cold", "calls last", "time cold", "time last")]
+        saved_calls = 0
+        for key, entry in self.entries.items():
+            cold, last = entry.get("cold_cost"), entry["last_cost"]
+            if cold is not None and cold["n_calls"] is not None and last["n_calls"] is not None:
+                saved_calls += cold["n_calls"] - last["n_calls"]
+            lines.append("{:<60}{:>12}{:>12}{:>12}{:>11.1f}s".format(
+                key,
+                str(cold["n_calls"]) if cold is not None else "-",
+                str(last["n_calls"]),
+                "{:.1f}s".format(cold["fit_time"]) if cold is not None else "-",
+                last["fit_time"]
+                ))
+        lines.append("Total function calls saved: {}".format(saved_calls))
+
+        return "\n".join(lines)
+
+
+def seed_roofit_parameters(parameters, seeds):
+    """Set the values of the RooRealVars in parameters to seeds (a dictionary name: value),
+    clipped to the ranges of the variables.
+    """
+    if seeds is None:
+        return
+    for var in parameters:
+        if var.GetName() in seeds:
+            var.setVal(min(max(seeds[var.GetName()], var.getMin()), var.getMax()))
+
+
+def run_warm_started_fits(fit_function, tasks, cache, n_workers=None):
+    """Run the fits with run_fits, starting every fit from the seeds found in cache.
+    Every task needs the keys "model" and "neighbours" (sequence of (channel, vertex, category),
+    see FitSeedCache.get); the key "seeds" is filled here and fit_function has to return
+    "params" (name: {"value": ..., "error": ...}) and "n_calls" (or None).
+
+    Fits are run in at most two parallel waves. For every (channel, vertex) none of whose fits can be
+    seeded from the cache, the fit of the middle category is first run cold as a pilot, all the pilots
+    in a single wave; then all the other fits are run at once, seeded from the cache (the fit itself or
+    its neighbours) or, if nothing is found there, from the pilot of their (channel, vertex).
+    """
+    def fit_id(task):
+        return (task["channel"], task["vertex"], task["category"])
+
+    def find_seeds(task, fallback=()):
+        return cache.get(
+                task["channel"], task["vertex"], task["category"], task["model"], list(task["neighbours"]) + list(fallback)
+                )
+
+    def update_cache(wave, results):
+        for task in wave:
+            result = results[task["channel"]][task["vertex"]][task["category"]]
+            if result["status"] != "ok":
+                continue
+            cache.update(
+                    task["channel"], task["vertex"], task["category"], task["model"],
+                    {name: par["value"] for name, par in result["params"].items()},
+                    {"n_calls": result["n_calls"], "fit_time": result["wall_time"]},
+                    warm=task["seeds"] is not None
+                    )
+
+    groups = {}
+    for task in tasks:
+        groups.setdefault((task["channel"], task["vertex"]), []).append(task)
+
+    all_results = []
+    pilots = []
+    for group_tasks in groups.values():
+        if all(find_seeds(task)[0] is None for task in group_tasks):
+            pilot = group_tasks[len(group_tasks) // 2]
+            pilot["seeds"] = None
+            logger.info("Fit {} started from the default values as pilot".format(fit_id(pilot)))
+            pilots.append(pilot)
+    if pilots:
+        logger.info("Running {} pilot fits".format(len(pilots)))
+        results = run_fits(fit_function, pilots, n_workers=n_workers)
+        update_cache(pilots, results)
+        all_results.append(results)
+
+    pilot_ids = set(fit_id(task) for task in pilots)
+    remaining = [task for task in tasks if fit_id(task) not in pilot_ids]
+    for task in remaining:
+        group_tasks = groups[(task["channel"], task["vertex"])]
+        fallback = [fit_id(t) for t in [group_tasks[len(group_tasks) // 2]] + group_tasks]
+        task["seeds"], source = find_seeds(task, fallback)
+        if source is not None:
+            logger.info("Fit {} seeded from {}".format(fit_id(task), source))
+        else:
+            logger.info("Fit {} started from the default values".format(fit_id(task)))
+    if remaining:
+        logger.info("Running {} fits".format(len(remaining)))
+        results = run_fits(fit_function, remaining, n_workers=n_workers)
+        update_cache(remaining, results)
+        all_results.append(results)
+
+    cache.save()
+    logger.info("Fit seeds:\n{}".format(cache.report()))
+
+    return merge_fit_results(tasks, *all_results)
@@ -0,0 +1,101 @@
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def parameters_by_name(fit_result, names):
+    """Return the fitted values and the covariance matrix of the parameters names (in this order)
+    from a RooFitResult, looking them up by name instead of relying on their position.
+    """
+    float_pars = fit_result.floatParsFinal()
+    float_names = [par.GetName() for par in float_pars]
+    missing = [name for name in names if name not in float_names]
+    if missing:
+        raise KeyError("Parameters {} are not floating in the fit result".format(missing))
+    indices = [float_names.index(name) for name in names]
+
+    cov_matrix = fit_result.covarianceMatrix()
+    values = np.array([float_pars[idx].getVal() for idx in indices])
+    cov = np.array([[cov_matrix[i][j] for j in indices] for i in indices])
+
+    return values, cov
+
+
+def sum_effective_sigma(x):
+    """Effective sigma of the sum of N components, sqrt(sum_i f_i * sigma_i^2), as in
+    https://root-forum.cern.ch/t/how-to-calculate-effective-sigma/39472/3
+    x has shape (..., 2N - 1) and contains sigma_1, ..., sigma_N, f_1, ..., f_{N-1}, with
+    f_N = 1 - sum(f_i) as for a (non recursive) RooAddPdf.
+    """
+    x = np.asarray(x)
+    n_components = (x.shape[-1] + 1) // 2
+    sigmas = x[..., :n_components]
+    fracs = x[..., n_components:]
+    fracs = np.concatenate([fracs, 1 - np.sum(fracs, axis=-1, keepdims=True)], axis=-1)
+
+    return np.sqrt(np.sum(fracs * sigmas**2, axis=-1))
+
+
+def jacobian(func, values, rel_step=1e-6):
+    """Numerical Jacobian of a scalar func (vectorized over the leading axes) with central
+    differences, computed for all the parameters and all the batch entries in a single call of func.
+    values has shape (..., n_params), the output has the same shape.
+    """
+    values = np.asarray(values, dtype=float)
+    n_params = values.shape[-1]
+    steps = rel_step * np.maximum(np.abs(values), 1.)
+
+    # Shape (..., 2, n_params, n_params): up and down shifts of one parameter at a time
+    shifts = np.eye(n_params) * steps[..., np.newaxis, :]
+    shifted = values[..., np.newaxis, np.newaxis, :] + np.stack([shifts, -shifts], axis=-3)
+    evaluated = func(shifted)
+
+    return (evaluated[..., 0, :] - evaluated[..., 1, :]) / (2 * steps)
+
+
+def propagate(func, values, cov):
+    """Linear propagation of the covariance cov of values to the scalar func.
+    Batched: values has shape (..., n_params) and cov (..., n_params, n_params), so that the
+    derived quantity of e.g. all the categories is computed at once.
+    Return the value of func and its uncertainty.
+    """
+    values = np.asarray(values, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    jac = jacobian(func, values)
+
+    var = np.einsum("...i,...ij,...j->...", jac, cov, jac)
+
+    return func(values), np.sqrt(var)
+
+
+def _toys(func, values, cov, n_toys, seed):
+    rng = np.random.default_rng(seed)
+    samples = rng.multivariate_normal(values, cov, size=n_toys)
+
+    return np.std(func(samples), ddof=1)
+
+
+def propagate_toys(func, values, cov, n_toys=10000, n_workers=None, seed=0):
+    """Cross-check of propagate: sample the parameters from a multivariate Gaussian with the
+    fitted values and covariance and take the spread of func.
+    The entries of the batch (e.g. the categories) are processed in parallel; func has to be
+    defined at module level.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    cov = np.asarray(cov, dtype=float).reshape(-1, values.shape[-1], values.shape[-1])
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(len(values))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+                executor.submit(_toys, func, val, cv, n_toys, entry_seed)
+                for val, cv, entry_seed in zip(values, cov, seeds)
+                ]
+        uncs = np.array([future.result() for future in futures])
+
+    return uncs
@@ -0,0 +1,71 @@
+import ROOT
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Used when RooDataSet.from_numpy is not available (ROOT < 6.28): the loop over the events
+# runs in C++, with the numpy buffers passed as pointers
+ROOT.gInterpreter.Declare("""
+void fill_weighted_dataset(RooDataSet &data, RooRealVar &var, const double *values, const double *weights, std::size_t n) {
+    for (std::size_t i = 0; i < n; ++i) {
+        var.setVal(values[i]);
+        data.add(RooArgSet(var), weights[i]);
+    }
+}
+""")
+
+
+def _as_double(arr):
+    return np.ascontiguousarray(arr, dtype=np.float64)
+
+
+def rdf_to_numpy(rdf, columns=("mass", "weight")):
+    """Extract columns from a (filtered) RDataFrame as numpy arrays in a single event loop.
+    """
+    arrays = rdf.AsNumpy(list(columns))
+
+    return {col: _as_double(arrays[col]) for col in columns}
+
+
+def weighted_dataset(name, var, weight_var, values, weights):
+    """Build a weighted RooDataSet for the observable var directly from numpy arrays, without
+    looping over the events in Python.
+    """
+    values = np.asarray(values)
+    weights = np.asarray(weights)
+
+    # As when importing from a TTree, events outside the range of the observable are dropped
+    in_range = (values >= var.getMin()) & (values <= var.getMax())
+    values = _as_double(values[in_range])
+    weights = _as_double(weights[in_range])
+
+    if hasattr(ROOT.RooDataSet, "from_numpy"):
+        return ROOT.RooDataSet.from_numpy(
+                {var.GetName(): values, weight_var.GetName(): weights},
+                [var],
+                name=name,
+                title=name,
+                weight_name=weight_var.GetName()
+                )
+
+    data = ROOT.RooDataSet(name, name, ROOT.RooArgSet(var, weight_var), ROOT.RooFit.WeightVar(weight_var))
+    ROOT.fill_weighted_dataset(data, var, values, weights, len(values))
+
+    return data
+
+
+def binned_dataset(name, var, values, weights, n_bins=200):
+    """Build a RooDataHist with n_bins in the range of var, filling a TH1D with FillN (so that
+    the sum of squared weights is kept for the uncertainties) instead of a Python loop.
+    """
+    values = _as_double(values)
+    weights = _as_double(weights)
+
+    hist = ROOT.TH1D("{}_hist".format(name), name, n_bins, var.getMin(), var.getMax())
+    hist.Sumw2()
+    hist.SetDirectory(0)
+    hist.FillN(len(values), values, weights)
+
+    return ROOT.RooDataHist(name, name, ROOT.RooArgList(var), ROOT.RooFit.Import(hist))
@@ -0,0 +1,97 @@
+import fcntl
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _timed_call(fit_function, task):
+    start = time.perf_counter()
+    result = fit_function(task)
+
+    return result, time.perf_counter() - start
+
+
+def run_fits(fit_function, tasks, output_file=None, n_workers=None):
+    """Run fit_function(task) for every task in a pool of n_workers processes (all the
+    available cores by default) and dump the results in the JSON file shared by all the channels
+    (if output_file is not None, see dump_fit_results).
+
+    Every task is a dictionary with at least the keys "channel", "vertex" and "category",
+    plus whatever fit_function needs (e.g. the numpy arrays to fit); fit_function has to be
+    defined at module level and return a JSON serializable dictionary.
+    Workers are started with "spawn", so that each of them has its own ROOT/zfit state
+    instead of a copy of the one of the main process.
+
+    The output has the structure {channel: {vertex: {category: result}}}, where every result
+    also contains the wall time of the fit; failed fits are logged and stored with status "failed".
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        futures = {executor.submit(_timed_call, fit_function, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            key = (task["channel"], task["vertex"], task["category"])
+            try:
+                result, wall_time = future.result()
+                result["status"] = "ok"
+                result["wall_time"] = wall_time
+                logger.info("Fit {} done in {:.1f} s".format(key, wall_time))
+            except Exception:
+                logger.exception("Fit {} failed".format(key))
+                result = {"status": "failed"}
+            results.setdefault(task["channel"], {}).setdefault(task["vertex"], {})[task["category"]] = result
+
+    ordered_results = merge_fit_results(tasks, results)
+
+    if output_file is not None:
+        dump_fit_results(ordered_results, output_file)
+
+    return ordered_results
+
+
+def merge_fit_results(tasks, *all_results):
+    """Merge outputs of different run_fits calls (e.g. when fits are run in more than one wave),
+    keeping the categories in the order in which they appear in tasks.
+    """
+    merged = {}
+    for task in tasks:
+        channel, vertex, category = task["channel"], task["vertex"], task["category"]
+        for results in all_results:
+            if category in results.get(channel, {}).get(vertex, {}):
+                merged.setdefault(channel, {}).setdefault(vertex, {})[category] = results[channel][vertex][category]
+
+    return merged
+
+
+def dump_fit_results(results, output_file):
+    """Write results ({channel: {vertex: {category: result}}}) in the single results file output_file,
+    shared by all the channels: the channels in results replace the ones already in the file, the
+    others are kept. The file is locked while it is updated, so channels can be fitted concurrently.
+    """
+    logger.info("Dumping fit results of {} in {}".format(list(results), output_file))
+    with open(output_file, "a+") as fl:
+        fcntl.flock(fl, fcntl.LOCK_EX)
+        fl.seek(0)
+        content = fl.read()
+        all_results = json.loads(content) if content else {}
+        all_results.update(results)
+        fl.seek(0)
+        fl.truncate()
+        json.dump(all_results, fl, indent=4, default=float)
+
+
+def load_fit_results(input_file, channel):
+    """Read back the results of a channel from the file written by dump_fit_results,
+    as {vertex: {category: result}}.
+    """
+    with open(input_file, "r") as fl:
+        results = json.load(fl)
+
+    return results[channel]
@@ -0,0 +1,131 @@
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _narrowest_interval_sorted(arr, weights, fraction):
+    """Given an already sorted array (and the weights in the same order, or None), return the
+    (low, high) edges of the narrowest interval containing the requested fraction of events.
+    Every possible starting event is tested at once, so this is a single vectorized sweep.
+    """
+    n = len(arr)
+    if n == 0:
+        return np.nan, np.nan
+
+    if weights is None:
+        k = min(max(int(np.ceil(fraction * n)), 1), n)
+        widths = arr[k - 1:] - arr[:n - k + 1]
+        start = np.argmin(widths)
+        return arr[start], arr[start + k - 1]
+
+    # Negative MC weights make the cumulative sum non monotonic: use its running maximum
+    # to find the closing event, which is exact when all the weights are positive
+    cum_weights = np.maximum.accumulate(np.cumsum(weights))
+    total = cum_weights[-1]
+    if total <= 0:
+        return np.nan, np.nan
+    targets = cum_weights - weights + fraction * total
+    stops = np.searchsorted(cum_weights, targets, side="left")
+    valid = stops < n
+    starts = np.nonzero(valid)[0]
+    widths = arr[stops[valid]] - arr[starts]
+    best = np.argmin(widths)
+
+    return arr[starts[best]], arr[stops[valid][best]]
+
+
+def sigma_effective(arr, weights=None, fraction=0.683):
+    """Compute the effective sigma of arr, i.e. half the width of the narrowest interval
+    containing the given fraction (68.3% by default) of the (weighted) events.
+    """
+    arr = np.asarray(arr)
+    order = np.argsort(arr, kind="stable")
+    arr = arr[order]
+    if weights is not None:
+        weights = np.asarray(weights)[order]
+
+    low, high = _narrowest_interval_sorted(arr, weights, fraction)
+
+    return (high - low) / 2
+
+
+def sigma_effective_by_category(arr, cat_index, n_categories, weights=None, fraction=0.683):
+    """Compute sigma_effective for all the categories with a single sort.
+    cat_index contains, for every event, the index of its category (events with index
+    outside [0, n_categories) are ignored), e.g. the output of np.digitize shifted by one.
+    Return an array of length n_categories.
+    """
+    arr = np.asarray(arr)
+    cat_index = np.asarray(cat_index)
+
+    # Sort by category first and by value inside each category
+    order = np.lexsort((arr, cat_index))
+    arr = arr[order]
+    cat_index = cat_index[order]
+    if weights is not None:
+        weights = np.asarray(weights)[order]
+
+    bounds = np.searchsorted(cat_index, np.arange(n_categories + 1), side="left")
+
+    sigmas = np.full(n_categories, np.nan)
+    for cat in range(n_categories):
+        start, stop = bounds[cat], bounds[cat + 1]
+        low, high = _narrowest_interval_sorted(
+                arr[start:stop],
+                weights[start:stop] if weights is not None else None,
+                fraction
+                )
+        sigmas[cat] = (high - low) / 2
+
+    return sigmas
+
+
+def _bootstrap_replicas(arr, weights, fraction, n_replicas, seed):
+    """Poisson bootstrap on an already sorted array: resampling is done by drawing a weight per
+    event, so the array never needs to be sorted again.
+    """
+    rng = np.random.default_rng(seed)
+    sigmas = np.empty(n_replicas)
+    for i in range(n_replicas):
+        replica_weights = rng.poisson(1., len(arr)).astype(float)
+        if weights is not None:
+            replica_weights *= weights
+        low, high = _narrowest_interval_sorted(arr, replica_weights, fraction)
+        sigmas[i] = (high - low) / 2
+
+    return sigmas
+
+
+def bootstrap_sigma_effective(arr, weights=None, fraction=0.683, n_bootstrap=100, n_workers=None, seed=0):
+    """Estimate the uncertainty on sigma_effective with n_bootstrap Poisson bootstrap replicas,
+    spread over n_workers processes (all the available cores by default).
+    Return the nominal value and the standard deviation of the replicas.
+    """
+    arr = np.asarray(arr)
+    order = np.argsort(arr, kind="stable")
+    arr = arr[order]
+    if weights is not None:
+        weights = np.asarray(weights)[order]
+
+    low, high = _narrowest_interval_sorted(arr, weights, fraction)
+    nominal = (high - low) / 2
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    n_workers = max(min(n_workers, n_bootstrap), 1)
+    replicas_per_worker = np.array_split(np.arange(n_bootstrap), n_workers)
+
+    # Independent streams for every worker, reproducible for a given seed
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+                executor.submit(_bootstrap_replicas, arr, weights, fraction, len(replicas), worker_seed)
+                for replicas, worker_seed in zip(replicas_per_worker, seeds)
+                ]
+        sigmas = np.concatenate([future.result() for future in futures])
+
+    return nominal, np.std(sigmas, ddof=1)
@@ -2,6 +2,8 @@ import argparse
 import numpy as np
 from rich.logging import RichHandler
 
+from .columnar_cache import default_cache_dir
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -49,6 +51,59 @@ def parse_arguments():
             required=True
             )
 
+    parser.add_argument(
+            "--cache-dir",
+            type=str,
+            default=default_cache_dir,
+            help="Directory where the needed branches of the input files are cached in columnar format"
+            )
+
+    parser.add_argument(
+            "--prune-cache",
+            action="store_true",
+            help="Remove the caches of outdated versions of the input files"
+            )
+
+    parser.add_argument(
+            "--binned",
+            action="store_true",
+            help="Perform binned fits instead of unbinned ones"
+            )
+
+    parser.add_argument(
+            "--validate-binned",
+            action="store_true",
+            help="Perform both binned and unbinned fits and compare parameters and fit times"
+            )
+
+    parser.add_argument(
+            "--seed-cache",
+            type=str,
+            default="fit_seeds.json",
+            help="JSON file where converged fit parameters are stored and read as starting values"
+            )
+
+    parser.add_argument(
+            "--n-bootstrap",
+            type=int,
+            default=0,
+            help="Number of bootstrap replicas used to compute uncertainties (0 to skip)"
+            )
+
+    parser.add_argument(
+            "--n-toys",
+            type=int,
+            default=0,
+            help="Number of toys used to cross-check the propagation of fit uncertainties (0 to skip)"
+            )
+
+    parser.add_argument(
+            "--n-workers",
+            type=int,
+            default=None,
+            help="Number of worker processes (default: all the available cores)"
+            )
+
     return parser.parse_args()
 
 
@@ -63,6 +118,26 @@ file_names_tmpl = {
 tree_name_tmpl = "diphotonDumper/trees/{}_125_13TeV_All_$SYST"
 
 
+def EBEB_mask(arr):
+    return np.maximum(abs(arr["lead_eta"]), abs(arr["sublead_eta"])) < 1.5
+
+def EBEE_mask(arr):
+    return np.logical_and(
+            np.minimum(abs(arr["lead_eta"]), abs(arr["sublead_eta"])) < 1.5,
+            np.maximum(abs(arr["lead_eta"]), abs(arr["sublead_eta"])) > 1.5
+            )
+
+def EEEE_mask(arr):
+    return np.maximum(abs(arr["lead_eta"]), abs(arr["sublead_eta"])) > 1.5
+
+
+subdetector_categories = {
+        "EBEB": EBEB_mask,
+        "EBEE": EBEE_mask,
+        "EEEE": EEEE_mask
+        }
+
+
 def rel_diff_asymm(a, b, a_uncs, b_uncs):
     """ Compute relative difference between two quantities with asymmetric uncertaintes.
     a and b are the two values, *_uncs are the uncertainties of value * in the format [low, up]